@@ -0,0 +1,559 @@
+import argparse
+import json
+import logging
+import random
+import re
+import threading
+import time
+import uuid
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+from xml.sax.saxutils import escape
+from typing import Any, Dict, List, Tuple, Union
+
+DEFAULT_INDEXES = ["history", "main", "summary", "lastchanceindex"]
+DEFAULT_ROLES = ["admin", "power", "user", "sc_admin"]
+
+ROLE_LIST_FIELDS = ["capabilities", "imported_roles", "srchIndexesAllowed", "srchIndexesDefault"]
+ROLE_INT_FIELDS = ["srchDiskQuota", "srchJobsQuota", "srchTimeWin"]
+
+SAML_KEYS = [
+    "entityId",
+    "fqdn",
+    "redirectPort",
+    "idpSSOUrl",
+    "idpSLOUrl",
+    "ssoBinding",
+    "sloBinding",
+    "attributeAliasMail",
+    "attributeAliasRealName",
+    "attributeAliasRole",
+    "scriptPath",
+    "useAuthExtForTokenAuthOnly",
+]
+
+ACS_PATH = re.compile(r"^/(?P<stack>[^/]+)/adminconfig/v2/(?P<path>.+?)/?$")
+REST_PATH = re.compile(r"^(?:/(?P<stack>[^/]+))?/services/(?P<path>.+?)/?$")
+SPLUNKBASE_LOGIN_PATH = "/api/account:login"
+
+Response = Tuple[int, Union[Dict[str, Any], List[Any], str]]
+
+
+class NotFound(Exception):
+    pass
+
+
+class MockSettings:
+    """
+    Behaviour of the mock server
+
+    :param latency: Seconds every response is delayed
+    :param jitter: Additional random delay of up to jitter seconds
+    :param throttle_rate: Share of requests answered with 429 Too Many Requests, between 0 and 1
+    :param retry_after: Seconds sent in the Retry-After header of throttled requests
+    :param max_page_size: The maximum number of items returned per page, None returns as many as requested
+    :param index_ready_delay: Seconds until a created index is returned by ACS
+    :param app_ready_delay: Seconds until an installed or updated app reports to be installed
+    :param deployment_delay: Seconds the stack deploys an allow list change, other changes are rejected meanwhile
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        throttle_rate: float = 0.0,
+        retry_after: float = 1.0,
+        max_page_size: Union[None, int] = None,
+        index_ready_delay: float = 0.0,
+        app_ready_delay: float = 0.0,
+        deployment_delay: float = 0.0,
+    ):
+        if not 0 <= throttle_rate <= 1:
+            raise ValueError("The throttle rate must be between 0 and 1")
+
+        self.latency = latency
+        self.jitter = jitter
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.max_page_size = max_page_size
+        self.index_ready_delay = index_ready_delay
+        self.app_ready_delay = app_ready_delay
+        self.deployment_delay = deployment_delay
+
+
+class StackState:
+    """
+    The objects of one stack, with the default objects of a new Splunk Cloud stack
+    """
+
+    def __init__(self):
+        self.allowlists: Dict[str, List[str]] = {}
+        # Time until which the last allow list change is deployed
+        self.deployed_at = 0.0
+        self.indexes: Dict[str, Dict[str, Any]] = {
+            name: {"name": name, "datatype": "event", "maxDataSizeMB": 0, "searchableDays": 90}
+            for name in DEFAULT_INDEXES
+        }
+        # Time from which each index is returned
+        self.index_ready: Dict[str, float] = {}
+        self.hec: Dict[str, Dict[str, Any]] = {}
+        self.apps: Dict[str, Dict[str, Any]] = {}
+        self.app_ready: Dict[str, float] = {}
+        self.roles: Dict[str, Dict[str, Any]] = {
+            name: {
+                "capabilities": [],
+                "defaultApp": "launcher",
+                "imported_roles": [],
+                "srchDiskQuota": 100,
+                "srchFilter": "",
+                "srchIndexesAllowed": ["*"],
+                "srchIndexesDefault": ["main"],
+                "srchJobsQuota": 3,
+                "srchTimeWin": 0,
+            }
+            for name in DEFAULT_ROLES
+        }
+        self.saml_groups: Dict[str, List[str]] = {}
+        self.saml: Union[None, Dict[str, Any]] = None
+
+
+def _page(items: List[Any], query: Dict[str, List[str]], max_page_size: Union[None, int]) -> Tuple[List[Any], int, int]:
+    offset = int(query.get("offset", ["0"])[0])
+    count = int(query.get("count", [str(len(items))])[0])
+    if count <= 0:
+        count = len(items)
+    if max_page_size is not None:
+        count = min(count, max_page_size)
+
+    return items[offset:offset + count], offset, count
+
+
+def _form_value(form: Dict[str, List[str]], key: str, default: str = "") -> str:
+    return form.get(key, [default])[0]
+
+
+class MockSplunkCloud:
+    """
+    In-memory stand-in for the ACS endpoints, the splunkd REST endpoints of the search head and the Splunkbase login
+    used by the features, for any number of stacks
+    """
+
+    def __init__(self, settings: Union[None, MockSettings] = None):
+        self.settings = settings or MockSettings()
+        self.stacks: Dict[str, StackState] = {}
+        self.sessions: set = set()
+        self.requests = 0
+        self.throttled = 0
+        self.statuses: Dict[int, int] = {}
+        self.lock = threading.Lock()
+
+    def stack(self, name: Union[None, str]) -> StackState:
+        name = name or "default"
+        if name not in self.stacks:
+            self.stacks[name] = StackState()
+
+        return self.stacks[name]
+
+    def reset_counters(self) -> None:
+        with self.lock:
+            self.requests = 0
+            self.throttled = 0
+            self.statuses = {}
+
+    def count(self, status: int) -> None:
+        with self.lock:
+            self.requests += 1
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            if status == 429:
+                self.throttled += 1
+
+    def should_throttle(self) -> bool:
+        return self.settings.throttle_rate > 0 and random.random() < self.settings.throttle_rate
+
+    def handle(self, method: str, url: str, headers: Dict[str, str], body: bytes) -> Response:
+        """
+        Handle a request against the in-memory state
+
+        :param method: The HTTP method
+        :param url: The path and query of the request
+        :param headers: The request headers with lower case names
+        :param body: The request body
+
+        :return: The status and the JSON or XML response
+        """
+        parts = urlsplit(url)
+        query = parse_qs(parts.query, keep_blank_values=True)
+
+        if parts.path == SPLUNKBASE_LOGIN_PATH and method == "POST":
+            token = uuid.uuid4().hex
+            with self.lock:
+                self.sessions.add(token)
+            return 200, f'<feed xmlns="http://www.w3.org/2005/Atom"><id>{token}</id></feed>'
+
+        if not headers.get("authorization", "").startswith("Bearer "):
+            return 401, {"code": "401-unauthorized", "message": "missing token"}
+
+        if "json" in headers.get("content-type", ""):
+            data = json.loads(body or b"{}")
+        else:
+            data = parse_qs(body.decode(), keep_blank_values=True)
+
+        with self.lock:
+            try:
+                match = ACS_PATH.match(parts.path)
+                if match:
+                    return self.handle_acs(
+                        method, self.stack(match["stack"]), match["path"], query, data, headers
+                    )
+
+                match = REST_PATH.match(parts.path)
+                if match:
+                    return self.handle_rest(method, self.stack(match["stack"]), match["path"], query, data)
+            except NotFound as error:
+                return 404, {"code": "404-object-not-found", "message": str(error)}
+
+        return 404, {"code": "404-not-found", "message": f"{method} {parts.path} is not mocked"}
+
+    def handle_acs(
+        self, method: str, stack: StackState, path: str, query: Dict[str, List[str]], data: Any, headers: Dict[str, str]
+    ) -> Response:
+        segments = path.split("/")
+
+        if segments == ["status"]:
+            status = "Ready" if stack.deployed_at <= time.monotonic() else "Updating"
+            return 200, {"infrastructure": {"stackType": "victoria", "status": status}, "messages": {}}
+
+        if len(segments) == 3 and segments[0] == "access" and segments[2] == "ipallowlists":
+            subnets = stack.allowlists.setdefault(segments[1], [])
+            if method in ("POST", "DELETE"):
+                if stack.deployed_at > time.monotonic():
+                    return 409, {"code": "409-conflict", "message": "another deployment is in progress"}
+                stack.deployed_at = time.monotonic() + self.settings.deployment_delay
+
+            if method == "POST":
+                subnets.extend(subnet for subnet in data.get("subnets", []) if subnet not in subnets)
+            elif method == "DELETE":
+                removed = set(data.get("subnets", []))
+                subnets[:] = [subnet for subnet in subnets if subnet not in removed]
+            return 200, {"subnets": list(subnets)}
+
+        if segments[0] == "indexes":
+            return self.handle_indexes(method, stack, segments[1:], query, data)
+
+        if segments[:2] == ["inputs", "http-event-collectors"]:
+            return self.handle_hec(method, stack, segments[2:], query, data)
+
+        if segments[:2] == ["apps", "victoria"]:
+            if method in ("POST", "PATCH") and headers.get("x-splunkbase-authorization") not in self.sessions:
+                return 401, {"code": "401-unauthorized", "message": "invalid Splunkbase session"}
+            return self.handle_apps(method, stack, segments[2:], data)
+
+        raise NotFound(path)
+
+    def handle_indexes(
+        self, method: str, stack: StackState, segments: List[str], query: Dict[str, List[str]], data: Any
+    ) -> Response:
+        now = time.monotonic()
+        visible = [name for name in stack.indexes if stack.index_ready.get(name, 0) <= now]
+
+        if not segments:
+            if method == "GET":
+                page, _, _ = _page(visible, query, self.settings.max_page_size)
+                return 200, [stack.indexes[name] for name in page]
+
+            if data["name"] in stack.indexes:
+                return 409, {"code": "409-conflict", "message": f"index {data['name']} exists"}
+
+            stack.indexes[data["name"]] = {"name": data["name"], **data}
+            stack.index_ready[data["name"]] = now + self.settings.index_ready_delay
+            return 202, stack.indexes[data["name"]]
+
+        name = segments[0]
+        if name not in visible:
+            raise NotFound(f"index {name}")
+
+        if method == "DELETE":
+            del stack.indexes[name]
+            return 202, {}
+
+        if method == "PATCH":
+            stack.indexes[name].update(data)
+            return 202, stack.indexes[name]
+
+        return 200, stack.indexes[name]
+
+    def handle_hec(
+        self, method: str, stack: StackState, segments: List[str], query: Dict[str, List[str]], data: Any
+    ) -> Response:
+        if not segments:
+            if method == "GET":
+                page, _, _ = _page(list(stack.hec.values()), query, self.settings.max_page_size)
+                return 200, {"http-event-collectors": page}
+
+            spec = {key: value for key, value in data.items() if key != "token"}
+            stack.hec[data["name"]] = {"token": data.get("token") or str(uuid.uuid4()), "spec": spec}
+            return 202, {"http-event-collector": stack.hec[data["name"]]}
+
+        name = segments[0]
+        if name not in stack.hec:
+            raise NotFound(f"HEC token {name}")
+
+        if method == "DELETE":
+            del stack.hec[name]
+            return 204, ""
+
+        if method == "PATCH":
+            stack.hec[name]["spec"].update(data)
+
+        return 200, {"http-event-collector": stack.hec[name]}
+
+    def handle_apps(self, method: str, stack: StackState, segments: List[str], data: Any) -> Response:
+        now = time.monotonic()
+
+        def describe(app_id: str) -> Dict[str, Any]:
+            status = "installed" if stack.app_ready.get(app_id, 0) <= now else "installing"
+            return {**stack.apps[app_id], "status": status}
+
+        if not segments:
+            if method == "GET":
+                return 200, {"apps": [describe(app_id) for app_id in stack.apps]}
+
+            splunkbase_id = _form_value(data, "splunkbaseID")
+            app_id = f"app_{splunkbase_id}"
+            stack.apps[app_id] = {"appID": app_id, "splunkbaseID": splunkbase_id, "version": _form_value(data, "version")}
+            stack.app_ready[app_id] = now + self.settings.app_ready_delay
+            return 202, describe(app_id)
+
+        app_id = segments[0]
+        if app_id not in stack.apps:
+            raise NotFound(f"app {app_id}")
+
+        if method == "DELETE":
+            del stack.apps[app_id]
+            return 202, {}
+
+        if method == "PATCH":
+            stack.apps[app_id]["version"] = _form_value(data, "version")
+            stack.app_ready[app_id] = now + self.settings.app_ready_delay
+            return 202, describe(app_id)
+
+        return 200, describe(app_id)
+
+    def handle_rest(
+        self, method: str, stack: StackState, path: str, query: Dict[str, List[str]], data: Dict[str, List[str]]
+    ) -> Response:
+        segments = path.split("/")
+
+        if segments[:2] == ["authorization", "roles"]:
+            return self.handle_collection(method, stack.roles, segments[2:], query, self.parse_role(data), data)
+
+        if segments[:2] == ["admin", "SAML-groups"]:
+            groups = {name: {"roles": roles} for name, roles in stack.saml_groups.items()}
+            status, response = self.handle_collection(
+                method, groups, segments[2:], query, {"roles": data.get("roles", [])}, data
+            )
+            stack.saml_groups = {name: content["roles"] for name, content in groups.items()}
+            return status, response
+
+        if segments[:3] == ["authentication", "providers", "SAML"]:
+            if method == "POST":
+                name = segments[3] if len(segments) > 3 else _form_value(data, "name")
+                if len(segments) > 3 and (stack.saml is None or stack.saml["name"] != name):
+                    raise NotFound(f"SAML provider {name}")
+                stack.saml = {"name": name, **{key: _form_value(data, key) for key in SAML_KEYS if key in data}}
+            return 200, self.saml_feed(stack.saml)
+
+        raise NotFound(path)
+
+    def parse_role(self, form: Dict[str, List[str]]) -> Dict[str, Any]:
+        # Like splunkd, a list field sent with an empty value is cleared
+        role: Dict[str, Any] = {field: [item for item in form.get(field, []) if item] for field in ROLE_LIST_FIELDS}
+        for field in ROLE_INT_FIELDS:
+            role[field] = int(_form_value(form, field, "0"))
+        role["defaultApp"] = _form_value(form, "defaultApp", "launcher")
+        role["srchFilter"] = _form_value(form, "srchFilter")
+        return role
+
+    def handle_collection(
+        self,
+        method: str,
+        entries: Dict[str, Dict[str, Any]],
+        segments: List[str],
+        query: Dict[str, List[str]],
+        content: Dict[str, Any],
+        form: Dict[str, List[str]],
+    ) -> Response:
+        """
+        Handle a splunkd collection endpoint with the JSON output mode and field filters
+        """
+        fields = query.get("f")
+
+        def entry(name: str) -> Dict[str, Any]:
+            values = entries[name]
+            if fields:
+                values = {key: value for key, value in values.items() if key in fields}
+            return {"name": name, "content": values}
+
+        if method == "GET" and not segments:
+            page, offset, count = _page(sorted(entries), query, self.settings.max_page_size)
+            return 200, {
+                "entry": [entry(name) for name in page],
+                "paging": {"total": len(entries), "perPage": count, "offset": offset},
+            }
+
+        if method == "POST" and not segments:
+            name = _form_value(form, "name")
+            if name in entries:
+                return 409, {"messages": [{"type": "ERROR", "text": f"{name} already exists"}]}
+            entries[name] = content
+            return 201, {"entry": [entry(name)]}
+
+        name = segments[0]
+        if name not in entries:
+            raise NotFound(name)
+
+        if method == "DELETE":
+            del entries[name]
+            return 200, {"entry": []}
+
+        if method == "POST":
+            # Like splunkd, an edit only changes the fields that are sent
+            entries[name] = {**entries[name], **{key: value for key, value in content.items() if key in form}}
+
+        return 200, {"entry": [entry(name)]}
+
+    @staticmethod
+    def saml_feed(saml: Union[None, Dict[str, Any]]) -> str:
+        namespaces = 'xmlns="http://www.w3.org/2005/Atom" xmlns:s="http://dev.splunk.com/ns/rest"'
+        if saml is None:
+            return f"<feed {namespaces}><title>SAML</title></feed>"
+
+        keys = "".join(
+            f'<s:key name="{key}">{escape(str(value))}</s:key>' for key, value in saml.items() if key != "name"
+        )
+        return (
+            f"<feed {namespaces}><title>SAML</title><entry><title>{escape(saml['name'])}</title>"
+            f'<content type="text/xml"><s:dict>{keys}</s:dict></content></entry></feed>'
+        )
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    mock: MockSplunkCloud
+
+    def log_message(self, format: str, *args: Any) -> None:
+        logging.debug("%s - %s", self.address_string(), format % args)
+
+    def _respond(self) -> None:
+        settings = self.mock.settings
+        body = self.rfile.read(int(self.headers.get("content-length") or 0))
+
+        delay = settings.latency + random.uniform(0, settings.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+        if self.path != SPLUNKBASE_LOGIN_PATH and self.mock.should_throttle():
+            status, response, headers = 429, {"code": "429-too-many-requests"}, {"Retry-After": f"{settings.retry_after:g}"}
+        else:
+            headers = {}
+            status, response = self.mock.handle(
+                self.command, self.path, {name.lower(): value for name, value in self.headers.items()}, body
+            )
+
+        self.mock.count(status)
+
+        if isinstance(response, str):
+            content, content_type = response.encode(), "text/xml; charset=utf-8"
+        else:
+            content, content_type = json.dumps(response).encode(), "application/json"
+
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(content)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    do_GET = _respond
+    do_POST = _respond
+    do_PATCH = _respond
+    do_PUT = _respond
+    do_DELETE = _respond
+
+
+class MockServer:
+    """
+    Runs the mock on a local port in a background thread
+
+    :param settings: The behaviour of the mock
+    :param host: The address to listen on
+    :param port: The port to listen on, 0 picks a free port
+    """
+
+    def __init__(self, settings: Union[None, MockSettings] = None, host: str = "127.0.0.1", port: int = 0):
+        self.mock = MockSplunkCloud(settings)
+        handler = type("BoundMockHandler", (MockHandler,), {"mock": self.mock})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name="mock-server", daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "MockServer":
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self) -> "MockServer":
+        return self.start()
+
+    def __exit__(self, *_) -> None:
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local mock of the ACS and splunkd endpoints used by the bootstrap")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", help="Seconds every response is delayed", type=float, default=0.0)
+    parser.add_argument("--jitter", help="Additional random delay of up to this many seconds", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", help="Share of requests answered with 429", type=float, default=0.0)
+    parser.add_argument("--retry-after", help="Retry-After of throttled requests in seconds", type=float, default=1.0)
+    parser.add_argument("--max-page-size", help="Maximum number of items per page", type=int, default=None)
+    parser.add_argument("--index-ready-delay", help="Seconds until a created index is returned", type=float, default=0.0)
+    parser.add_argument("--app-ready-delay", help="Seconds until an app is installed", type=float, default=0.0)
+    parser.add_argument("--deployment-delay", help="Seconds an allow list change is deployed", type=float, default=0.0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    settings = MockSettings(
+        latency=args.latency,
+        jitter=args.jitter,
+        throttle_rate=args.throttle_rate,
+        retry_after=args.retry_after,
+        max_page_size=args.max_page_size,
+        index_ready_delay=args.index_ready_delay,
+        app_ready_delay=args.app_ready_delay,
+        deployment_delay=args.deployment_delay,
+    )
+    server = MockServer(settings, host=args.host, port=args.port)
+    logging.info("Mock listening on %s - use it as acs_url (with a trailing slash) and as api_url", server.url)
+
+    try:
+        server.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,256 @@
+import argparse
+import csv
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+import yaml
+
+from typing import Any, Dict, List
+from mock_server import MockServer, MockSettings
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STACK_NAME = "bench"
+DEFAULT_SIZES = "10,1000,10000"
+SCENARIOS = ["initial", "noop"]
+
+
+def build_stack(size: int, api_url: str) -> Dict[str, Any]:
+    """
+    Build an environment with size objects per feature, every HEC token and role references an index
+
+    :param size: The number of objects per feature
+    :param api_url: The REST API URL of the mock
+
+    :return: The environment, as written to the environment file
+    """
+    indexes = [f"bench-{number:05d}" for number in range(size)]
+    subnets = [f"10.{number // 65536 % 256}.{number // 256 % 256}.{number % 256}/32" for number in range(size)]
+
+    return {
+        "stack_name": STACK_NAME,
+        "api_url": api_url,
+        "should_delete": True,
+        "allowlist": {feature: subnets for feature in ["search-ui", "search-api", "s2s", "hec"]},
+        "indexes": [{"name": name, "datatype": "event", "maxmb": 1024, "days_searchable": 30} for name in indexes],
+        "hec": [
+            {
+                "name": f"token-{number:05d}",
+                "token": str(uuid.UUID(int=number + 1)),
+                "default_index": indexes[number],
+                "allowed_indexes": [indexes[number]],
+            }
+            for number in range(size)
+        ],
+        "roles": [
+            {
+                "name": f"role-{number:05d}",
+                "imported_roles": ["user"],
+                "search_indexes_allowed": [indexes[number]],
+                "search_indexes_default": [indexes[number]],
+            }
+            for number in range(size)
+        ],
+        "saml": {
+            "name": "bench_saml",
+            "entity_id": "https://bench.example.com",
+            "fqdn": "https://bench.example.com",
+            "port": 443,
+            "cert": "bench",
+            "sso_url": "https://idp.example.com/saml2",
+            "slo_url": "https://idp.example.com/saml2",
+        },
+        "saml_role_mappings": [
+            {"group": f"group-{number:05d}", "roles": [f"role-{number:05d}"]} for number in range(size)
+        ],
+        "splunkbase_apps": [{"splunkbase_id": str(100000 + number), "version": "1.0.0"} for number in range(size)],
+    }
+
+
+def write_sources(stack: Dict[str, Any], directory: str) -> None:
+    """
+    Move the objects of the environment to source files, indexes and roles as CSV, HEC tokens and SAML groups as JSON lines
+
+    :param stack: The environment from build_stack, changed in place
+    :param directory: The directory for the source files
+
+    :return: None
+    """
+    stack["sources"] = {}
+    for section, extension in [("indexes", "csv"), ("roles", "csv"), ("hec", "jsonl"), ("saml_role_mappings", "jsonl")]:
+        objects = stack.pop(section)
+        path = os.path.join(directory, f"{section}.{extension}")
+        with open(path, "w", newline="") as file:
+            if extension == "jsonl":
+                file.writelines(json.dumps(obj) + "\n" for obj in objects)
+            else:
+                writer = csv.DictWriter(file, fieldnames=list(objects[0]))
+                writer.writeheader()
+                writer.writerows(
+                    {key: ";".join(value) if isinstance(value, list) else value for key, value in obj.items()}
+                    for obj in objects
+                )
+        stack["sources"][section] = [os.path.basename(path)]
+
+
+def build_config(server: MockServer, directory: str) -> Dict[str, Any]:
+    """
+    Build a configuration pointing at the mock, with limits that do not hide the cost of the tool itself
+
+    :param server: The running mock
+    :param directory: The directory for the state of the runs
+
+    :return: The configuration, as written to the config file
+    """
+    rate_limit = {"rate": 100000, "burst": 100000, "initial_concurrency": 32, "max_concurrency": 64}
+    tracking = {"initial_delay": 0.05, "max_delay": 0.5, "deadline": 600}
+
+    return {
+        "acs_url": server.url + "/",
+        "acs_rate_limit": rate_limit,
+        "api_rate_limit": rate_limit,
+        "pagination": {"page_size": 100, "concurrency": 8},
+        "max_in_flight": 32,
+        "cache": {"directory": os.path.join(directory, "snapshots"), "ttl": 0},
+        "splunkbase": {"login_url": server.url + "/api/account:login", "session_file": os.path.join(directory, "sessions.json")},
+        "secret_fingerprints": {"directory": os.path.join(directory, "fingerprints")},
+        "journal": {"directory": os.path.join(directory, "journal")},
+        "app_tracking": tracking,
+        "allowlist_tracking": tracking,
+        "index_tracking": tracking,
+    }
+
+
+def run_bootstrap(env_file: str, config_file: str, env: Dict[str, str]) -> Dict[str, Any]:
+    """
+    Run the bootstrap in a child process, so its peak memory is measured without the mock
+
+    :param env_file: The environment file
+    :param config_file: The config file
+    :param env: The environment of the child process
+
+    :return: The wall time, exit code and peak memory of the run
+    """
+    command = [sys.executable, os.path.join(ROOT, "bootstrap.py"), "--env-file", env_file, "--config-file", config_file, "--full"]
+
+    started = time.monotonic()
+    process = subprocess.Popen(command, env=env, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    stderr = process.stderr.read()
+    _, status, usage = os.wait4(process.pid, 0)
+    wall_time = time.monotonic() - started
+    process.returncode = os.waitstatus_to_exitcode(status)
+
+    if process.returncode != 0:
+        logging.error("Bootstrap failed:\n%s", stderr.decode(errors="replace")[-4000:])
+
+    return {
+        "wall_time": wall_time,
+        "exit_code": process.returncode,
+        # ru_maxrss is reported in kilobytes on Linux
+        "peak_memory_mb": usage.ru_maxrss / 1024,
+    }
+
+
+def run_size(size: int, settings: MockSettings, sources: bool = False) -> List[Dict[str, Any]]:
+    """
+    Bootstrap an empty mock stack with size objects per feature, then run again without changes
+
+    :param size: The number of objects per feature
+    :param settings: The behaviour of the mock
+    :param sources: Whether to read the objects from source files instead of the environment file
+
+    :return: The result of each scenario
+    """
+    results = []
+
+    with MockServer(settings) as server, tempfile.TemporaryDirectory(prefix="sc-bootstrap-bench-") as directory:
+        env_file = os.path.join(directory, "env.yaml")
+        config_file = os.path.join(directory, "config.yaml")
+        stack = build_stack(size, api_url=f"{server.url}/{STACK_NAME}")
+        if sources:
+            write_sources(stack, directory)
+        with open(env_file, "w") as file:
+            yaml.safe_dump(stack, file)
+        with open(config_file, "w") as file:
+            yaml.safe_dump(build_config(server, directory), file)
+
+        env = {
+            **os.environ,
+            f"{STACK_NAME.upper()}_TOKEN": "bench-token",
+            f"{STACK_NAME.upper()}_USERNAME": "bench",
+            f"{STACK_NAME.upper()}_PASSWORD": "bench",
+            "FINGERPRINT_KEY": "bench",
+        }
+
+        for scenario in SCENARIOS:
+            server.mock.reset_counters()
+            result = run_bootstrap(env_file, config_file, env)
+            result.update(
+                size=size,
+                scenario=scenario,
+                requests=server.mock.requests,
+                throttled=server.mock.throttled,
+            )
+            logging.info(
+                "%d objects, %s run: %.2fs, %d requests, %.0f MB peak memory",
+                size,
+                scenario,
+                result["wall_time"],
+                result["requests"],
+                result["peak_memory_mb"],
+            )
+            results.append(result)
+
+    return results
+
+
+def print_results(results: List[Dict[str, Any]]) -> None:
+    print(f"{'OBJECTS':>8}  {'SCENARIO':<8}  {'WALL TIME':>10}  {'REQUESTS':>9}  {'THROTTLED':>9}  {'PEAK MEMORY':>11}  STATUS")
+    for result in results:
+        status = "ok" if result["exit_code"] == 0 else f"exit {result['exit_code']}"
+        print(
+            f"{result['size']:>8}  {result['scenario']:<8}  {result['wall_time']:>9.2f}s  {result['requests']:>9}  "
+            f"{result['throttled']:>9}  {result['peak_memory_mb']:>8.0f} MB  {status}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the bootstrap against a local mock of Splunk Cloud")
+    parser.add_argument("--sizes", help="Comma separated numbers of objects per feature", default=DEFAULT_SIZES)
+    parser.add_argument("--latency", help="Seconds every response of the mock is delayed", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", help="Share of requests answered with 429", type=float, default=0.0)
+    parser.add_argument("--max-page-size", help="Maximum number of items per page of the mock", type=int, default=None)
+    parser.add_argument("--deployment-delay", help="Seconds the mock deploys each allow list change", type=float, default=0.0)
+    parser.add_argument("--sources", help="Read the objects from CSV and JSON lines source files", action="store_true")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    settings = MockSettings(
+        latency=args.latency,
+        throttle_rate=args.throttle_rate,
+        retry_after=0.1,
+        max_page_size=args.max_page_size,
+        deployment_delay=args.deployment_delay,
+    )
+
+    results = []
+    for size in [int(size) for size in args.sizes.split(",")]:
+        results.extend(run_size(size, settings, sources=args.sources))
+
+    print_results(results)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+    if any(result["exit_code"] != 0 for result in results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
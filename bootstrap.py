@@ -5,65 +5,185 @@ import os
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), "src"))
 
-from pydantic import ValidationError
-from models import StackConfiguration, Config
+from typing import List
+from models import CassetteMode, Config
 from utilities import load_yaml_to_model
-from client import Client
-
-from features.allowlist import set_allowlist
-from features.hec import set_hec
-from features.index import set_indexes
-from features.saml import set_saml
-from features.role import set_roles
-from features.samlrole import set_saml_mapping
-from features.splunkbase_apps import set_splunkbase_apps
+from runner import apply_stack_plan, bootstrap_stack, get_fingerprints, plan_stack
+from incremental import get_unchanged_features, record_results
+from metrics import write_reports
+from cassette import close_cassettes
+from journal import open_journal
+from scheduler import DEFAULT_WORKERS
+from plan import DEFAULT_MAX_PLAN_AGE, PLAN_FILE_EXTENSIONS, get_plan_path, log_plan_summary, write_plan
+from fleet import (
+    DEFAULT_MAX_FEATURES,
+    DEFAULT_MAX_STACKS,
+    FleetStack,
+    StackResult,
+    find_env_files,
+    load_fleet,
+    load_plans,
+    print_summary,
+    run_fleet,
+)
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+def load_stacks(args: argparse.Namespace, config: Config) -> List[FleetStack]:
+    if args.command == "apply":
+        plan_files = [args.plan_file] if args.plan_file else find_env_files(args.fleet, extensions=PLAN_FILE_EXTENSIONS)
+        stacks, errors = load_plans(plan_files, config, max_age=args.max_plan_age)
+    else:
+        env_files = [args.env_file] if args.env_file else find_env_files(args.fleet)
+        for env_file in env_files:
+            if not os.path.exists(env_file):
+                logging.error("File not found: %s", env_file)
+                sys.exit(1)
+        stacks, errors = load_fleet(env_files, config)
+
+    if errors:
+        for error in errors:
+            logging.error(error)
+        sys.exit(1)
+
+    if not stacks:
+        logging.error("No stacks found for %s", args.fleet)
+        sys.exit(1)
+
+    logging.info("Read config and %d stack configurations", len(stacks))
+    return stacks
+
+def run_stacks(args: argparse.Namespace, config: Config, stacks: List[FleetStack]) -> List[StackResult]:
+    def run(stack: FleetStack, max_workers, gate):
+        stack_name = stack.stack_config.stack_name
+        fingerprints = get_fingerprints(stack.stack_config, config)
+        unchanged, full = get_unchanged_features(stack_name, fingerprints, config, full=args.full)
+        journal = open_journal(config.journal, stack_name, fingerprints, resume=args.resume)
+        try:
+            results = bootstrap_stack(
+                stack_config=stack.stack_config,
+                config=config,
+                acs_client=stack.acs_client,
+                api_client=stack.api_client,
+                max_workers=max_workers,
+                gate=gate,
+                unchanged=unchanged,
+                journal=journal,
+            )
+        finally:
+            if journal is not None:
+                journal.close()
+        record_results(stack_name, fingerprints, results, config, full=full)
+        return results
+
+    def plan(stack: FleetStack, max_workers, gate):
+        fingerprints = get_fingerprints(stack.stack_config, config)
+        unchanged, full = get_unchanged_features(stack.stack_config.stack_name, fingerprints, config, full=args.full)
+        stack_plan, results = plan_stack(
+            stack_config=stack.stack_config,
+            config=config,
+            acs_client=stack.acs_client,
+            api_client=stack.api_client,
+            max_workers=max_workers,
+            gate=gate,
+            unchanged=unchanged,
+            full=full,
+        )
+        if stack_plan:
+            path = get_plan_path(args.plan_dir, stack_plan.stack_name)
+            write_plan(stack_plan, path)
+            log_plan_summary(stack_plan)
+            logging.info("Wrote plan for %s to %s", stack_plan.stack_name, path)
+        return results
+
+    def apply(stack: FleetStack, max_workers, gate):
+        journal = open_journal(config.journal, stack.plan.stack_name, stack.plan.fingerprints, resume=args.resume)
+        try:
+            results = apply_stack_plan(
+                plan=stack.plan,
+                config=config,
+                acs_client=stack.acs_client,
+                api_client=stack.api_client,
+                max_workers=max_workers,
+                gate=gate,
+                journal=journal,
+            )
+        finally:
+            if journal is not None:
+                journal.close()
+        record_results(stack.plan.stack_name, stack.plan.fingerprints, results, config, full=stack.plan.full)
+        return results
+
+    commands = {"run": run, "plan": plan, "apply": apply}
+    return run_fleet(
+        stacks,
+        commands[args.command],
+        max_stacks=args.max_stacks,
+        max_workers=args.workers,
+        max_features=args.max_features,
+    )
 
 def main():
     parser = argparse.ArgumentParser(description='Bootstrap a new Splunk Cloud instance')
-    parser.add_argument('--env-file', help='Path to the environment file', required=True)
+    parser.add_argument('command', help='run: plan and apply directly, plan: only write plans, apply: apply written plans', nargs='?', choices=['run', 'plan', 'apply'], default='run')
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument('--env-file', help='Path to the environment file')
+    target.add_argument('--fleet', help='Directory or glob pattern of environment files (or plan files for apply) to process in parallel')
+    target.add_argument('--plan-file', help='Path to the plan file to apply')
     parser.add_argument('--config-file', help='Path to the config file', required=False, default='config.yaml')
+    parser.add_argument('--plan-dir', help='Directory the plan command writes the plans to', default='plans')
+    parser.add_argument('--max-plan-age', help='Maximum age of a plan in seconds to still apply it', type=float, default=DEFAULT_MAX_PLAN_AGE)
+    parser.add_argument('--full', help='Reconcile all features, also those whose configuration did not change since the last apply', action='store_true')
+    parser.add_argument('--resume', help='Continue the last unfinished run or apply of each stack from its journal', action='store_true')
+    parser.add_argument('--no-cache', help='Always fetch the remote state instead of using cached snapshots', action='store_true')
+    cassette = parser.add_mutually_exclusive_group()
+    cassette.add_argument('--record', help='Record all requests and responses, with secrets redacted, to this cassette file', metavar='CASSETTE')
+    cassette.add_argument('--replay', help='Answer all requests from this cassette file without network access', metavar='CASSETTE')
+    parser.add_argument('--workers', help='Maximum number of features to run concurrently per stack', type=int, default=DEFAULT_WORKERS)
+    parser.add_argument('--max-stacks', help='Maximum number of stacks to process concurrently in fleet mode', type=int, default=DEFAULT_MAX_STACKS)
+    parser.add_argument('--max-features', help='Maximum number of features to run concurrently across all stacks in fleet mode', type=int, default=DEFAULT_MAX_FEATURES)
     args = parser.parse_args()
 
-    try:
-        config: Config = load_yaml_to_model(args.config_file, Config)
-        stack_config: StackConfiguration = load_yaml_to_model(args.env_file, StackConfiguration)
-        acs_client = Client(stack_name=stack_config.stack_name, proxy=config.proxy, is_stage=stack_config.is_stage)
-        api_client = Client(stack_name=stack_config.stack_name, proxy=config.proxy, is_stage=stack_config.is_stage, is_acs=False, api_url=stack_config.api_url)
-        logging.info("Read config and stack configuration")
-    except FileNotFoundError as e:
-        logging.error("File not found: %s", e)
-        sys.exit(1)
-    except ValidationError as e:
-        for error in e.errors():
-            logging.error(error["msg"].replace("Value error, ", ""))
+    if args.command == "apply" and args.env_file:
+        parser.error("apply reads the stacks from plans, use --plan-file or --fleet")
+    if args.command != "apply" and args.plan_file:
+        parser.error(f"{args.command} reads environment files, use --env-file or --fleet")
+    if args.command == "plan" and args.resume:
+        parser.error("plan does not change the stacks, --resume only applies to run and apply")
+    if not (args.env_file or args.fleet or args.plan_file):
+        parser.error("one of the arguments --env-file --fleet --plan-file is required")
+
+    config: Config = load_yaml_to_model(args.config_file, Config)
+    if args.no_cache:
+        config.cache.ttl = 0
+    if args.record or args.replay:
+        config.cassette.mode = CassetteMode.RECORD if args.record else CassetteMode.REPLAY
+        config.cassette.path = args.record or args.replay
+    stacks = load_stacks(args, config)
+
+    if args.fleet:
+        # Interleaved output of concurrent stacks is only readable with the stack name on each line
+        for handler in logging.getLogger().handlers:
+            handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - [%(threadName)s] %(message)s'))
+
+    results = run_stacks(args, config, stacks)
+    write_reports(config.metrics)
+    close_cassettes()
+
+    if args.fleet:
+        print_summary(results)
+    else:
+        for result in results:
+            if result.error:
+                logging.error("Stack %s failed: %s", result.stack_name, result.error)
+            for name, error in result.errors.items():
+                logging.error("Feature %s did not succeed: %s", name, error)
+
+    if not all(result.ok for result in results):
         sys.exit(1)
 
-    logging.info('Bootstrapping environment: %s', stack_config.stack_name)
-
-    logging.info("Setting allowlist")
-    set_allowlist(client=acs_client, stack_config=stack_config)
-
-    logging.info("Setting indexes")
-    set_indexes(stack_config=stack_config, client=acs_client)
-
-    logging.info("Setting HEC")
-    set_hec(stack_config=stack_config, client=acs_client)
-
-    logging.info("Setting SAML")
-    set_saml(stack_config=stack_config, client=api_client)
-
-    logging.info("Setting Splunkbase apps")
-    set_splunkbase_apps(stack_config=stack_config, client=acs_client)
-
-    logging.info("Setting roles")
-    set_roles(stack_config=stack_config, client=api_client)
-
-    logging.info("Setting SAML role mappings")
-    set_saml_mapping(stack_config=stack_config, client=api_client)
-
-    logging.info("Bootstrap complete")
+    logging.info("%s complete", {"run": "Bootstrap", "plan": "Plan", "apply": "Apply"}[args.command])
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,157 @@
+import json
+import logging
+import os
+import threading
+import time
+
+from pydantic import TypeAdapter, ValidationError
+from typing import Any, Callable, Tuple, Type, TypeVar
+from metrics import get_recorder
+from models import Config
+
+SNAPSHOT_VERSION = 1
+
+T = TypeVar("T")
+
+
+class SnapshotCache:
+    """
+    On-disk cache of the remote state of each feature, keyed by stack and feature
+    Snapshots older than ttl seconds are ignored, and a ttl of 0 disables reading and writing snapshots
+    """
+
+    def __init__(self, directory: str, ttl: float):
+        self.directory = directory
+        self.ttl = ttl
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    def get_path(self, stack_name: str, feature: str) -> str:
+        """
+        Get the path of the snapshot of a feature
+
+        :param stack_name: The name of the stack
+        :param feature: The name of the feature
+
+        :return: The path of the snapshot file
+        """
+        return os.path.join(self.directory, stack_name, f"{feature}.json")
+
+    def load(self, stack_name: str, feature: str, state_type: Type[T]) -> Tuple[bool, Any]:
+        """
+        Load the snapshot of a feature if it exists and is not older than the TTL
+
+        :param stack_name: The name of the stack
+        :param feature: The name of the feature
+        :param state_type: The type of the cached state
+
+        :return: A tuple of whether the snapshot was usable and the cached state
+        """
+        path = self.get_path(stack_name=stack_name, feature=feature)
+        try:
+            with open(path, "r") as file:
+                snapshot = json.load(file)
+        except FileNotFoundError:
+            return False, None
+        except (OSError, ValueError) as error:
+            logging.warning("Ignoring unreadable snapshot %s: %s", path, error)
+            return False, None
+
+        age = time.time() - snapshot.get("fetched_at", 0)
+        if snapshot.get("version") != SNAPSHOT_VERSION or age > self.ttl or age < 0:
+            return False, None
+
+        try:
+            state = TypeAdapter(state_type).validate_python(snapshot.get("state"))
+        except ValidationError as error:
+            logging.warning("Ignoring invalid snapshot %s: %s", path, error)
+            return False, None
+
+        logging.info("Using %s state of %s cached %.0fs ago", feature, stack_name, age)
+        return True, state
+
+    def store(self, stack_name: str, feature: str, state_type: Type[T], state: T) -> None:
+        """
+        Write the snapshot of a feature
+        Snapshots contain HEC tokens, so they are only readable by the owner
+
+        :param stack_name: The name of the stack
+        :param feature: The name of the feature
+        :param state_type: The type of the cached state
+        :param state: The state to cache
+
+        :return: None
+        """
+        path = self.get_path(stack_name=stack_name, feature=feature)
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+
+        snapshot = {
+            "version": SNAPSHOT_VERSION,
+            "fetched_at": time.time(),
+            "state": TypeAdapter(state_type).dump_python(state, mode="json", by_alias=True),
+        }
+
+        # Write to a temporary file first so concurrent readers never see a partial snapshot
+        temporary_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        fd = os.open(temporary_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as file:
+            json.dump(snapshot, file, separators=(",", ":"))
+        os.replace(temporary_path, path)
+
+    def invalidate(self, stack_name: str, feature: str) -> None:
+        """
+        Remove the snapshot of a feature, also when the cache is disabled so no outdated snapshot survives
+
+        :param stack_name: The name of the stack
+        :param feature: The name of the feature
+
+        :return: None
+        """
+        try:
+            os.remove(self.get_path(stack_name=stack_name, feature=feature))
+            logging.debug("Invalidated %s state of %s", feature, stack_name)
+        except FileNotFoundError:
+            pass
+
+    def fetch(self, stack_name: str, feature: str, state_type: Type[T], fetch: Callable[[], T]) -> T:
+        """
+        Get the state of a feature from its snapshot, or fetch and cache it if there is no usable snapshot
+
+        :param stack_name: The name of the stack
+        :param feature: The name of the feature
+        :param state_type: The type of the state
+        :param fetch: Fetches the state from the stack
+
+        :return: The state of the feature
+        """
+        with get_recorder().timed(stack_name=stack_name, feature=feature, phase="read"):
+            return self.__fetch(stack_name=stack_name, feature=feature, state_type=state_type, fetch=fetch)
+
+    def __fetch(self, stack_name: str, feature: str, state_type: Type[T], fetch: Callable[[], T]) -> T:
+        if not self.enabled:
+            return fetch()
+
+        found, state = self.load(stack_name=stack_name, feature=feature, state_type=state_type)
+        if found:
+            return state
+
+        state = fetch()
+        try:
+            self.store(stack_name=stack_name, feature=feature, state_type=state_type, state=state)
+        except OSError as error:
+            logging.warning("Could not cache %s state of %s: %s", feature, stack_name, error)
+
+        return state
+
+
+def get_snapshot_cache(config: Config) -> SnapshotCache:
+    """
+    Get the snapshot cache configured in the global configuration
+
+    :param config: The global configuration
+
+    :return: The snapshot cache
+    """
+    return SnapshotCache(directory=config.cache.directory, ttl=config.cache.ttl)
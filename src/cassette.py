@@ -0,0 +1,346 @@
+import gzip
+import hashlib
+import hmac
+import httpx
+import json
+import logging
+import os
+import re
+import threading
+
+from collections import deque
+from urllib.parse import parse_qsl, urlencode
+from xml.sax.saxutils import escape
+from typing import IO, Any, Deque, Dict, Iterable, List, Tuple, Union
+from models import Cassette, CassetteMode, SecretFingerprints
+from secret_fingerprint import get_fingerprint_key
+
+REDACTED = "REDACTED"
+PLACEHOLDER_PATTERN = re.compile(rf"{REDACTED}:[0-9a-f]{{16}}")
+CASSETTE_VERSION = 1
+# Only the headers the client reads are kept, all others are left out to keep the cassette small and free of cookies
+RESPONSE_HEADERS = ["content-type", "retry-after"]
+
+_CASSETTES: Dict[Tuple[str, str], "CassetteFile"] = {}
+_CASSETTES_LOCK = threading.Lock()
+
+
+class CassetteError(Exception):
+    """
+    Raised in replay mode for a request that is not in the cassette
+    """
+
+
+def get_placeholder(value: Any, key: bytes) -> str:
+    """
+    Get the placeholder written instead of a redacted value
+    The placeholder is a keyed hash, so equal values get equal placeholders without revealing them
+
+    :param value: The redacted value
+    :param key: The key of the secret fingerprints
+
+    :return: The placeholder
+    """
+    digest = hmac.new(key, str(value).encode(), hashlib.sha256).hexdigest()
+    return f"{REDACTED}:{digest[:16]}"
+
+
+def redact_value(value: Any, fields: List[str], key: bytes) -> Any:
+    """
+    Replace the values of the redacted fields in a decoded JSON document
+
+    :param value: The JSON document
+    :param fields: The names of the fields to redact
+    :param key: The key of the secret fingerprints
+
+    :return: The redacted document
+    """
+    if isinstance(value, dict):
+        return {
+            name: get_placeholder(item, key) if name in fields else redact_value(item, fields, key)
+            for name, item in value.items()
+        }
+
+    if isinstance(value, list):
+        return [redact_value(item, fields, key) for item in value]
+
+    return value
+
+
+def restore_value(value: Any, secrets: Dict[str, str]) -> Any:
+    """
+    Replace the placeholders of known secrets in a decoded JSON document with their values
+
+    :param value: The JSON document
+    :param secrets: The known secrets by placeholder
+
+    :return: The restored document
+    """
+    if isinstance(value, dict):
+        return {name: restore_value(item, secrets) for name, item in value.items()}
+
+    if isinstance(value, list):
+        return [restore_value(item, secrets) for item in value]
+
+    if isinstance(value, str):
+        return secrets.get(value, value)
+
+    return value
+
+
+def redact_body(content: bytes, content_type: str, fields: List[str], key: bytes) -> str:
+    """
+    Redact a JSON, form or XML body
+
+    :param content: The body
+    :param content_type: The content type of the body
+    :param fields: The names of the fields to redact
+    :param key: The key of the secret fingerprints
+
+    :return: The redacted body as text
+    """
+    text = content.decode(errors="replace")
+    if not text:
+        return text
+
+    if "json" in content_type:
+        try:
+            return json.dumps(redact_value(json.loads(text), fields, key), separators=(",", ":"))
+        except ValueError:
+            return text
+
+    if "x-www-form-urlencoded" in content_type:
+        pairs = parse_qsl(text, keep_blank_values=True)
+        return urlencode([(name, get_placeholder(value, key) if name in fields else value) for name, value in pairs])
+
+    def replace(match: re.Match) -> str:
+        return match[1] + get_placeholder(match[2], key) + match[3]
+
+    for field in fields:
+        name = re.escape(field)
+        # Atom elements like the Splunkbase session id and the s:key entries of splunkd
+        text = re.sub(rf"(<{name}>)([^<]*)(</{name}>)", replace, text)
+        text = re.sub(rf'(<s:key name="{name}">)([^<]*)(</s:key>)', replace, text)
+
+    return text
+
+
+def restore_body(text: str, content_type: str, secrets: Dict[str, str]) -> str:
+    """
+    Replace the placeholders of known secrets in a recorded response body with their values,
+    so a replayed response matches the recorded one where the secret did not change
+
+    :param text: The recorded body
+    :param content_type: The content type of the body
+    :param secrets: The known secrets by placeholder
+
+    :return: The restored body
+    """
+    if not secrets or REDACTED not in text:
+        return text
+
+    if "json" in content_type:
+        try:
+            return json.dumps(restore_value(json.loads(text), secrets), separators=(",", ":"))
+        except ValueError:
+            return text
+
+    return PLACEHOLDER_PATTERN.sub(lambda match: escape(secrets.get(match[0], match[0])), text)
+
+
+class CassetteFile:
+    """
+    The recorded interactions of a run, written one JSON line per request as they happen
+    In replay mode, each request is answered with the next recorded response of the same method, URL and body
+    The last response of a request is repeated, so polling always ends
+    Redacted values are written as keyed placeholders. In replay mode, the placeholders of the secrets
+    added with add_secrets are replaced with their values, other placeholders are kept
+    """
+
+    def __init__(self, config: Cassette, key: bytes):
+        self.config = config
+        self.key = key
+        self._secrets: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._file: Union[None, IO[str]] = None
+        self._interactions: Dict[Tuple[str, str, str], Deque[Dict[str, Any]]] = {}
+        self._by_url: Dict[Tuple[str, str], Deque[Dict[str, Any]]] = {}
+
+        if config.mode == CassetteMode.REPLAY:
+            self._load()
+
+    def _open(self, mode: str) -> IO[str]:
+        if self.config.path.endswith(".gz"):
+            return gzip.open(self.config.path, mode + "t")
+
+        return open(self.config.path, mode)
+
+    def _load(self) -> None:
+        with self._open("r") as file:
+            header = json.loads(file.readline() or "{}")
+            if header.get("version") != CASSETTE_VERSION:
+                raise CassetteError(f"Unsupported cassette {self.config.path}")
+
+            count = 0
+            for line in file:
+                interaction = json.loads(line)
+                key = (interaction["method"], interaction["url"], interaction["body_digest"])
+                self._interactions.setdefault(key, deque()).append(interaction)
+                self._by_url.setdefault(key[:2], deque()).append(interaction)
+                count += 1
+
+        logging.info("Replaying %d recorded requests from %s", count, self.config.path)
+
+    def add_secrets(self, values: Iterable[str]) -> None:
+        """
+        Add secrets of the desired configuration, e.g. HEC tokens, to restore from their placeholders on replay
+
+        :param values: The secrets
+
+        :return: None
+        """
+        secrets = {get_placeholder(value, self.key): value for value in values}
+        with self._lock:
+            self._secrets.update(secrets)
+
+    def digest(self, request: httpx.Request) -> str:
+        """
+        Digest of the redacted request body, so requests match without the secrets being written to the cassette
+        """
+        content_type = request.headers.get("content-type", "")
+        body = redact_body(request.content, content_type, self.config.redact_fields, self.key)
+        return hashlib.sha256(body.encode()).hexdigest()[:16]
+
+    def record(self, request: httpx.Request, response: httpx.Response, content: bytes) -> None:
+        """
+        Append a request with its response to the cassette
+
+        :param request: The sent request
+        :param response: The received response
+        :param content: The decoded body of the response
+
+        :return: None
+        """
+        content_type = response.headers.get("content-type", "")
+        interaction = {
+            "method": request.method,
+            "url": str(request.url),
+            "body_digest": self.digest(request),
+            "status": response.status_code,
+            "headers": {name: response.headers[name] for name in RESPONSE_HEADERS if name in response.headers},
+            "body": redact_body(content, content_type, self.config.redact_fields, self.key),
+        }
+
+        with self._lock:
+            if self._file is None:
+                directory = os.path.dirname(self.config.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                self._file = self._open("w")
+                self._file.write(json.dumps({"version": CASSETTE_VERSION}) + "\n")
+
+            self._file.write(json.dumps(interaction, separators=(",", ":")) + "\n")
+            self._file.flush()
+
+    def replay(self, request: httpx.Request) -> httpx.Response:
+        """
+        Get the recorded response of a request
+
+        :param request: The request to answer
+
+        :return: The recorded response
+        """
+        key = (request.method, str(request.url), self.digest(request))
+
+        with self._lock:
+            # Fall back to any request of the same method and URL, e.g. if the body contains a timestamp
+            recorded = self._interactions.get(key) or self._by_url.get(key[:2])
+            if not recorded:
+                raise CassetteError(f"{request.method} {request.url} is not in the cassette {self.config.path}")
+
+            interaction = recorded.popleft() if len(recorded) > 1 else recorded[0]
+            secrets = self._secrets
+
+        content_type = interaction["headers"].get("content-type", "")
+        return httpx.Response(
+            interaction["status"],
+            headers=interaction["headers"],
+            content=restore_body(interaction["body"], content_type, secrets).encode(),
+            request=request,
+        )
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class RecordingTransport(httpx.AsyncBaseTransport):
+    """
+    Sends the requests with the wrapped transport and records every response
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, cassette: CassetteFile):
+        self.transport = transport
+        self.cassette = cassette
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        response = await self.transport.handle_async_request(request)
+        response.request = request
+        try:
+            content = await response.aread()
+        finally:
+            await response.aclose()
+
+        self.cassette.record(request, response, content)
+
+        # The content is already decoded, so the encoding headers of the original response no longer apply
+        headers = [(name, value) for name, value in response.headers.items() if name not in ("content-encoding", "content-length")]
+        return httpx.Response(response.status_code, headers=headers, content=content, request=request)
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+
+class ReplayTransport(httpx.AsyncBaseTransport):
+    """
+    Answers every request from the cassette without any network access
+    """
+
+    def __init__(self, cassette: CassetteFile):
+        self.cassette = cassette
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        return self.cassette.replay(request)
+
+
+def get_cassette(config: Cassette, fingerprints: SecretFingerprints) -> Union[None, CassetteFile]:
+    """
+    Get the cassette of the process for a given configuration
+
+    :param config: The cassette configuration
+    :param fingerprints: The secret fingerprint configuration, whose key is used for the placeholders
+
+    :return: The cassette or None if requests are neither recorded nor replayed
+    """
+    if config.mode == CassetteMode.OFF:
+        return None
+
+    with _CASSETTES_LOCK:
+        key = (config.mode.value, config.path)
+        if key not in _CASSETTES:
+            _CASSETTES[key] = CassetteFile(config, get_fingerprint_key(fingerprints))
+
+        return _CASSETTES[key]
+
+
+def close_cassettes() -> None:
+    """
+    Close all cassettes that are recorded, so compressed cassettes are complete
+
+    :return: None
+    """
+    with _CASSETTES_LOCK:
+        for cassette in _CASSETTES.values():
+            cassette.close()
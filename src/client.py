@@ -1,18 +1,151 @@
+import asyncio
+import atexit
 import os
-import requests
+import httpx
 import logging
+import threading
+import time
 
-import xml.etree.ElementTree as ET
-from typing import Any, Dict, Tuple, Union, List
-from models import Proxy
+from urllib.parse import urlencode
+from typing import Any, Awaitable, Dict, Iterable, Tuple, Union, List
+from models import CassetteMode, Proxy, RateLimit, Splunkbase
+from cassette import CassetteFile, RecordingTransport, ReplayTransport
+from metrics import get_recorder
+from ratelimit import IDEMPOTENT_METHODS, RateLimiter, backoff_delay, parse_retry_after, should_retry
+from splunkbase import get_session_cache, login
 
 BASE_URLS = {
     "prod": "https://admin.splunk.com/",
     "stage": "https://staging.admin.splunk.com/",
 }
 
+DEFAULT_TIMEOUT = 120.0
+DEFAULT_MAX_CONNECTIONS = 32
+SPLUNKBASE_HEADER = "X-Splunkbase-Authorization"
 
-class Client:
+_POOLS: Dict[Tuple[asyncio.AbstractEventLoop, str], httpx.AsyncClient] = {}
+_LOOP: Union[None, asyncio.AbstractEventLoop] = None
+_LOOP_LOCK = threading.Lock()
+
+
+def get_proxy_url(proxy: Proxy, scheme: str) -> Union[None, str]:
+    """
+    Get the proxy URL for a given scheme
+
+    :param proxy: The proxy configuration
+    :param scheme: The scheme of the proxied requests (http or https)
+
+    :return: The proxy URL or None if no proxy is used
+    """
+    if not proxy.used or not proxy.url:
+        return None
+
+    if proxy.username and proxy.password:
+        return f"{scheme}://{proxy.username}:{proxy.password}@{proxy.url}"
+
+    return str(proxy.url)
+
+
+def get_pool(
+    proxy: Proxy, max_connections: int = DEFAULT_MAX_CONNECTIONS, cassette: Union[None, CassetteFile] = None
+) -> httpx.AsyncClient:
+    """
+    Get the connection pool shared by all clients with the same proxy and cassette on the running event loop
+
+    :param proxy: The proxy configuration
+    :param max_connections: The maximum number of connections of a newly created pool
+    :param cassette: The cassette to record the requests to or to replay them from
+
+    :return: The connection pool
+    """
+    loop = asyncio.get_running_loop()
+    key = (loop, f"{get_proxy_url(proxy, 'http')}|{get_proxy_url(proxy, 'https')}|{id(cassette)}")
+
+    if key not in _POOLS:
+        limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+
+        def transport(proxy_url: Union[None, str] = None) -> httpx.AsyncBaseTransport:
+            if cassette is None or cassette.config.mode == CassetteMode.RECORD:
+                sender = httpx.AsyncHTTPTransport(proxy=proxy_url, limits=limits)
+                return sender if cassette is None else RecordingTransport(sender, cassette)
+
+            return ReplayTransport(cassette)
+
+        mounts = {}
+        for scheme in ("http", "https"):
+            proxy_url = get_proxy_url(proxy, scheme)
+            if proxy_url:
+                mounts[f"{scheme}://"] = transport(proxy_url)
+
+        _POOLS[key] = httpx.AsyncClient(
+            transport=transport(),
+            mounts=mounts,
+            timeout=DEFAULT_TIMEOUT,
+            limits=limits,
+        )
+
+    return _POOLS[key]
+
+
+async def _close_pools(loop: asyncio.AbstractEventLoop) -> None:
+    for key in [key for key in _POOLS if key[0] is loop]:
+        await _POOLS.pop(key).aclose()
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """
+    Get the background event loop used by the synchronous clients
+    The loop is started on first use and runs in a daemon thread for the lifetime of the process
+    """
+    global _LOOP
+
+    with _LOOP_LOCK:
+        if _LOOP is None:
+            _LOOP = asyncio.new_event_loop()
+            threading.Thread(target=_LOOP.run_forever, name="client-loop", daemon=True).start()
+            atexit.register(lambda loop: asyncio.run_coroutine_threadsafe(_close_pools(loop), loop).result(timeout=5), _LOOP)
+
+        return _LOOP
+
+
+async def gather_limited(calls: Iterable[Awaitable], limit: int) -> List[Any]:
+    """
+    Await the calls concurrently with at most limit calls in flight
+
+    :param calls: The calls to await
+    :param limit: The maximum number of calls in flight
+
+    :return: The result or the raised exception of each call, in order
+    """
+    if limit < 1:
+        raise ValueError("The limit must be at least 1")
+
+    semaphore = asyncio.Semaphore(limit)
+
+    async def bounded(call: Awaitable) -> Any:
+        async with semaphore:
+            return await call
+
+    return await asyncio.gather(*[bounded(call) for call in calls], return_exceptions=True)
+
+
+def convert_to_form_data(data: dict) -> List[Tuple[str, str]]:
+    """
+    Convert the data to form data format
+    Converts lists to multiple key-value pairs
+    """
+    form_data = []
+    for key, value in data.items():
+        if isinstance(value, list):
+            for item in value:
+                form_data.append((key, item))
+        else:
+            form_data.append((key, value))
+
+    return form_data
+
+
+class AsyncClient:
     def __init__(
         self,
         stack_name: str,
@@ -20,54 +153,62 @@ class Client:
         is_stage: bool = False,
         is_acs: bool = True,
         api_url: str = "",
+        acs_url: Union[None, str] = None,
+        max_connections: int = DEFAULT_MAX_CONNECTIONS,
+        rate_limit: Union[None, RateLimit] = None,
+        splunkbase: Union[None, Splunkbase] = None,
+        cassette: Union[None, CassetteFile] = None,
     ):
         self.stack_name = stack_name.upper().replace("-", "_")
         self.proxy = proxy
         self.is_stage = is_stage
+        self.kind = "acs" if is_acs else "api"
+        self.max_connections = max_connections
+        self.rate_limit = rate_limit or RateLimit()
+        self.splunkbase = splunkbase or Splunkbase()
+        self.cassette = cassette
+        self.limiter = RateLimiter(name=f"{self.stack_name} {'ACS' if is_acs else 'REST API'}", config=self.rate_limit)
 
         if is_acs:
-            self.base_url = BASE_URLS["stage" if self.is_stage else "prod"]
+            self.base_url = acs_url or BASE_URLS["stage" if self.is_stage else "prod"]
         else:
             self.base_url = api_url
 
-        self.token = os.environ.get(f"{self.stack_name}_TOKEN")
+        # Replayed requests are never sent, so the credentials are only required to record or talk to a stack
+        replaying = cassette is not None and cassette.config.mode == CassetteMode.REPLAY
+        default = "replay" if replaying else None
+
+        self.token = os.environ.get(f"{self.stack_name}_TOKEN", default)
         if not self.token:
             raise ValueError(f"Token not found for {self.stack_name}")
 
-        self.username = os.environ.get(f"{self.stack_name}_USERNAME")
+        self.username = os.environ.get(f"{self.stack_name}_USERNAME", default)
         if not self.username:
             raise ValueError(f"Username not found for {self.stack_name}")
 
-        self.password = os.environ.get(f"{self.stack_name}_PASSWORD")
+        self.password = os.environ.get(f"{self.stack_name}_PASSWORD", default)
         if not self.password:
             raise ValueError(f"Password not found for {self.stack_name}")
 
         self.headers = {"Authorization": f"Bearer {self.token}"}
 
-        self.session = requests.Session()
-        if self.proxy.used and self.proxy.url:
-            if self.proxy.username and self.proxy.password:
-                self.session.proxies = {
-                    "http": f"http://{self.proxy.username}:{self.proxy.password}@{self.proxy.url}",
-                    "https": f"https://{self.proxy.username}:{self.proxy.password}@{self.proxy.url}",
-                }
-            else:
-                self.session.proxies = {
-                    "http": str(self.proxy.url),
-                    "https": str(self.proxy.url),
-                }
+    @property
+    def pool(self) -> httpx.AsyncClient:
+        return get_pool(self.proxy, self.max_connections, self.cassette)
 
     def __handle_response(
-        self, response: requests.Response
+        self, response: httpx.Response, allowed_status: Iterable[int] = ()
     ) -> Tuple[int, Union[Dict[Any, Any], str, List]]:
         """
         Handle the response from the API - raise an error if the response is not successful
+        unless the status is explicitly allowed
         If the response is JSON, return the JSON object, otherwise return the text
         """
-        if response.status_code >= 400:
-            logging.error("Go error %s", response.text)
-            
-        response.raise_for_status()
+        if response.status_code not in allowed_status:
+            if response.status_code >= 400:
+                logging.error("Go error %s", response.text)
+
+            response.raise_for_status()
 
         if "content-type" in response.headers and response.headers[
             "content-type"
@@ -76,95 +217,211 @@ class Client:
 
         return response.status_code, response.text
 
-    def __convert_to_form_data(self, data: dict) -> List[Tuple[str, str]]:
+    def __record(self, method: str, url: str, status: int, size: int, started: float) -> None:
         """
-        Convert the data to form data format
-        Converts lists to multiple key-value pairs
+        Record the status, response size and latency of a request, without the wait for the rate limiter
         """
-        form_data = []
-        for key, value in data.items():
-            if isinstance(value, list):
-                for item in value:
-                    form_data.append((key, item))
-            else:
-                form_data.append((key, value))
+        get_recorder().record_request(
+            stack_name=self.stack_name,
+            client=self.kind,
+            method=method,
+            url=url,
+            status=status,
+            size=size,
+            latency=time.monotonic() - started,
+        )
 
-        return form_data
-    
-    def authenticate_splunkbase(self):
+    async def authenticate_splunkbase(self):
         """
         Authenticate with Splunkbase and set the necessary headers
+        A session of the same account from another client or an earlier run is reused until it expires
+        """
+        sessions = get_session_cache(self.splunkbase)
+
+        # Clients of the same account wait for each other, so only the first one logs in
+        async with sessions.login_lock(self.username):
+            token = sessions.get(self.username)
+            if token is None:
+                token = await login(self.pool, self.splunkbase.login_url, self.username, self.password)
+                sessions.store(self.username, token)
+            else:
+                logging.debug("Reusing Splunkbase session of %s", self.username)
+
+        self.headers[SPLUNKBASE_HEADER] = token
+
+    async def __reauthenticate_splunkbase(self, rejected_token: str) -> Dict[str, str]:
         """
-        response = self.session.post(
-            "https://splunkbase.splunk.com/api/account:login", data={"username": self.username, "password": self.password}
+        Log in to Splunkbase again after the session was rejected and return the new header
+        """
+        logging.info("Splunkbase session of %s was rejected - logging in again", self.username)
+        get_session_cache(self.splunkbase).invalidate(self.username, rejected_token)
+        await self.authenticate_splunkbase()
+        return {SPLUNKBASE_HEADER: self.headers[SPLUNKBASE_HEADER]}
+
+    async def request(
+        self,
+        method: str,
+        url: str,
+        headers: Dict[str, str],
+        data: Union[None, dict] = None,
+        params: Union[None, dict] = None,
+        as_json: bool = True,
+        allowed_status: Iterable[int] = (),
+    ) -> Tuple[int, Union[Dict[Any, Any], str, List]]:
+        kwargs: Dict[str, Any] = {"headers": {**self.headers, **headers}, "params": params}
+        if data is not None:
+            if as_json:
+                kwargs["json"] = data
+            else:
+                # Encode the form ourselves to keep the value formatting of requests (e.g. enums and booleans)
+                form_data = [(key, value) for key, value in convert_to_form_data(data) if value is not None]
+                kwargs["content"] = urlencode(form_data, doseq=True)
+                kwargs["headers"] = {"Content-Type": "application/x-www-form-urlencoded", **kwargs["headers"]}
+
+        attempt = 0
+        reauthenticated = False
+        while True:
+            try:
+                async with self.limiter.slot():
+                    started = time.monotonic()
+                    try:
+                        response = await self.pool.request(method, self.base_url + url, **kwargs)
+                    except httpx.TransportError:
+                        self.__record(method, url, 0, 0, started)
+                        raise
+                    self.__record(method, url, response.status_code, len(response.content), started)
+            except httpx.TransportError as e:
+                if method.upper() not in IDEMPOTENT_METHODS or attempt >= self.rate_limit.max_retries:
+                    raise
+
+                delay = backoff_delay(attempt)
+                logging.warning("%s %s failed with %s - retrying in %.1fs", method, url, e, delay)
+            else:
+                splunkbase_token = kwargs["headers"].get(SPLUNKBASE_HEADER)
+                if response.status_code == 401 and splunkbase_token and not reauthenticated:
+                    # An expired Splunkbase session is only noticed by ACS, retry once with a new login
+                    reauthenticated = True
+                    kwargs["headers"] = {**kwargs["headers"], **await self.__reauthenticate_splunkbase(splunkbase_token)}
+                    continue
+
+                if not should_retry(method, response.status_code):
+                    self.limiter.on_success()
+                    return self.__handle_response(response, allowed_status)
+
+                retry_after = parse_retry_after(response.headers.get("retry-after"))
+                self.limiter.on_throttle(retry_after)
+
+                if attempt >= self.rate_limit.max_retries:
+                    return self.__handle_response(response, allowed_status)
+
+                delay = backoff_delay(attempt, retry_after)
+                logging.warning("%s %s returned %d - retrying in %.1fs", method, url, response.status_code, delay)
+
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def get(
+        self, url: str, headers: Dict[str, str], params: dict
+    ) -> Tuple[int, Union[Dict[Any, Any], str, List]]:
+        return await self.request("GET", url, headers, params=params)
+
+    async def post(
+        self, url: str, headers: Dict[str, str], data: dict, as_json: bool = True
+    ) -> Tuple[int, Union[Dict[Any, Any], str, List]]:
+        return await self.request("POST", url, headers, data=data, as_json=as_json)
+
+    async def put(
+        self, url: str, headers: Dict[str, str], data: dict, as_json: bool = True
+    ) -> Tuple[int, Union[Dict[Any, Any], str, List]]:
+        return await self.request("PUT", url, headers, data=data, as_json=as_json)
+
+    async def patch(
+        self, url: str, headers: Dict[str, str], data: dict, as_json: bool = True
+    ) -> Tuple[int, Union[Dict[Any, Any], str, List]]:
+        return await self.request("PATCH", url, headers, data=data, as_json=as_json)
+
+    async def delete(
+        self, url: str, headers: Dict[str, str], data: dict, as_json: bool = True
+    ) -> Tuple[int, Union[Dict[Any, Any], str, List]]:
+        return await self.request("DELETE", url, headers, data=data, as_json=as_json)
+
+
+class Client:
+    """
+    Synchronous wrapper around AsyncClient
+    All calls are executed on a shared background event loop, so the connection pool is shared
+    between all clients and threads of the process. Do not call it from within a coroutine.
+    """
+
+    def __init__(
+        self,
+        stack_name: str,
+        proxy: Proxy,
+        is_stage: bool = False,
+        is_acs: bool = True,
+        api_url: str = "",
+        acs_url: Union[None, str] = None,
+        max_connections: int = DEFAULT_MAX_CONNECTIONS,
+        rate_limit: Union[None, RateLimit] = None,
+        splunkbase: Union[None, Splunkbase] = None,
+        cassette: Union[None, CassetteFile] = None,
+    ):
+        self.async_client = AsyncClient(
+            stack_name=stack_name,
+            proxy=proxy,
+            is_stage=is_stage,
+            is_acs=is_acs,
+            api_url=api_url,
+            acs_url=acs_url,
+            max_connections=max_connections,
+            rate_limit=rate_limit,
+            splunkbase=splunkbase,
+            cassette=cassette,
         )
-        response.raise_for_status()
+        self.stack_name = self.async_client.stack_name
+        self.base_url = self.async_client.base_url
 
-        namespace = {'atom': 'http://www.w3.org/2005/Atom'}
-        root = ET.fromstring(response.text)
-        id_element = root.find('atom:id', namespace)
+    def run(self, call: Awaitable) -> Any:
+        """
+        Run a coroutine on the background event loop and wait for its result
+        """
+        return asyncio.run_coroutine_threadsafe(call, get_loop()).result()
+
+    def gather(self, calls: Iterable[Awaitable], limit: int) -> List[Any]:
+        """
+        Run the calls concurrently with at most limit calls in flight
+
+        :param calls: The calls to run, e.g. client.async_client.post(...)
+        :param limit: The maximum number of calls in flight
+
+        :return: The result or the raised exception of each call, in order
+        """
+        return self.run(gather_limited(calls, limit))
 
-        if id_element is None or not id_element.text:
-            raise ValueError("Invalid response from Splunkbase")
-        
-        self.session.headers.update({"X-Splunkbase-Authorization": id_element.text})
+    def authenticate_splunkbase(self):
+        self.run(self.async_client.authenticate_splunkbase())
 
     def get(
         self, url: str, headers: Dict[str, str], params: dict
     ) -> Tuple[int, Union[Dict[Any, Any], str, List]]:
-        response = self.session.get(
-            self.base_url + url, headers={**self.headers, **headers}, params=params
-        )
-        return self.__handle_response(response)
+        return self.run(self.async_client.get(url, headers, params))
 
     def post(
         self, url: str, headers: Dict[str, str], data: dict, as_json: bool = True
     ) -> Tuple[int, Union[Dict[Any, Any], str, List]]:
-        if as_json:
-            response = self.session.post(
-                self.base_url + url, headers={**self.headers, **headers}, json=data
-            )
-        else:
-            response = self.session.post(
-                self.base_url + url, headers={**self.headers, **headers}, data=self.__convert_to_form_data(data)
-            )
-        return self.__handle_response(response)
+        return self.run(self.async_client.post(url, headers, data, as_json=as_json))
 
     def put(
         self, url: str, headers: Dict[str, str], data: dict, as_json: bool = True
     ) -> Tuple[int, Union[Dict[Any, Any], str, List]]:
-        if as_json:
-            response = self.session.put(
-                self.base_url + url, headers={**self.headers, **headers}, json=data
-            )
-        else:
-            response = self.session.put(
-                self.base_url + url, headers={**self.headers, **headers}, data=self.__convert_to_form_data(data)
-            )
-        return self.__handle_response(response)
+        return self.run(self.async_client.put(url, headers, data, as_json=as_json))
 
     def patch(
         self, url: str, headers: Dict[str, str], data: dict, as_json: bool = True
     ) -> Tuple[int, Union[Dict[Any, Any], str, List]]:
-        if as_json:
-            response = self.session.patch(
-                self.base_url + url, headers={**self.headers, **headers}, json=data
-            )
-        else:
-            response = self.session.patch(
-                self.base_url + url, headers={**self.headers, **headers}, data=self.__convert_to_form_data(data)
-            )
-        return self.__handle_response(response)
+        return self.run(self.async_client.patch(url, headers, data, as_json=as_json))
 
     def delete(
         self, url: str, headers: Dict[str, str], data: dict, as_json: bool = True
     ) -> Tuple[int, Union[Dict[Any, Any], str, List]]:
-        if as_json:
-            response = self.session.delete(
-                self.base_url + url, headers={**self.headers, **headers}, json=data
-            )
-        else:
-            response = self.session.delete(
-                self.base_url + url, headers={**self.headers, **headers}, data=self.__convert_to_form_data(data)
-            )
-        return self.__handle_response(response)
+        return self.run(self.async_client.delete(url, headers, data, as_json=as_json))
@@ -0,0 +1,75 @@
+from pydantic import BaseModel, Field
+from typing import Callable, Generic, Iterable, List, TypeVar, Union
+
+T = TypeVar("T")
+
+
+class Change(BaseModel, Generic[T]):
+    desired: T
+    current: T
+
+
+class ChangePlan(BaseModel, Generic[T]):
+    to_add: List[T] = Field(default=[])
+    to_update: List[Change[T]] = Field(default=[])
+    to_delete: List[T] = Field(default=[])
+    unchanged: int = 0
+
+    @property
+    def has_changes(self) -> bool:
+        return bool(self.to_add or self.to_update or self.to_delete)
+
+
+def default_fingerprint(obj) -> str:
+    return obj.fingerprint()
+
+
+def diff(
+    desired: Iterable[T],
+    current: Iterable[T],
+    key: Callable[[T], str],
+    protected: Iterable[str] = (),
+    read_only: Iterable[str] = (),
+    fingerprint: Union[None, Callable[[T], str]] = None,
+) -> ChangePlan[T]:
+    """
+    Compare the desired and the current objects by their identity key and content fingerprint
+    Runs in linear time - every object is keyed and fingerprinted once
+
+    :param desired: The objects as they should be
+    :param current: The objects as they are
+    :param key: Returns the identity of an object, e.g. its name
+    :param protected: Keys of objects that are never deleted
+    :param read_only: Keys of objects that are never updated
+    :param fingerprint: Returns the canonical content hash of an object, defaults to its fingerprint method
+
+    :return: The objects to add, update and delete
+    """
+    fingerprint = fingerprint or default_fingerprint
+    protected = set(protected)
+    read_only = set(read_only)
+
+    current_by_key = {key(obj): obj for obj in current}
+    desired_keys = set()
+
+    to_add = []
+    to_update = []
+    unchanged = 0
+
+    for obj in desired:
+        obj_key = key(obj)
+        desired_keys.add(obj_key)
+        existing = current_by_key.get(obj_key)
+
+        if existing is None:
+            to_add.append(obj)
+        elif obj_key in read_only or fingerprint(obj) == fingerprint(existing):
+            unchanged += 1
+        else:
+            to_update.append(Change(desired=obj, current=existing))
+
+    to_delete = [
+        obj for obj_key, obj in current_by_key.items() if obj_key not in desired_keys and obj_key not in protected
+    ]
+
+    return ChangePlan(to_add=to_add, to_update=to_update, to_delete=to_delete, unchanged=unchanged)
@@ -0,0 +1,204 @@
+import asyncio
+import httpx
+import logging
+
+from enum import Enum
+from pydantic import BaseModel, Field
+from typing import Any, Awaitable, Callable, Dict, List, Union
+from cache import SnapshotCache
+from client import AsyncClient, Client
+from journal import ApplyJournal
+from readiness import ReadinessBoard
+
+DEFAULT_MAX_IN_FLIGHT = 8
+
+
+class Action(str, Enum):
+    DELETE = "delete"
+    ADD = "add"
+    UPDATE = "update"
+
+
+# Deletes go first to free names and quotas, updates last as they never depend on new objects
+ACTION_ORDER = [Action.DELETE, Action.ADD, Action.UPDATE]
+
+# Called after an operation was applied successfully, e.g. to wait until the change is complete
+# An exception marks the operation as failed
+FollowUp = Callable[["Operation", Any], Awaitable[None]]
+
+ACTION_VERBS = {
+    Action.DELETE: "Deleted",
+    Action.ADD: "Created",
+    Action.UPDATE: "Updated",
+}
+
+
+class Operation(BaseModel):
+    feature: str
+    kind: str
+    action: Action
+    name: str
+    method: str
+    url: str
+    headers: Dict[str, str] = Field(default={})
+    data: Dict[str, Any] = Field(default={})
+    as_json: bool = True
+    # Keys of objects created by other features that must be ready before this operation is sent
+    requires: List[str] = Field(default=[])
+    # Current values of the fields an update changes, data only holds the changed fields
+    previous: Dict[str, Any] = Field(default={})
+    # Keyed fingerprint of content that can not be read back, recorded once the operation succeeded
+    secret_fingerprint: Union[None, str] = None
+
+    def describe(self) -> str:
+        return f"{self.action.value} {self.kind} {self.name}"
+
+    def key(self) -> str:
+        """
+        Identifies the operation in the journal, independent of the request content
+        """
+        return f"{self.feature}:{self.action.value}:{self.kind}:{self.name}"
+
+
+class OperationResult(BaseModel):
+    operation: Operation
+    succeeded: bool
+    status_code: int = 0
+    error: str = ""
+    response: Any = None
+
+
+class ApplyError(Exception):
+    """
+    Raised after all operations of a feature were attempted and at least one of them failed
+    """
+
+    def __init__(self, failed: List[OperationResult], total: int):
+        self.failed = failed
+        self.total = total
+        details = "; ".join(f"{result.operation.describe()}: {result.error}" for result in failed)
+        super().__init__(f"{len(failed)} of {total} operations failed: {details}")
+
+
+async def _apply(client: AsyncClient, operation: Operation) -> Any:
+    return await client.request(
+        operation.method,
+        operation.url,
+        operation.headers,
+        data=operation.data,
+        as_json=operation.as_json,
+    )
+
+
+async def _apply_phase(
+    client: AsyncClient,
+    operations: List[Operation],
+    max_in_flight: int,
+    board: Union[None, ReadinessBoard],
+    follow_up: Union[None, FollowUp],
+    journal: Union[None, ApplyJournal],
+    hold_slot_for_follow_up: bool,
+) -> List[Any]:
+    semaphore = asyncio.Semaphore(max_in_flight)
+
+    async def apply_when_ready(operation: Operation) -> Any:
+        # Wait outside of the semaphore, so waiting operations do not block those that are ready
+        if board is not None and operation.requires:
+            await board.wait(operation.requires)
+
+        async with semaphore:
+            outcome = await _apply(client, operation)
+            if follow_up is not None and hold_slot_for_follow_up:
+                await follow_up(operation, outcome[1])
+
+        if follow_up is not None and not hold_slot_for_follow_up:
+            await follow_up(operation, outcome[1])
+
+        if journal is not None:
+            journal.done(operation.key())
+
+        return outcome
+
+    return await asyncio.gather(*[apply_when_ready(operation) for operation in operations], return_exceptions=True)
+
+
+def _describe_error(error: BaseException) -> str:
+    if isinstance(error, httpx.HTTPStatusError):
+        return f"{error.response.status_code} {error.response.text}"
+
+    return str(error) or type(error).__name__
+
+
+def apply_operations(
+    client: Client,
+    operations: List[Operation],
+    max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+    order: List[Action] = ACTION_ORDER,
+    cache: Union[None, SnapshotCache] = None,
+    board: Union[None, ReadinessBoard] = None,
+    follow_up: Union[None, FollowUp] = None,
+    journal: Union[None, ApplyJournal] = None,
+    hold_slot_for_follow_up: bool = False,
+) -> List[OperationResult]:
+    """
+    Apply the operations with at most max_in_flight requests at the same time
+    By default all deletes are applied before all adds, and all adds before all updates
+    A failed operation does not stop the remaining ones
+    The cached state of every changed feature is invalidated before the first request
+    Operations that require objects of other features are only sent once these are ready on the board
+    Every operation that succeeded, including its follow up, is recorded in the journal
+
+    :param client: The client to use for the requests
+    :param operations: The operations to apply
+    :param max_in_flight: The maximum number of requests in flight
+    :param order: The order in which the actions are applied
+    :param cache: The snapshot cache to invalidate
+    :param board: The readiness board of the run
+    :param follow_up: Awaited after each successful operation, by default without holding a slot of max_in_flight
+    :param journal: The journal of the run
+    :param hold_slot_for_follow_up: Keep the slot of max_in_flight until the follow up finished,
+        so the next operation is only sent once the previous one is complete
+
+    :return: The result of each operation
+    """
+    if max_in_flight < 1:
+        raise ValueError("The number of operations in flight must be at least 1")
+
+    results = []
+
+    if cache:
+        for feature in sorted({operation.feature for operation in operations}):
+            cache.invalidate(stack_name=client.stack_name, feature=feature)
+
+    for action in order:
+        phase = [operation for operation in operations if operation.action == action]
+        if not phase:
+            continue
+
+        logging.debug("Applying %d %s operations with up to %d in flight", len(phase), action.value, max_in_flight)
+        outcomes = client.run(
+            _apply_phase(client.async_client, phase, max_in_flight, board, follow_up, journal, hold_slot_for_follow_up)
+        )
+
+        for operation, outcome in zip(phase, outcomes):
+            if isinstance(outcome, BaseException):
+                logging.error("Failed to %s: %s", operation.describe(), _describe_error(outcome))
+                results.append(OperationResult(operation=operation, succeeded=False, error=_describe_error(outcome)))
+            else:
+                logging.info("%s %s %s", ACTION_VERBS[action], operation.kind, operation.name)
+                results.append(OperationResult(operation=operation, succeeded=True, status_code=outcome[0], response=outcome[1]))
+
+    return results
+
+
+def check_results(results: List[OperationResult]) -> None:
+    """
+    Raise an ApplyError listing every failed operation
+
+    :param results: The results of apply_operations
+
+    :return: None
+    """
+    failed = [result for result in results if not result.succeeded]
+    if failed:
+        raise ApplyError(failed=failed, total=len(results))
@@ -1,10 +1,24 @@
+import bisect
+import ipaddress
 import logging
 
+from typing import Any, Dict, Iterable, List, Sequence, Tuple, Union
+from cache import get_snapshot_cache
 from client import Client
-from models import AllowList, StackConfiguration
+from diff import ChangePlan
+from executor import Action, Operation, OperationResult, apply_operations, check_results
+from journal import ApplyJournal
+from metrics import get_recorder
+from prefetch import RemoteState, get_current
+from readiness import ReadinessBoard
+from models import AllowList, Config, StackConfiguration
+from tracker import Check, PollState, TrackStatus, wait_until_ready
 
 
 IP_ALLOW_URL = "{stack_name}/adminconfig/v2/access/{feature}/ipallowlists"
+STATUS_URL = "{stack_name}/adminconfig/v2/status"
+# The stack statuses ACS reports while a change is being deployed, anything else but ready or failed is an error
+DEPLOYING_STATUSES = {"updating", "deploying", "provisioning", "restarting"}
 
 
 FEATURE_ATTRIBUTE_MAP = {
@@ -14,6 +28,14 @@ FEATURE_ATTRIBUTE_MAP = {
     "hec": "hec",
 }
 
+Network = Union[ipaddress.IPv4Network, ipaddress.IPv6Network]
+
+
+class DeploymentError(Exception):
+    """
+    Raised when the stack did not finish deploying an allow list change in time
+    """
+
 
 def get_feature_url(stack_name: str, feature: str) -> str:
     """
@@ -27,9 +49,79 @@ def get_feature_url(stack_name: str, feature: str) -> str:
     return IP_ALLOW_URL.format(stack_name=stack_name, feature=feature)
 
 
+def collapse_subnets(subnets: Iterable[Network]) -> List[Network]:
+    """
+    Remove duplicate subnets and subnets covered by others, and merge adjacent subnets
+
+    :param subnets: The subnets, IPv4 and IPv6 mixed
+
+    :return: The smallest list of subnets covering the same addresses, sorted by version and address
+    """
+    subnets = list(subnets)
+    collapsed = []
+    for version in (4, 6):
+        collapsed.extend(ipaddress.collapse_addresses(subnet for subnet in subnets if subnet.version == version))
+
+    return collapsed
+
+
+def get_covering_subnet(
+    subnet: Network, collapsed: Sequence[Network], starts: Sequence[Tuple[int, int]]
+) -> Union[None, Network]:
+    """
+    Find the collapsed subnet that contains a subnet
+    Collapsed subnets do not overlap, so only the last one starting before the subnet can contain it
+
+    :param subnet: The subnet to look up
+    :param collapsed: The collapsed subnets, see collapse_subnets
+    :param starts: The version and first address of each collapsed subnet
+
+    :return: The containing subnet or None if no collapsed subnet contains the subnet
+    """
+    position = bisect.bisect_right(starts, (subnet.version, int(subnet.network_address))) - 1
+    if position < 0:
+        return None
+
+    candidate = collapsed[position]
+    if candidate.version == subnet.version and subnet.subnet_of(candidate):
+        return candidate
+
+    return None
+
+
+def diff_subnets(desired: List[Network], current: List[Network]) -> ChangePlan[Network]:
+    """
+    Compare the subnets by the addresses they cover instead of by their notation
+    Current subnets inside a desired subnet are kept, all others are deleted,
+    and a desired subnet is only added if the kept subnets do not already cover all of its addresses
+
+    :param desired: The collapsed desired subnets, see collapse_subnets
+    :param current: The subnets on the stack
+
+    :return: The subnets to add and to delete, the number of kept subnets as unchanged
+    """
+    starts = [(subnet.version, int(subnet.network_address)) for subnet in desired]
+    kept: Dict[Network, List[Network]] = {}
+    to_delete = []
+
+    for subnet in current:
+        covering = get_covering_subnet(subnet, desired, starts)
+        if covering is None:
+            to_delete.append(subnet)
+        else:
+            kept.setdefault(covering, []).append(subnet)
+
+    to_add = [subnet for subnet in desired if collapse_subnets(kept.get(subnet, [])) != [subnet]]
+
+    return ChangePlan(
+        to_add=to_add, to_delete=to_delete, unchanged=sum(len(subnets) for subnets in kept.values())
+    )
+
+
 def get_allowlist(stack_name: str, client: Client) -> AllowList:
     """
     Get the IP allow configuration for a given stack and feature
+    The allow lists of all features are requested at the same time
 
     :param stack_name: The name of the stack
     :param feature: The feature to get the IP allow configuration for
@@ -39,11 +131,17 @@ def get_allowlist(stack_name: str, client: Client) -> AllowList:
     """
     config = {}
 
-    for feature, _ in FEATURE_ATTRIBUTE_MAP.items():
-        logging.debug("Getting IP allow configuration for %s", feature)
-        _, response = client.get(
-            get_feature_url(stack_name=stack_name, feature=feature), {}, {}
-        )
+    features = list(FEATURE_ATTRIBUTE_MAP)
+    outcomes = client.gather(
+        [client.async_client.get(get_feature_url(stack_name=stack_name, feature=feature), {}, {}) for feature in features],
+        limit=len(features),
+    )
+
+    for feature, outcome in zip(features, outcomes):
+        if isinstance(outcome, BaseException):
+            raise outcome
+
+        _, response = outcome
         logging.debug("IP allow configuration for %s: %s", feature, response)
 
         if not isinstance(response, dict) or "subnets" not in response:
@@ -56,46 +154,184 @@ def get_allowlist(stack_name: str, client: Client) -> AllowList:
     return AllowList.model_validate(config)
 
 
-def set_allowlist(stack_config: StackConfiguration, client: Client) -> None:
+def read_allowlist(
+    stack_config: StackConfiguration, client: Client, config: Union[None, Config] = None
+) -> AllowList:
     """
-    Set the IP allow configuration for a given stack
+    Fetches the current IP allow configuration, or takes it from a snapshot that is recent enough
 
-    :param stack: The name of the stack
-    :param ip_allow: The IP allow configuration to set
+    :param stack_config: The stack configuration to use
     :param client: The client to use for the request
+    :param config: The global configuration
+
+    :return: The current IP allow configuration
+    """
+    config = config or Config()
+    return get_snapshot_cache(config).fetch(
+        stack_name=client.stack_name,
+        feature="allowlist",
+        state_type=AllowList,
+        fetch=lambda: get_allowlist(client=client, stack_name=stack_config.stack_name),
+    )
+
 
-    :return: None
+def plan_allowlist(
+    stack_config: StackConfiguration,
+    client: Client,
+    config: Union[None, Config] = None,
+    state: Union[None, RemoteState] = None,
+) -> List[Operation]:
+    """
+    Fetches the current IP allow configuration and computes the operations to match the stack configuration
+    The desired subnets are collapsed first, and compared with the current ones by the addresses they cover
+    Each feature gets at most one request adding and one request removing subnets
+
+    :param stack_config: The stack configuration to use
+    :param client: The client to use for the request
+    :param config: The global configuration
+    :param state: The prefetched remote state, fetched if it does not contain the feature
+
+    :return: The operations to apply
     """
     new_ip_allow = stack_config.allowlist
-    current_ip_allow = get_allowlist(client=client, stack_name=stack_config.stack_name)
+    config = config or Config()
+    current_ip_allow = get_current(
+        state, "allowlist", lambda: read_allowlist(stack_config=stack_config, client=client, config=config)
+    )
+    operations = []
+
     for feature, attribute in FEATURE_ATTRIBUTE_MAP.items():
-        to_delete = []
-        to_add = []
-
-        for subnet in getattr(new_ip_allow, attribute):
-            if subnet not in getattr(current_ip_allow, attribute):
-                to_add.append(subnet)
-
-        for subnet in getattr(current_ip_allow, attribute):
-            if subnet not in getattr(new_ip_allow, attribute):
-                to_delete.append(subnet)
-
-        if to_add:
-            logging.info("Adding subnets to %s: %s", feature, to_add)
-            client.post(
-                url=get_feature_url(stack_name=stack_config.stack_name, feature=feature),
-                headers={},
-                data={"subnets": [str(subnet) for subnet in to_add]},
+        with get_recorder().timed(stack_name=client.stack_name, feature="allowlist", phase="diff"):
+            desired = getattr(new_ip_allow, attribute)
+            collapsed = collapse_subnets(desired)
+            plan = diff_subnets(desired=collapsed, current=getattr(current_ip_allow, attribute))
+
+        if len(collapsed) < len(desired):
+            logging.info(
+                "Collapsed %d subnets of %s to %d (%.0f%% fewer)",
+                len(desired),
+                feature,
+                len(collapsed),
+                100 * (1 - len(collapsed) / len(desired)),
+            )
+
+        if plan.to_add:
+            logging.info("Adding subnets to %s: %s", feature, plan.to_add)
+            operations.append(
+                Operation(
+                    feature="allowlist",
+                    kind="IP allow list entries for",
+                    action=Action.ADD,
+                    name=feature,
+                    method="POST",
+                    url=get_feature_url(stack_name=stack_config.stack_name, feature=feature),
+                    data={"subnets": [str(subnet) for subnet in plan.to_add]},
+                )
             )
-            logging.info("Added subnets to %s: %s", feature, to_add)
-
-        if to_delete:
-            logging.info("Removing subnets from %s: %s", feature, to_delete)
-            client.delete(
-                url=get_feature_url(stack_name=stack_config.stack_name, feature=feature),
-                headers={},
-                data={"subnets": [str(subnet) for subnet in to_delete]},
+
+        if plan.to_delete:
+            logging.info("Removing subnets from %s: %s", feature, plan.to_delete)
+            operations.append(
+                Operation(
+                    feature="allowlist",
+                    kind="IP allow list entries for",
+                    action=Action.DELETE,
+                    name=feature,
+                    method="DELETE",
+                    url=get_feature_url(stack_name=stack_config.stack_name, feature=feature),
+                    data={"subnets": [str(subnet) for subnet in plan.to_delete]},
+                )
             )
-            logging.info("Removed subnets from %s: %s", feature, to_delete)
+
+    return operations
+
+
+def get_deployment_check(client: Client, stack_name: str) -> Check:
+    """
+    Build a status check that is ready once the stack finished deploying its last change
+    A missing or unrecognised status fails the check instead of being polled until the deadline
+
+    :param client: The client to use for the requests
+    :param stack_name: The name of the stack
+
+    :return: The status check of the stack
+    """
+    status_url = STATUS_URL.format(stack_name=stack_name)
+
+    async def check():
+        _, response = await client.async_client.get(status_url, {}, {})
+        infrastructure = response.get("infrastructure") if isinstance(response, dict) else None
+        if not isinstance(infrastructure, dict):
+            return PollState.FAILED, f"no infrastructure status in the response: {response}"
+
+        status = str(infrastructure.get("status") or infrastructure.get("stackStatus") or "").lower()
+        if status == "ready":
+            return PollState.READY, status
+        if status == "failed":
+            return PollState.FAILED, status
+        if status in DEPLOYING_STATUSES:
+            return PollState.PENDING, status
+
+        return PollState.FAILED, f"unrecognised stack status: {status or infrastructure}"
+
+    return check
+
+
+def apply_allowlist(
+    client: Client,
+    operations: List[Operation],
+    stack_name: str,
+    config: Union[None, Config] = None,
+    board: Union[None, ReadinessBoard] = None,
+    journal: Union[None, ApplyJournal] = None,
+) -> List[OperationResult]:
+    """
+    Applies the planned IP allow list operations one after another
+    Every change starts a deployment on the stack, so the next change is only sent once the stack is ready again,
+    with the stack status polled using the allowlist_tracking settings
+    Subnets are added before others are removed to never lock out existing clients
+
+    :param client: The client to use for the request
+    :param operations: The operations from plan_allowlist
+    :param stack_name: The name of the stack as written in the stack configuration
+    :param config: The global configuration
+    :param board: The readiness board of the run
+    :param journal: The journal of the run
+
+    :return: The result of each applied operation
+    """
+    if not operations:
+        return []
+
+    config = config or Config()
+    tracking = config.allowlist_tracking
+
+    check = get_deployment_check(client, stack_name=stack_name)
+
+    async def wait_for_deployment(operation: Union[None, Operation] = None, response: Any = None) -> None:
+        name = f"deployment of {operation.describe()}" if operation else "running deployment"
+        outcome = await wait_until_ready(name, check, tracking)
+        if outcome.status != TrackStatus.READY:
+            raise DeploymentError(f"{name} {outcome.status.value} after {outcome.elapsed:.0f}s: {outcome.detail}")
+
+        logging.debug("Finished %s after %.1fs", name, outcome.elapsed)
+
+    # A change sent while another deployment is running collides with it
+    if tracking.enabled:
+        client.run(wait_for_deployment())
+
+    results = apply_operations(
+        client=client,
+        operations=operations,
+        max_in_flight=1,
+        order=[Action.ADD, Action.DELETE],
+        cache=get_snapshot_cache(config),
+        board=board,
+        journal=journal,
+        follow_up=wait_for_deployment if tracking.enabled else None,
+        hold_slot_for_follow_up=True,
+    )
+    check_results(results)
 
     logging.info("IP allow configuration set")
+    return results
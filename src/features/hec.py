@@ -1,8 +1,16 @@
 import logging
 
-from typing import List
+from typing import List, Union
+from cache import get_snapshot_cache
 from client import Client
-from models import HecToken, StackConfiguration
+from pagination import fetch_all_pages
+from diff import diff
+from executor import Action, Operation
+from metrics import get_recorder
+from prefetch import RemoteState, get_current
+from sources import iter_objects
+from readiness import get_resource_key
+from models import HecToken, Config, StackConfiguration
 
 HEC_URL = "{stack}/adminconfig/v2/inputs/http-event-collectors"
 DEFAULT_HEC_NAME = "victoriahec"
@@ -19,24 +27,36 @@ def get_hec_url(stack: str) -> str:
     return HEC_URL.format(stack=stack)
 
 
-def get_hec(stack_name: str, client: Client) -> List[HecToken]:
+def get_hec(stack_name: str, client: Client, page_size: int = 100, concurrency: int = 4) -> List[HecToken]:
     """
     Get the HEC configuration for a given stack
 
     :param stack_name: The name of the stack
     :param client: The client to use for the request
+    :param page_size: The number of tokens requested per page
+    :param concurrency: The maximum number of pages requested at the same time
 
     :return: The HEC configuration for the stack
     """
-    _, response = client.get(get_hec_url(stack=stack_name), {}, {})
-    logging.debug("HEC configuration for %s: %s", stack_name, response)
-
-    if not isinstance(response, dict) or "http-event-collectors" not in response:
+    def items(response) -> list:
+        if not isinstance(response, dict) or "http-event-collectors" not in response:
+            return []
+
+        return response.get("http-event-collectors", []) or []
+
+    collectors = fetch_all_pages(
+        client=client,
+        url=get_hec_url(stack=stack_name),
+        items=items,
+        page_size=page_size,
+        concurrency=concurrency,
+    )
+    logging.debug("HEC configuration for %s: %s", stack_name, collectors)
+
+    if not collectors:
         logging.info("Did not find any existing HEC configuration")
         return []
 
-    collectors = response.get("http-event-collectors", [])
-
     return [
         HecToken(
             token=collector["token"],
@@ -52,62 +72,113 @@ def get_hec(stack_name: str, client: Client) -> List[HecToken]:
     ]
 
 
-def set_hec(stack_config: StackConfiguration, client: Client) -> None:
+def read_hec(
+    stack_config: StackConfiguration, client: Client, config: Union[None, Config] = None
+) -> List[HecToken]:
     """
-    Fetches current HEC configuration and updates it based on the stack configuration
-    If new tokens are found, they are created and added
-    If tokens are missing, they are deleted
+    Fetches the current HEC tokens, or takes them from a snapshot that is recent enough
 
     :param stack_config: The stack configuration to use
     :param client: The client to use for the request
+    :param config: The global configuration
 
-    :return: None
+    :return: The current HEC tokens
     """
-    new_hec = stack_config.hec
-    new_hec_names = [hec.name for hec in new_hec]
-
-    current_hec = get_hec(client=client, stack_name=stack_config.stack_name)
-    current_hec_names = [hec.name for hec in current_hec]
+    config = config or Config()
+    return get_snapshot_cache(config).fetch(
+        stack_name=client.stack_name,
+        feature="hec",
+        state_type=List[HecToken],
+        fetch=lambda: get_hec(
+            client=client,
+            stack_name=stack_config.stack_name,
+            page_size=config.pagination.page_size,
+            concurrency=config.pagination.concurrency,
+        ),
+    )
+
+
+def plan_hec(
+    stack_config: StackConfiguration,
+    client: Client,
+    config: Union[None, Config] = None,
+    state: Union[None, RemoteState] = None,
+) -> List[Operation]:
+    """
+    Fetches current HEC configuration and computes the operations to match the stack configuration
 
-    to_delete = []
-    to_add = []
-    to_update = []
+    :param stack_config: The stack configuration to use
+    :param client: The client to use for the request
+    :param config: The global configuration
+    :param state: The prefetched remote state, fetched if it does not contain the feature
 
-    for token in new_hec:
-        if token.name not in current_hec_names:
-            to_add.append(token)
-        elif token not in current_hec:
-            to_update.append(token)
+    :return: The operations to apply
+    """
+    config = config or Config()
+    current_hec = get_current(
+        state, "hec", lambda: read_hec(stack_config=stack_config, client=client, config=config)
+    )
+
+    with get_recorder().timed(stack_name=client.stack_name, feature="hec", phase="diff"):
+        plan = diff(
+            desired=iter_objects(stack_config, "hec"),
+            current=current_hec,
+            key=lambda token: token.name,
+            protected=[DEFAULT_HEC_NAME],
+        )
 
-    for token in current_hec:
-        if token.name not in new_hec_names and token.name != DEFAULT_HEC_NAME:
-            to_delete.append(token)
+    operations = []
+    hec_url = get_hec_url(stack=stack_config.stack_name)
 
-    for token in to_delete:
+    for token in plan.to_delete:
         if stack_config.should_delete:
-            logging.info("Deleting HEC token %s", token.name)
-            client.delete(
-                get_hec_url(stack=stack_config.stack_name) + f"/{token.name}",
-                {},
-                {},
+            operations.append(
+                Operation(
+                    feature="hec",
+                    kind="HEC token",
+                    action=Action.DELETE,
+                    name=token.name,
+                    method="DELETE",
+                    url=hec_url + f"/{token.name}",
+                )
             )
-            logging.info("HEC token deleted: %s", token.name)
         else:
             logging.warning("Would have deleted HEC token %s", token.name)
 
-    for token in to_add:
-        logging.info("Creating HEC token %s", token.name)
-        client.post(
-            get_hec_url(stack=stack_config.stack_name), {}, token.to_create_dict(),
+    for token in plan.to_add:
+        operations.append(
+            Operation(
+                feature="hec",
+                kind="HEC token",
+                action=Action.ADD,
+                name=token.name,
+                method="POST",
+                url=hec_url,
+                data=token.to_create_dict(),
+                requires=[get_resource_key("indexes", index) for index in token.referenced_indexes()],
+            )
         )
-        logging.info("HEC token created: %s", token.name)
-
-    for token in to_update:
-        logging.info("Updating HEC token %s", token.name)
-        client.patch(
-            get_hec_url(stack=stack_config.stack_name) + f"/{token.name}",
-            {},
-            token.to_update_dict(),
+
+    for change in plan.to_update:
+        token = change.desired
+        data, previous = token.to_update_delta(change.current)
+        if not data:
+            logging.warning(
+                "Can not update HEC token %s, it only differs in settings an update can not change", token.name
+            )
+            continue
+        operations.append(
+            Operation(
+                feature="hec",
+                kind="HEC token",
+                action=Action.UPDATE,
+                name=token.name,
+                method="PATCH",
+                url=hec_url + f"/{token.name}",
+                data=data,
+                previous=previous,
+                requires=[get_resource_key("indexes", index) for index in token.referenced_indexes()],
+            )
         )
 
-    logging.info("HEC configuration updated")
\ No newline at end of file
+    return operations
@@ -1,8 +1,18 @@
 import logging
 
-from typing import List
+from typing import Any, List, Union
+from cache import get_snapshot_cache
 from client import Client
-from models import Index, StackConfiguration
+from pagination import fetch_all_pages
+from diff import diff
+from executor import Action, Operation, OperationResult, apply_operations, check_results
+from journal import ApplyJournal
+from metrics import get_recorder
+from prefetch import RemoteState, get_current
+from sources import iter_objects
+from models import Index, Config, StackConfiguration
+from readiness import ReadinessBoard, ReadinessError
+from tracker import Check, PollState, TrackStatus, wait_until_ready
 
 INDEX_URL = "{stack_name}/adminconfig/v2/indexes"
 DEFAULT_INDEX_NAMES = [
@@ -26,21 +36,32 @@ def get_index_url(stack_name: str) -> str:
     return INDEX_URL.format(stack_name=stack_name)
 
 
-def get_indexes(stack_name: str, client: Client) -> List[Index]:
+def get_indexes(stack_name: str, client: Client, page_size: int = 100, concurrency: int = 4) -> List[Index]:
     """
     Get the index configuration for a given stack
 
     :param stack_name: The name of the stack
     :param client: The client to use for the request
+    :param page_size: The number of indexes requested per page
+    :param concurrency: The maximum number of pages requested at the same time
 
     :return: The index configuration for the stack
     """
-    _, response = client.get(get_index_url(stack_name=stack_name), {}, {})
-    logging.debug("Index configuration for %s: %s", stack_name, response)
+    def items(response) -> list:
+        if not isinstance(response, list):
+            logging.info("Invalid response type for indexes")
+            return []
+
+        return response
 
-    if not isinstance(response, list):
-        logging.info("Invalid response type for indexes")
-        return []
+    response = fetch_all_pages(
+        client=client,
+        url=get_index_url(stack_name=stack_name),
+        items=items,
+        page_size=page_size,
+        concurrency=concurrency,
+    )
+    logging.debug("Index configuration for %s: %s", stack_name, response)
 
     return [
         Index(
@@ -53,65 +74,205 @@ def get_indexes(stack_name: str, client: Client) -> List[Index]:
     ]
 
 
-def set_indexes(stack_config: StackConfiguration, client: Client) -> None:
+def read_indexes(
+    stack_config: StackConfiguration, client: Client, config: Union[None, Config] = None
+) -> List[Index]:
     """
-    Fetches current index configuration and updates it based on the stack configuration
-    If new indexes are found, they are created and added
-    If indexes are missing, they are deleted
+    Fetches the current indexes, or takes them from a snapshot that is recent enough
 
     :param stack_config: The stack configuration to use
     :param client: The client to use for the request
+    :param config: The global configuration
+
+    :return: The current indexes
+    """
+    config = config or Config()
+    return get_snapshot_cache(config).fetch(
+        stack_name=client.stack_name,
+        feature="indexes",
+        state_type=List[Index],
+        fetch=lambda: get_indexes(
+            stack_name=stack_config.stack_name,
+            client=client,
+            page_size=config.pagination.page_size,
+            concurrency=config.pagination.concurrency,
+        ),
+    )
 
-    :return: None
+
+def plan_indexes(
+    stack_config: StackConfiguration,
+    client: Client,
+    config: Union[None, Config] = None,
+    state: Union[None, RemoteState] = None,
+) -> List[Operation]:
     """
-    new_indexes = stack_config.indexes
-    new_indexe_names = [index.name for index in new_indexes]
+    Fetches current index configuration and computes the operations to match the stack configuration
 
-    current_indexes = get_indexes(stack_name=stack_config.stack_name, client=client)
-    current_index_names = [index.name for index in current_indexes]
+    :param stack_config: The stack configuration to use
+    :param client: The client to use for the request
+    :param config: The global configuration
+    :param state: The prefetched remote state, fetched if it does not contain the feature
 
-    to_delete = []
-    to_add = []
-    to_update = []
+    :return: The operations to apply
+    """
+    config = config or Config()
+    current_indexes = get_current(
+        state, "indexes", lambda: read_indexes(stack_config=stack_config, client=client, config=config)
+    )
 
-    for index in new_indexes:
-        if index.name not in current_index_names:
-            to_add.append(index)
-        elif index not in current_indexes:
-            to_update.append(index)
+    with get_recorder().timed(stack_name=client.stack_name, feature="indexes", phase="diff"):
+        plan = diff(
+            desired=iter_objects(stack_config, "indexes"),
+            current=current_indexes,
+            key=lambda index: index.name,
+            protected=DEFAULT_INDEX_NAMES,
+        )
 
-    for index in current_indexes:
-        if index.name not in new_indexe_names and index.name not in DEFAULT_INDEX_NAMES:
-            to_delete.append(index)
+    operations = []
+    index_url = get_index_url(stack_name=stack_config.stack_name)
 
-    for index in to_delete:
+    for index in plan.to_delete:
         if stack_config.should_delete:
-            logging.info("Deleting index %s", index.name)
-            client.delete(
-                get_index_url(stack_name=stack_config.stack_name) + f"/{index.name}",
-                {},
-                {},
+            operations.append(
+                Operation(
+                    feature="indexes",
+                    kind="index",
+                    action=Action.DELETE,
+                    name=index.name,
+                    method="DELETE",
+                    url=index_url + f"/{index.name}",
+                )
             )
-            logging.info("Index deleted: %s", index.name)
         else:
             logging.warning("Would have deleted index %s", index.name)
 
-    for index in to_add:
-        logging.info("Creating index %s", index.name)
-        client.post(
-            get_index_url(stack_name=stack_config.stack_name),
-            {},
-            index.to_create_dict(),
+    for index in plan.to_add:
+        operations.append(
+            Operation(
+                feature="indexes",
+                kind="index",
+                action=Action.ADD,
+                name=index.name,
+                method="POST",
+                url=index_url,
+                data=index.to_create_dict(),
+            )
         )
-        logging.info("Index created: %s", index.name)
-
-    for index in to_update:
-        logging.info("Updating index %s", index.name)
-        client.patch(
-            get_index_url(stack_name=stack_config.stack_name) + f"/{index.name}",
-            {},
-            index.to_update_dict(),
+
+    for change in plan.to_update:
+        index = change.desired
+        data, previous = index.to_update_delta(change.current)
+        if not data:
+            logging.warning(
+                "Can not update index %s, it only differs in settings an update can not change", index.name
+            )
+            continue
+        operations.append(
+            Operation(
+                feature="indexes",
+                kind="index",
+                action=Action.UPDATE,
+                name=index.name,
+                method="PATCH",
+                url=index_url + f"/{index.name}",
+                data=data,
+                previous=previous,
+            )
         )
-        logging.info("Index updated: %s", index.name)
+
+    return operations
+
+
+def get_index_check(client: Client, operation: Operation) -> Check:
+    """
+    Build the status check of an index that was requested to be created or updated
+    The index is ready once ACS returns it with the requested settings
+
+    :param client: The client to use for the requests
+    :param operation: The create or update operation
+
+    :return: The status check of the index
+    """
+    index_url = operation.url if operation.action == Action.UPDATE else operation.url + f"/{operation.name}"
+    # Compare enums like the datatype by their value, as ACS returns plain strings
+    expected = {key: getattr(value, "value", value) for key, value in operation.data.items() if key != "name"}
+
+    async def check():
+        status_code, index = await client.async_client.request("GET", index_url, {}, allowed_status=[404])
+        if status_code == 404 or not isinstance(index, dict):
+            return PollState.PENDING, "not created yet"
+
+        differing = [key for key, value in expected.items() if key in index and str(index[key]) != str(value)]
+        if differing:
+            return PollState.PENDING, f"{', '.join(differing)} not updated yet"
+
+        return PollState.READY, "ready"
+
+    return check
+
+
+def apply_indexes(
+    client: Client,
+    operations: List[Operation],
+    stack_name: str,
+    config: Union[None, Config] = None,
+    board: Union[None, ReadinessBoard] = None,
+    journal: Union[None, ApplyJournal] = None,
+) -> List[OperationResult]:
+    """
+    Applies the planned index operations and waits until each created or updated index is ready
+    Every index is polled right after its request succeeded and marked on the board as soon as it is ready,
+    so operations of other features referencing it do not wait for the remaining indexes
+
+    :param client: The client to use for the request
+    :param operations: The operations from plan_indexes
+    :param stack_name: The name of the stack as written in the stack configuration
+    :param config: The global configuration
+    :param board: The readiness board of the run
+    :param journal: The journal of the run
+
+    :return: The result of each applied operation
+    """
+    config = config or Config()
+    tracking = config.index_tracking
+    changed = [operation.name for operation in operations if operation.action in (Action.ADD, Action.UPDATE)]
+    if board is not None:
+        board.declare("indexes", changed)
+
+    async def wait_for_index(operation: Operation, response: Any) -> None:
+        if operation.action == Action.DELETE:
+            return
+
+        if tracking.enabled:
+            outcome = await wait_until_ready(operation.name, get_index_check(client=client, operation=operation), tracking)
+            if outcome.status != TrackStatus.READY:
+                error = f"{outcome.status.value} after {outcome.elapsed:.0f}s: {outcome.detail}"
+                if board is not None:
+                    board.mark_failed("indexes", operation.name, error)
+                raise ReadinessError(error)
+
+            logging.debug("Index %s is ready after %.1fs", operation.name, outcome.elapsed)
+
+        if board is not None:
+            board.mark_ready("indexes", operation.name)
+
+    results = apply_operations(
+        client=client,
+        operations=operations,
+        max_in_flight=config.max_in_flight,
+        cache=get_snapshot_cache(config),
+        board=board,
+        journal=journal,
+        follow_up=wait_for_index,
+    )
+
+    if board is not None:
+        for result in results:
+            if not result.succeeded:
+                board.mark_failed("indexes", result.operation.name, result.error)
+
+    check_results(results)
 
     logging.info("Index configuration updated")
+    return results
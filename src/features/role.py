@@ -1,12 +1,33 @@
 import logging
 
-from typing import List
+from typing import List, Union
+from cache import get_snapshot_cache
 from client import Client
-from models import Role, StackConfiguration
+from pagination import fetch_all_pages
+from diff import diff
+from executor import Action, Operation
+from metrics import get_recorder
+from prefetch import RemoteState, get_current
+from sources import iter_objects
+from readiness import get_resource_key
+from models import Role, Config, StackConfiguration
 
 ROLE_URL = "/services/authorization/roles?output_mode=json"
 ROLE_NAME_URL = "/services/authorization/roles/{role_name}?output_mode=json"
 
+# The attributes read by get_roles, splunkd only returns these in the content of each entry
+ROLE_FIELDS = [
+    "capabilities",
+    "defaultApp",
+    "imported_roles",
+    "srchDiskQuota",
+    "srchFilter",
+    "srchIndexesAllowed",
+    "srchIndexesDefault",
+    "srchJobsQuota",
+    "srchTimeWin",
+]
+
 DEFAULT_ROLES = [
     "admin",
     "can_delete",
@@ -41,19 +62,35 @@ def get_role_name_url(role_name: str) -> str:
     return ROLE_NAME_URL.format(role_name=role_name)
 
 
-def get_roles(client: Client) -> List[Role]:
+def get_roles(client: Client, page_size: int = 100, concurrency: int = 4) -> List[Role]:
     """
     Get the role configuration for a given stack
+    Only the attributes used by the Role model are requested
 
     :param client: The client to use for the request
+    :param page_size: The number of roles requested per page
+    :param concurrency: The maximum number of pages requested at the same time
 
     :return: The role configuration for the stack
     """
-    _, response = client.get(get_role_url(), {}, {})
-    if not response or not isinstance(response, dict):
-        raise ValueError("Invalid response from server - expected dictionary")
-
-    role_content = response.get("entry", [])
+    def items(response) -> list:
+        if not response or not isinstance(response, dict):
+            raise ValueError("Invalid response from server - expected dictionary")
+
+        return response.get("entry", []) or []
+
+    def total(response) -> Union[None, int]:
+        return response.get("paging", {}).get("total")
+
+    role_content = fetch_all_pages(
+        client=client,
+        url=get_role_url(),
+        items=items,
+        page_size=page_size,
+        concurrency=concurrency,
+        params={"f": ROLE_FIELDS},
+        total=total,
+    )
     return [
         Role(
             name=role["name"],
@@ -71,65 +108,117 @@ def get_roles(client: Client) -> List[Role]:
     ]
 
 
-def set_roles(stack_config: StackConfiguration, client: Client) -> None:
+def read_roles(
+    stack_config: StackConfiguration, client: Client, config: Union[None, Config] = None
+) -> List[Role]:
     """
-    Fetches current role configuration and updates it based on the stack configuration
-    If new roles are found, they are created and added
-    If roles are missing, they are deleted
+    Fetches the current roles, or takes them from a snapshot that is recent enough
 
     :param stack_config: The stack configuration to use
     :param client: The client to use for the request
+    :param config: The global configuration
 
-    :return: None
+    :return: The current roles
     """
-    new_roles = stack_config.roles
-    new_role_names = [role.name for role in new_roles]
-
-    current_roles = get_roles(client=client)
-    current_role_names = [role.name for role in current_roles]
+    config = config or Config()
+    return get_snapshot_cache(config).fetch(
+        stack_name=client.stack_name,
+        feature="roles",
+        state_type=List[Role],
+        fetch=lambda: get_roles(
+            client=client,
+            page_size=config.pagination.page_size,
+            concurrency=config.pagination.concurrency,
+        ),
+    )
+
+
+def plan_roles(
+    stack_config: StackConfiguration,
+    client: Client,
+    config: Union[None, Config] = None,
+    state: Union[None, RemoteState] = None,
+) -> List[Operation]:
+    """
+    Fetches current role configuration and computes the operations to match the stack configuration
 
-    to_delete = []
-    to_add = []
-    to_update = []
+    :param stack_config: The stack configuration to use
+    :param client: The client to use for the request
+    :param config: The global configuration
+    :param state: The prefetched remote state, fetched if it does not contain the feature
 
-    for role in new_roles:
-        if role.name not in current_role_names:
-            to_add.append(role)
-        else:
-            current_role = next((r for r in current_roles if r.name == role.name), None)
-            if role != current_role and role.name not in DEFAULT_ROLES:
-                to_update.append(role)
+    :return: The operations to apply
+    """
+    config = config or Config()
+    current_roles = get_current(
+        state, "roles", lambda: read_roles(stack_config=stack_config, client=client, config=config)
+    )
+
+    with get_recorder().timed(stack_name=client.stack_name, feature="roles", phase="diff"):
+        plan = diff(
+            desired=iter_objects(stack_config, "roles"),
+            current=current_roles,
+            key=lambda role: role.name,
+            protected=DEFAULT_ROLES,
+            read_only=DEFAULT_ROLES,
+        )
 
-    for role in current_roles:
-        if role.name not in new_role_names and role.name not in DEFAULT_ROLES:
-            to_delete.append(role)
+    operations = []
 
-    for role in to_delete:
+    for role in plan.to_delete:
         if stack_config.should_delete:
-            logging.info("Deleting role %s", role.name)
-            client.delete(
-                get_role_name_url(role_name=role.name),
-                {},
-                {},
-                as_json=False,
+            operations.append(
+                Operation(
+                    feature="roles",
+                    kind="role",
+                    action=Action.DELETE,
+                    name=role.name,
+                    method="DELETE",
+                    url=get_role_name_url(role_name=role.name),
+                    as_json=False,
+                )
             )
-            logging.info("Role deleted: %s", role.name)
         else:
             logging.warning("Would have deleted role %s", role.name)
 
-    for role in to_add:
-        logging.info("Creating role %s", role.name)
-        client.post(get_role_url(), {}, role.to_create_dict(), as_json=False,)
-        logging.info("Role created: %s", role.name)
-
-    for role in to_update:
-        logging.info("Updating role %s", role.name)
-        client.post(
-            get_role_name_url(role_name=role.name),
-            {},
-            role.to_update_dict(),
-            as_json=False,
+    for role in plan.to_add:
+        operations.append(
+            Operation(
+                feature="roles",
+                kind="role",
+                action=Action.ADD,
+                name=role.name,
+                method="POST",
+                url=get_role_url(),
+                data=role.to_create_dict(),
+                requires=[get_resource_key("indexes", index) for index in role.referenced_indexes()],
+                as_json=False,
+            )
+        )
+
+    for change in plan.to_update:
+        role = change.desired
+        data, previous = role.to_update_delta(change.current)
+        if not data:
+            logging.warning(
+                "Can not update role %s, it only differs in settings an update can not change", role.name
+            )
+            continue
+        # An empty list is skipped by the form conversion, an empty value makes splunkd clear the field
+        data = {key: [""] if value == [] else value for key, value in data.items()}
+        operations.append(
+            Operation(
+                feature="roles",
+                kind="role",
+                action=Action.UPDATE,
+                name=role.name,
+                method="POST",
+                url=get_role_name_url(role_name=role.name),
+                data=data,
+                previous=previous,
+                requires=[get_resource_key("indexes", index) for index in role.referenced_indexes()],
+                as_json=False,
+            )
         )
-        logging.info("Role updated: %s", role.name)
 
-    logging.info("Role configuration updated")
+    return operations
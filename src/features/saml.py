@@ -1,11 +1,26 @@
 import logging
 
 import xml.etree.ElementTree as ET
-from typing import Union
+from typing import List, Union
+from cache import get_snapshot_cache
 from client import Client
-from models import SAML, StackConfiguration
+from diff import diff
+from executor import Action, Operation, OperationResult, apply_operations, check_results
+from journal import ApplyJournal
+from metrics import get_recorder
+from prefetch import RemoteState, get_current
+from models import SAML, Config, StackConfiguration
+from readiness import ReadinessBoard
+from secret_fingerprint import (
+    get_fingerprint_key,
+    get_secret_fingerprint,
+    read_secret_fingerprint,
+    write_secret_fingerprint,
+)
 
 SAML_URL = "/services/authentication/providers/SAML"
+# A stack has a single SAML provider, so the desired and current provider are always the same object
+SAML_PROVIDER_KEY = "SAML"
 
 
 def get_saml_url() -> str:
@@ -59,36 +74,152 @@ def get_saml(client: Client) -> Union[SAML, None]:
         alias_email=key_values["attributeAliasMail"],
         alias_realname=key_values["attributeAliasRealName"],
         alias_roles=key_values["attributeAliasRole"],
-        script_path=key_values.get("scriptPath", ""),
-        use_auth_extentsion_token_only=key_values.get("useAuthExtensionTokenOnly", True),
+        script_path=key_values.get("scriptPath") or "",
+        use_auth_extentsion_token_only=key_values.get(
+            "useAuthExtForTokenAuthOnly", key_values.get("useAuthExtensionTokenOnly", True)
+        ),
     )
 
 
-def set_saml(stack_config: StackConfiguration, client: Client) -> None:
+def read_saml(
+    stack_config: StackConfiguration, client: Client, config: Union[None, Config] = None
+) -> Union[SAML, None]:
     """
-    Set the SAML configuration for a given stack
+    Fetches the current SAML configuration, or takes it from a snapshot that is recent enough
 
     :param stack_config: The stack configuration to use
     :param client: The client to use for the request
+    :param config: The global configuration
 
-    :return: None
+    :return: The current SAML configuration
+    """
+    config = config or Config()
+    if not stack_config.saml:
+        return None
+
+    return get_snapshot_cache(config).fetch(
+        stack_name=client.stack_name,
+        feature="saml",
+        state_type=Union[SAML, None],
+        fetch=lambda: get_saml(client=client),
+    )
+
+
+def plan_saml(
+    stack_config: StackConfiguration,
+    client: Client,
+    config: Union[None, Config] = None,
+    state: Union[None, RemoteState] = None,
+) -> List[Operation]:
+    """
+    Fetches the current SAML configuration and computes the operation to match the stack configuration
+    The settings that can be read back are compared with the stack, the others by the fingerprint
+    recorded by the last successful apply, so the provider is only updated if something changed
+
+    :param stack_config: The stack configuration to use
+    :param client: The client to use for the request
+    :param config: The global configuration
+    :param state: The prefetched remote state, fetched if it does not contain the feature
+
+    :return: The operations to apply
     """
     saml = stack_config.saml
     if not saml:
         logging.info("No SAML configuration to configure found - skipping")
-        return
-
-    current_config = get_saml(client=client)
-    if not current_config:
-        _, _ = client.post(get_saml_url(), {}, saml.to_create_dict(), as_json=False)
-        logging.info("SAML configuration created")
-    elif current_config != saml:
-        _, _ = client.post(
-            get_saml_url() + "/" + current_config.name,
-            {},
-            saml.to_update_dict(),
-            as_json=False,
+        return []
+
+    config = config or Config()
+    current_config = get_current(
+        state, "saml", lambda: read_saml(stack_config=stack_config, client=client, config=config)
+    )
+    with get_recorder().timed(stack_name=client.stack_name, feature="saml", phase="diff"):
+        plan = diff(
+            desired=[saml],
+            current=[current_config] if current_config else [],
+            key=lambda _: SAML_PROVIDER_KEY,
         )
-        logging.info("SAML configuration updated")
-    else:
+
+    secret_fingerprint = get_secret_fingerprint(saml.secret_content(), get_fingerprint_key(config.secret_fingerprints))
+
+    if plan.to_add:
+        return [
+            Operation(
+                feature="saml",
+                kind="SAML configuration",
+                action=Action.ADD,
+                name=saml.name,
+                method="POST",
+                url=get_saml_url(),
+                data=saml.to_create_dict(),
+                as_json=False,
+                secret_fingerprint=secret_fingerprint,
+            )
+        ]
+
+    current_name = current_config.name if current_config else saml.name
+    recorded = read_secret_fingerprint(config.secret_fingerprints, client.stack_name, "saml")
+
+    if not plan.to_update and recorded == secret_fingerprint:
         logging.info("SAML configuration unchanged")
+        return []
+
+    if not plan.to_update:
+        logging.info(
+            "SAML certificate or script arguments %s, updating the SAML configuration",
+            "were never applied by this tool" if recorded is None else "changed",
+        )
+
+    return [
+        Operation(
+            feature="saml",
+            kind="SAML configuration",
+            action=Action.UPDATE,
+            name=current_name,
+            method="POST",
+            url=get_saml_url() + "/" + current_name,
+            data=saml.to_update_dict(),
+            as_json=False,
+            secret_fingerprint=secret_fingerprint,
+        )
+    ]
+
+
+def apply_saml(
+    client: Client,
+    operations: List[Operation],
+    stack_name: str,
+    config: Union[None, Config] = None,
+    board: Union[None, ReadinessBoard] = None,
+    journal: Union[None, ApplyJournal] = None,
+) -> List[OperationResult]:
+    """
+    Applies the planned SAML operation and records its fingerprint once it succeeded
+
+    :param client: The client to use for the request
+    :param operations: The operations from plan_saml
+    :param stack_name: The name of the stack as written in the stack configuration
+    :param config: The global configuration
+    :param board: The readiness board of the run
+    :param journal: The journal of the run
+
+    :return: The result of each applied operation
+    """
+    config = config or Config()
+    results = apply_operations(
+        client=client,
+        operations=operations,
+        max_in_flight=1,
+        cache=get_snapshot_cache(config),
+        board=board,
+        journal=journal,
+    )
+
+    for result in results:
+        if result.succeeded and result.operation.secret_fingerprint is not None:
+            write_secret_fingerprint(
+                config.secret_fingerprints, client.stack_name, "saml", result.operation.secret_fingerprint
+            )
+
+    check_results(results)
+
+    return results
@@ -1,12 +1,22 @@
 import logging
 
-from typing import List
+from typing import List, Union
+from cache import get_snapshot_cache
 from client import Client
-from models import SAMLRoleMapping, StackConfiguration
-
-SAML_MAPPING_URL = "/services/admin/SAML-groups?output_mode=json&count=0"
+from pagination import fetch_all_pages
+from diff import diff
+from executor import Action, Operation
+from metrics import get_recorder
+from prefetch import RemoteState, get_current
+from sources import iter_objects
+from models import SAMLRoleMapping, Config, StackConfiguration
+
+SAML_MAPPING_URL = "/services/admin/SAML-groups?output_mode=json"
 SAML_ROLE_MAPPING_URL = "/services/admin/SAML-groups/{group}"
 
+# The attributes read by get_saml_mapping, splunkd only returns these in the content of each entry
+SAML_MAPPING_FIELDS = ["roles"]
+
 def get_saml_mapping_url() -> str:
     """
     Get the URL for a given stack
@@ -28,19 +38,35 @@ def get_saml_group_mapping_url(group: str) -> str:
     return SAML_ROLE_MAPPING_URL.format(group=group)
 
 
-def get_saml_mapping(client: Client) -> List[SAMLRoleMapping]:
+def get_saml_mapping(client: Client, page_size: int = 100, concurrency: int = 4) -> List[SAMLRoleMapping]:
     """
     Get the SAML role mapping configuration
+    Only the attributes used by the SAMLRoleMapping model are requested
 
     :param client: The client to use for the request
+    :param page_size: The number of groups requested per page
+    :param concurrency: The maximum number of pages requested at the same time
 
     :return: The SAML role mapping configuration
     """
-    _, response = client.get(get_saml_mapping_url(), {}, {})
-    if not response or not isinstance(response, dict):
-        raise ValueError("Invalid response from server - expected dictionary")
-
-    role_content = response.get("entry", [])
+    def items(response) -> list:
+        if not response or not isinstance(response, dict):
+            raise ValueError("Invalid response from server - expected dictionary")
+
+        return response.get("entry", []) or []
+
+    def total(response) -> Union[None, int]:
+        return response.get("paging", {}).get("total")
+
+    role_content = fetch_all_pages(
+        client=client,
+        url=get_saml_mapping_url(),
+        items=items,
+        page_size=page_size,
+        concurrency=concurrency,
+        params={"f": SAML_MAPPING_FIELDS},
+        total=total,
+    )
     return [
         SAMLRoleMapping(
             group=role["name"],
@@ -50,72 +76,104 @@ def get_saml_mapping(client: Client) -> List[SAMLRoleMapping]:
     ]
 
 
-def set_saml_mapping(stack_config: StackConfiguration, client: Client) -> None:
+def read_saml_mapping(
+    stack_config: StackConfiguration, client: Client, config: Union[None, Config] = None
+) -> List[SAMLRoleMapping]:
     """
-    Fetches current SAML role mapping configuration and updates it based on the stack configuration
-    If new mappings are found, they are created and added
-    If mappings are missing, they are deleted
+    Fetches the current SAML role mappings, or takes them from a snapshot that is recent enough
 
     :param stack_config: The stack configuration to use
     :param client: The client to use for the request
+    :param config: The global configuration
 
-    :return: None
+    :return: The current SAML role mappings
     """
-    new_mappings = stack_config.saml_role_mappings
-    new_mapping_names = [mapping.group for mapping in new_mappings]
-
-    current_mappings = get_saml_mapping(client=client)
-    current_mapping_names = [mapping.group for mapping in current_mappings]
+    config = config or Config()
+    return get_snapshot_cache(config).fetch(
+        stack_name=client.stack_name,
+        feature="saml_mapping",
+        state_type=List[SAMLRoleMapping],
+        fetch=lambda: get_saml_mapping(
+            client=client,
+            page_size=config.pagination.page_size,
+            concurrency=config.pagination.concurrency,
+        ),
+    )
+
+
+def plan_saml_mapping(
+    stack_config: StackConfiguration,
+    client: Client,
+    config: Union[None, Config] = None,
+    state: Union[None, RemoteState] = None,
+) -> List[Operation]:
+    """
+    Fetches current SAML role mapping configuration and computes the operations to match the stack configuration
 
-    to_delete = []
-    to_add = []
-    to_update = []
+    :param stack_config: The stack configuration to use
+    :param client: The client to use for the request
+    :param config: The global configuration
+    :param state: The prefetched remote state, fetched if it does not contain the feature
 
-    for mapping in new_mappings:
-        if mapping.group not in current_mapping_names:
-            to_add.append(mapping)
-        else:
-            current_mapping = next(
-                (m for m in current_mappings if m.group == mapping.group), None
-            )
-            if current_mapping is not None and current_mapping != mapping:
-                to_update.append(mapping)
+    :return: The operations to apply
+    """
+    config = config or Config()
+    current_mappings = get_current(
+        state, "saml_mapping", lambda: read_saml_mapping(stack_config=stack_config, client=client, config=config)
+    )
+
+    with get_recorder().timed(stack_name=client.stack_name, feature="saml_mapping", phase="diff"):
+        plan = diff(
+            desired=iter_objects(stack_config, "saml_role_mappings"),
+            current=current_mappings,
+            key=lambda mapping: mapping.group,
+        )
 
-    for mapping in current_mappings:
-        if mapping.group not in new_mapping_names:
-            to_delete.append(mapping)
+    operations = []
 
-    for mapping in to_delete:
+    for mapping in plan.to_delete:
         if stack_config.should_delete:
-            logging.info("Deleting SAML role mapping: %s", mapping.group)
-            client.delete(
-                get_saml_group_mapping_url(mapping.group),
-                {},
-                {},
-                as_json=False,
+            operations.append(
+                Operation(
+                    feature="saml_mapping",
+                    kind="SAML role mapping",
+                    action=Action.DELETE,
+                    name=mapping.group,
+                    method="DELETE",
+                    url=get_saml_group_mapping_url(mapping.group),
+                    as_json=False,
+                )
             )
-            logging.info("SAML role mapping deleted: %s", mapping.group)
         else:
             logging.warning("Would have deleted SAML role mapping: %s", mapping.group)
 
-    for mapping in to_add:
-        logging.info("Creating SAML role mapping: %s", mapping.group)
-        client.post(
-            get_saml_mapping_url(),
-            {},
-            mapping.to_create_dict(),
-            as_json=False,
+    for mapping in plan.to_add:
+        operations.append(
+            Operation(
+                feature="saml_mapping",
+                kind="SAML role mapping",
+                action=Action.ADD,
+                name=mapping.group,
+                method="POST",
+                url=get_saml_mapping_url(),
+                data=mapping.to_create_dict(),
+                as_json=False,
+            )
         )
-        logging.info("SAML role mapping created: %s", mapping.group)
-
-    for mapping in to_update:
-        logging.info("Updating SAML role mapping: %s", mapping.group)
-        client.post(
-            get_saml_group_mapping_url(mapping.group),
-            {},
-            mapping.to_update_dict(),
-            as_json=False,
+
+    for change in plan.to_update:
+        mapping = change.desired
+        operations.append(
+            Operation(
+                feature="saml_mapping",
+                kind="SAML role mapping",
+                action=Action.UPDATE,
+                name=mapping.group,
+                method="POST",
+                url=get_saml_group_mapping_url(mapping.group),
+                data=mapping.to_update_dict(),
+                as_json=False,
+            )
         )
-        logging.info("SAML role mapping updated: %s", mapping.group)
 
-    logging.info("SAML role mapping updated")
+    return operations
@@ -1,8 +1,16 @@
 import logging
 
-from typing import List
+from typing import Any, List, Union
+from cache import get_snapshot_cache
 from client import Client
-from models import SplunkbaseApp, StackConfiguration
+from diff import diff
+from executor import Action, Operation, OperationResult, apply_operations, check_results
+from journal import ApplyJournal
+from metrics import get_recorder
+from prefetch import RemoteState, get_current
+from readiness import ReadinessBoard
+from models import SplunkbaseApp, Config, StackConfiguration
+from tracker import Check, PollState, TrackStatus, wait_until_ready
 
 
 SPLUNKBASE_APPS_URL = "{stack_name}/adminconfig/v2/apps/victoria?splunkbase=true"
@@ -14,6 +22,14 @@ DEFAULT_APP_IDS = [
     "1876",
 ]
 
+INSTALLED_STATUS = "installed"
+
+
+class AppInstallError(Exception):
+    """
+    Raised when a requested app install or update failed or was not finished before the deadline
+    """
+
 
 def get_splunkbase_apps_url(stack_name: str) -> str:
     """
@@ -56,72 +72,210 @@ def get_splunkbase_apps(stack_name: str, client: Client) -> List[SplunkbaseApp]:
         for app in response["apps"]
     ]
 
-def set_splunkbase_apps(stack_config: StackConfiguration, client: Client) -> None:
+def read_splunkbase_apps(
+    stack_config: StackConfiguration, client: Client, config: Union[None, Config] = None
+) -> List[SplunkbaseApp]:
     """
-    Fetches current Splunkbase apps configuration and updates it based on the stack configuration
-    If new apps are found, they are installed from Splunkbase
-    If app versions are different, they are updated
-    If apps are missing, they are deleted
+    Fetches the current Splunkbase apps, or takes them from a snapshot that is recent enough
 
     :param stack_config: The stack configuration to use
     :param client: The client to use for the request
+    :param config: The global configuration
+
+    :return: The current Splunkbase apps
     """
-    new_apps = stack_config.splunkbase_apps
-    new_app_ids = [app.splunkbase_id for app in new_apps]
+    config = config or Config()
+    return get_snapshot_cache(config).fetch(
+        stack_name=client.stack_name,
+        feature="splunkbase_apps",
+        state_type=List[SplunkbaseApp],
+        fetch=lambda: get_splunkbase_apps(stack_config.stack_name, client),
+    )
 
-    current_apps = get_splunkbase_apps(stack_config.stack_name, client)
-    current_app_ids = [app.splunkbase_id for app in current_apps]
 
-    to_add = []
-    to_update = []
-    to_delete = []
+def plan_splunkbase_apps(
+    stack_config: StackConfiguration,
+    client: Client,
+    config: Union[None, Config] = None,
+    state: Union[None, RemoteState] = None,
+) -> List[Operation]:
+    """
+    Fetches current Splunkbase apps configuration and computes the operations to match the stack configuration
+
+    :param stack_config: The stack configuration to use
+    :param client: The client to use for the request
+    :param config: The global configuration
+    :param state: The prefetched remote state, fetched if it does not contain the feature
 
-    for app in new_apps:
-        if app.splunkbase_id not in current_app_ids:
-            to_add.append(app)
-        elif app not in current_apps:
-            to_update.append(app)
+    :return: The operations to apply
+    """
+    config = config or Config()
+    current_apps = get_current(
+        state, "splunkbase_apps", lambda: read_splunkbase_apps(stack_config=stack_config, client=client, config=config)
+    )
 
-    for app in current_apps:
-        if app.splunkbase_id not in new_app_ids and app.splunkbase_id not in DEFAULT_APP_IDS:
-            to_delete.append(app)
+    with get_recorder().timed(stack_name=client.stack_name, feature="splunkbase_apps", phase="diff"):
+        plan = diff(
+            desired=stack_config.splunkbase_apps,
+            current=current_apps,
+            key=lambda app: app.splunkbase_id,
+            protected=DEFAULT_APP_IDS,
+        )
 
-    if not (to_add or to_update or to_delete):
+    if not plan.has_changes:
         logging.info("No changes to Splunkbase apps")
-        return
+        return []
 
-    client.authenticate_splunkbase()
+    operations = []
 
-    for app in to_delete:
+    for app in plan.to_delete:
         if stack_config.should_delete:
-            logging.info("Deleting app %s", app.splunkbase_id)
-            client.delete(
-                get_splunkbase_app_url(stack_name=stack_config.stack_name, app_id=app.app_id),
-                {},
-                {},
+            operations.append(
+                Operation(
+                    feature="splunkbase_apps",
+                    kind="app",
+                    action=Action.DELETE,
+                    name=app.splunkbase_id,
+                    method="DELETE",
+                    url=get_splunkbase_app_url(stack_name=stack_config.stack_name, app_id=app.app_id),
+                )
             )
-            logging.info("Requested uninstall for app %s", app.splunkbase_id)
         else:
             logging.warning("Would have deleted app %s", app.splunkbase_id)
 
-    for app in to_add:
-        logging.info("Adding app %s", app.splunkbase_id)
-        client.post(
-            get_splunkbase_apps_url(stack_name=stack_config.stack_name),
-            {"ACS-Licensing-Ack": app.license_url},
-            app.to_create_dict(),
-            as_json=False
+    for app in plan.to_add:
+        operations.append(
+            Operation(
+                feature="splunkbase_apps",
+                kind="app",
+                action=Action.ADD,
+                name=app.splunkbase_id,
+                method="POST",
+                url=get_splunkbase_apps_url(stack_name=stack_config.stack_name),
+                headers={"ACS-Licensing-Ack": app.license_url},
+                data=app.to_create_dict(),
+                as_json=False,
+            )
         )
-        logging.info("Requested install for app %s", app.splunkbase_id)
-
-    for app in to_update:
-        logging.info("Updating app %s", app.splunkbase_id)
-        current_app = next(a for a in current_apps if a.splunkbase_id == app.splunkbase_id)
-        client.patch(
-            get_splunkbase_app_url(stack_name=stack_config.stack_name, app_id=current_app.app_id),
-            {"ACS-Licensing-Ack": app.license_url},
-            app.to_update_dict(),
-            as_json=False
+
+    for change in plan.to_update:
+        app = change.desired
+        operations.append(
+            Operation(
+                feature="splunkbase_apps",
+                kind="app",
+                action=Action.UPDATE,
+                name=app.splunkbase_id,
+                method="PATCH",
+                url=get_splunkbase_app_url(stack_name=stack_config.stack_name, app_id=change.current.app_id),
+                headers={"ACS-Licensing-Ack": app.license_url},
+                data=app.to_update_dict(),
+                as_json=False,
+            )
         )
-        logging.info("Requested update for app %s", app.splunkbase_id)
+
+    return operations
+
+
+def apply_splunkbase_apps(
+    client: Client,
+    operations: List[Operation],
+    stack_name: str,
+    config: Union[None, Config] = None,
+    board: Union[None, ReadinessBoard] = None,
+    journal: Union[None, ApplyJournal] = None,
+) -> List[OperationResult]:
+    """
+    Authenticates with Splunkbase, applies the planned app operations and waits until the apps are installed
+    Apps that fail to install or are not installed before the deadline are reported as failed operations
+
+    :param client: The client to use for the request
+    :param operations: The operations from plan_splunkbase_apps
+    :param stack_name: The name of the stack as written in the stack configuration
+    :param config: The global configuration
+    :param board: The readiness board of the run
+    :param journal: The journal of the run
+
+    :return: The result of each applied operation
+    """
+    config = config or Config()
+    if not operations:
+        return []
+
+    client.authenticate_splunkbase()
+
+    tracking = config.app_tracking
+
+    # Installs and updates are asynchronous on ACS, a successful request only means the change was requested.
+    # Each app is polled right after its request, so it is only journaled once it is installed
+    async def wait_for_app(operation: Operation, response: Any) -> None:
+        if operation.action == Action.DELETE or not tracking.enabled:
+            return
+
+        check = get_app_check(client=client, operation=operation, response=response)
+        outcome = await wait_until_ready(operation.name, check, tracking)
+        if outcome.status != TrackStatus.READY:
+            raise AppInstallError(f"{outcome.status.value} after {outcome.elapsed:.0f}s: {outcome.detail}")
+
+        logging.info("App %s is ready after %.1fs", operation.name, outcome.elapsed)
+
+    results = apply_operations(
+        client=client,
+        operations=operations,
+        max_in_flight=config.max_in_flight,
+        cache=get_snapshot_cache(config),
+        board=board,
+        journal=journal,
+        follow_up=wait_for_app,
+    )
+
+    check_results(results)
+
+    logging.info("Splunkbase apps configuration updated")
+    return results
+
+
+def get_app_check(client: Client, operation: Operation, response: object) -> Check:
+    """
+    Build the status check of an app that was requested to be installed or updated
+    Updates are polled on the URL they were sent to, installs on the app reported in the response,
+    or on the list of apps if the response did not contain the app ID
+
+    :param client: The client to use for the requests
+    :param operation: The install or update operation
+    :param response: The response to the operation
+
+    :return: The status check of the app
+    """
+    splunkbase_id = operation.name
+    version = operation.data.get("version")
+    status_url = operation.url
+    is_list = False
+
+    if operation.action == Action.ADD:
+        app_id = response.get("appID") if isinstance(response, dict) else None
+        if app_id:
+            status_url = f"{operation.url.split('?')[0]}/{app_id}"
+        else:
+            is_list = True
+
+    async def check():
+        _, app = await client.async_client.get(status_url, {}, {})
+        if is_list:
+            listed = [listed for listed in app.get("apps", []) if str(listed.get("splunkbaseID")) == splunkbase_id]
+            if not listed:
+                return PollState.PENDING, "not listed yet"
+            app = listed[0]
+
+        # Apps without a status are not in progress
+        status = str(app.get("status") or INSTALLED_STATUS).lower()
+        if "fail" in status:
+            return PollState.FAILED, status
+
+        if status == INSTALLED_STATUS and app.get("version") == version:
+            return PollState.READY, f"version {version} {status}"
+
+        return PollState.PENDING, f"{status} with version {app.get('version')}"
+
+    return check
 
@@ -0,0 +1,219 @@
+import glob
+import logging
+import os
+import threading
+import time
+import yaml
+
+from concurrent.futures import ThreadPoolExecutor
+from pydantic import BaseModel, Field, ValidationError
+from typing import Callable, Dict, List, Tuple, Union
+from client import Client
+from models import Config, StackConfiguration
+from plan import StackPlan, check_plan_fresh, read_plan
+from runner import create_clients
+from scheduler import DEFAULT_WORKERS, FeatureResult, FeatureStatus
+from sources import resolve_sources
+
+DEFAULT_MAX_STACKS = 4
+DEFAULT_MAX_FEATURES = 16
+ENV_FILE_EXTENSIONS = (".yaml", ".yml")
+
+
+class FleetStack(BaseModel):
+    env_file: str
+    stack_config: StackConfiguration
+    acs_client: Client
+    api_client: Client
+    plan: Union[None, StackPlan] = None
+
+    class Config:
+        arbitrary_types_allowed = True
+
+
+class StackResult(BaseModel):
+    stack_name: str
+    env_file: str
+    succeeded: List[str] = Field(default=[])
+    failed: List[str] = Field(default=[])
+    skipped: List[str] = Field(default=[])
+    errors: Dict[str, str] = Field(default={})
+    duration: float = 0.0
+    error: str = ""
+
+    @property
+    def ok(self) -> bool:
+        return not (self.failed or self.skipped or self.error)
+
+
+StackRun = Callable[[FleetStack, int, threading.Semaphore], Dict[str, FeatureResult]]
+
+
+def find_env_files(pattern: str, extensions: Tuple[str, ...] = ENV_FILE_EXTENSIONS) -> List[str]:
+    """
+    Find the environment files for a directory or a glob pattern
+
+    :param pattern: A directory containing environment files or a glob pattern
+    :param extensions: The file extensions to include
+
+    :return: The sorted list of environment files
+    """
+    if os.path.isdir(pattern):
+        paths = [os.path.join(pattern, name) for name in os.listdir(pattern)]
+    else:
+        paths = glob.glob(pattern, recursive=True)
+
+    return sorted(path for path in paths if os.path.isfile(path) and path.endswith(extensions))
+
+
+def load_fleet(env_files: List[str], config: Config) -> Tuple[List[FleetStack], List[str]]:
+    """
+    Load and validate all environment files before anything is reconciled
+    Missing credentials and duplicate stacks are reported as errors as well
+
+    :param env_files: The environment files to load
+    :param config: The global configuration
+
+    :return: The validated stacks and the list of errors
+    """
+    stacks = []
+    errors = []
+    seen = {}
+
+    for env_file in env_files:
+        try:
+            with open(env_file, "r") as file:
+                stack_config = StackConfiguration.model_validate(yaml.safe_load(file))
+            resolve_sources(stack_config, os.path.dirname(os.path.abspath(env_file)))
+            acs_client, api_client = create_clients(stack_config=stack_config, config=config)
+        except yaml.YAMLError as e:
+            errors.append(f"{env_file}: Invalid YAML: {e}")
+            continue
+        except ValidationError as e:
+            for error in e.errors():
+                errors.append(f"{env_file}: {error['msg'].replace('Value error, ', '')}")
+            continue
+        except ValueError as e:
+            errors.append(f"{env_file}: {e}")
+            continue
+
+        if stack_config.stack_name in seen:
+            errors.append(f"{env_file}: Stack {stack_config.stack_name} is already configured in {seen[stack_config.stack_name]}")
+            continue
+
+        seen[stack_config.stack_name] = env_file
+        stacks.append(FleetStack(env_file=env_file, stack_config=stack_config, acs_client=acs_client, api_client=api_client))
+
+    return stacks, errors
+
+
+def load_plans(plan_files: List[str], config: Config, max_age: float) -> Tuple[List[FleetStack], List[str]]:
+    """
+    Load and validate all plan files before anything is applied
+    Stale plans, missing credentials and duplicate stacks are reported as errors
+
+    :param plan_files: The plan files to load
+    :param config: The global configuration
+    :param max_age: The maximum age of a plan in seconds
+
+    :return: The validated stacks with their plans and the list of errors
+    """
+    stacks = []
+    errors = []
+    seen = {}
+
+    for plan_file in plan_files:
+        try:
+            plan = read_plan(plan_file)
+            check_plan_fresh(plan, max_age=max_age)
+            stack_config = plan.stack_config()
+            acs_client, api_client = create_clients(stack_config=stack_config, config=config)
+        except ValidationError as e:
+            for error in e.errors():
+                errors.append(f"{plan_file}: {error['msg'].replace('Value error, ', '')}")
+            continue
+        except (OSError, ValueError) as e:
+            errors.append(f"{plan_file}: {e}")
+            continue
+
+        if plan.stack_name in seen:
+            errors.append(f"{plan_file}: Stack {plan.stack_name} is already planned in {seen[plan.stack_name]}")
+            continue
+
+        seen[plan.stack_name] = plan_file
+        stacks.append(FleetStack(env_file=plan_file, stack_config=stack_config, acs_client=acs_client, api_client=api_client, plan=plan))
+
+    return stacks, errors
+
+
+def _reconcile_stack(stack: FleetStack, run: StackRun, max_workers: int, gate: threading.Semaphore) -> StackResult:
+    started = time.monotonic()
+    result = StackResult(stack_name=stack.stack_config.stack_name, env_file=stack.env_file)
+
+    try:
+        features = run(stack, max_workers, gate)
+    except Exception as e:
+        logging.exception("Failed to bootstrap %s", result.stack_name)
+        result.error = str(e)
+    else:
+        for name, feature in features.items():
+            if feature.status == FeatureStatus.SUCCEEDED:
+                result.succeeded.append(name)
+                continue
+
+            if feature.status == FeatureStatus.FAILED:
+                result.failed.append(name)
+            else:
+                result.skipped.append(name)
+            result.errors[name] = feature.error
+
+    result.duration = time.monotonic() - started
+    return result
+
+
+def run_fleet(
+    stacks: List[FleetStack],
+    run: StackRun,
+    max_stacks: int = DEFAULT_MAX_STACKS,
+    max_workers: int = DEFAULT_WORKERS,
+    max_features: int = DEFAULT_MAX_FEATURES,
+) -> List[StackResult]:
+    """
+    Reconcile, plan or apply many stacks concurrently
+
+    :param stacks: The validated stacks
+    :param run: Runs the features of one stack, e.g. a wrapper around bootstrap_stack
+    :param max_stacks: The maximum number of stacks reconciled at the same time
+    :param max_workers: The maximum number of features running at the same time per stack
+    :param max_features: The maximum number of features running at the same time across all stacks
+
+    :return: The result of each stack, in the order of the given stacks
+    """
+    if max_stacks < 1 or max_features < 1:
+        raise ValueError("The concurrency limits must be at least 1")
+
+    gate = threading.BoundedSemaphore(max_features)
+
+    with ThreadPoolExecutor(max_workers=max_stacks, thread_name_prefix="stack") as executor:
+        futures = [executor.submit(_reconcile_stack, stack, run, max_workers, gate) for stack in stacks]
+        return [future.result() for future in futures]
+
+
+def print_summary(results: List[StackResult]) -> None:
+    """
+    Print a per-stack summary of the fleet run
+
+    :param results: The results of the fleet run
+
+    :return: None
+    """
+    width = max([len("STACK")] + [len(result.stack_name) for result in results])
+
+    print(f"{'STACK':<{width}}  {'STATUS':<7}  {'DURATION':>9}  SUCCEEDED  FAILED")
+    for result in results:
+        status = "ok" if result.ok else "failed"
+        failed = ", ".join(result.failed + [f"{name} (skipped)" for name in result.skipped]) or result.error or "-"
+        print(f"{result.stack_name:<{width}}  {status:<7}  {result.duration:>8.1f}s  {len(result.succeeded):>9}  {failed}")
+
+    failed_count = len([result for result in results if not result.ok])
+    print(f"{len(results) - failed_count} of {len(results)} stacks succeeded")
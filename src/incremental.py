@@ -0,0 +1,183 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+
+from datetime import datetime, timezone
+from pydantic import BaseModel, Field, ValidationError
+from typing import Dict, Set, Tuple, Union
+from models import Config, StackConfiguration
+from scheduler import FeatureResult, FeatureStatus
+from secret_fingerprint import get_fingerprint_key, get_secret_fingerprint
+from sources import get_source_digests
+
+RECORD_VERSION = 1
+
+# Settings that change the operations of every section
+SHARED_SETTINGS = ["should_delete", "api_url", "is_stage"]
+
+
+class ApplyRecord(BaseModel):
+    version: int = RECORD_VERSION
+    stack_name: str
+    # Fingerprint of the desired configuration of each feature at its last successful apply
+    fingerprints: Dict[str, str] = Field(default={})
+    applied_at: Union[None, datetime] = None
+    full_at: Union[None, datetime] = None
+
+
+def get_section_fingerprint(stack_config: StackConfiguration, section: str, config: Config) -> str:
+    """
+    Hash of the validated desired configuration of a section, together with the settings shared by all sections
+    and the templates and source files of the section
+    The SAML section also includes the secret fingerprint, so a rotated secret script argument counts as a change
+
+    :param stack_config: The stack configuration
+    :param section: The name of the section in the stack configuration
+    :param config: The global configuration
+
+    :return: The fingerprint of the section
+    """
+    content = stack_config.model_dump(mode="json", include=set(SHARED_SETTINGS + [section]))
+    content["sources"] = get_source_digests(stack_config, section)
+    content["templates"] = [
+        {"values": template.values, "objects": getattr(template, section)}
+        for template in stack_config.templates
+        if getattr(template, section, None)
+    ]
+    if section == "saml" and stack_config.saml is not None:
+        key = get_fingerprint_key(config.secret_fingerprints)
+        content["secret_fingerprint"] = get_secret_fingerprint(stack_config.saml.secret_content(), key)
+    encoded = json.dumps(content, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+def get_record_path(directory: str, stack_name: str) -> str:
+    """
+    Get the path of the apply record of a stack
+
+    :param directory: The directory containing the apply records
+    :param stack_name: The name of the stack
+
+    :return: The path of the apply record
+    """
+    return os.path.join(directory, f"{stack_name}.json")
+
+
+def read_record(path: str, stack_name: str) -> ApplyRecord:
+    """
+    Read the apply record of a stack
+    A missing or unreadable record is treated as if the stack was never applied
+
+    :param path: The path of the apply record
+    :param stack_name: The name of the stack
+
+    :return: The apply record
+    """
+    try:
+        with open(path, "r") as file:
+            record = ApplyRecord.model_validate_json(file.read())
+    except FileNotFoundError:
+        return ApplyRecord(stack_name=stack_name)
+    except (OSError, ValidationError) as error:
+        logging.warning("Ignoring unreadable apply record %s: %s", path, error)
+        return ApplyRecord(stack_name=stack_name)
+
+    if record.version != RECORD_VERSION or record.stack_name != stack_name:
+        logging.warning("Ignoring apply record %s written for another version or stack", path)
+        return ApplyRecord(stack_name=stack_name)
+
+    return record
+
+
+def write_record(record: ApplyRecord, path: str) -> None:
+    """
+    Atomically replace the apply record of a stack
+
+    :param record: The apply record to write
+    :param path: The path of the apply record
+
+    :return: None
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    temporary_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temporary_path, "w") as file:
+        file.write(record.model_dump_json(indent=2))
+    os.replace(temporary_path, path)
+
+
+def get_unchanged_features(
+    stack_name: str, fingerprints: Dict[str, str], config: Config, full: bool = False
+) -> Tuple[Set[str], bool]:
+    """
+    Get the features whose desired configuration did not change since their last successful apply
+    No feature is unchanged if a full reconcile is requested, incremental runs are disabled,
+    or the last full reconcile is older than the configured interval
+
+    :param stack_name: The name of the stack
+    :param fingerprints: The current fingerprint of each feature
+    :param config: The global configuration
+    :param full: Whether a full reconcile was requested
+
+    :return: The unchanged features and whether this run is a full reconcile
+    """
+    if full or not config.incremental.enabled:
+        return set(), True
+
+    record = read_record(get_record_path(config.incremental.directory, stack_name), stack_name)
+    if record.full_at is None:
+        logging.info("Running a full reconcile of %s as it was never fully reconciled", stack_name)
+        return set(), True
+
+    age = (datetime.now(timezone.utc) - record.full_at).total_seconds()
+    if age > config.incremental.full_interval:
+        logging.info("Running a full reconcile of %s as the last one was %.0fs ago", stack_name, age)
+        return set(), True
+
+    unchanged = {feature for feature, fingerprint in fingerprints.items() if record.fingerprints.get(feature) == fingerprint}
+    logging.info(
+        "Skipping %d unchanged features of %s: %s",
+        len(unchanged),
+        stack_name,
+        ", ".join(sorted(unchanged)) or "-",
+    )
+    return unchanged, False
+
+
+def record_results(
+    stack_name: str, fingerprints: Dict[str, str], results: Dict[str, FeatureResult], config: Config, full: bool
+) -> None:
+    """
+    Record the fingerprints of the features that were applied successfully
+    Features that did not succeed lose their fingerprint, so the next run reconciles them again
+
+    :param stack_name: The name of the stack
+    :param fingerprints: The fingerprint of each feature at the time it was planned
+    :param results: The result of each feature
+    :param config: The global configuration
+    :param full: Whether this run was a full reconcile
+
+    :return: None
+    """
+    if not config.incremental.enabled:
+        return
+
+    path = get_record_path(config.incremental.directory, stack_name)
+    record = read_record(path, stack_name)
+    now = datetime.now(timezone.utc)
+
+    for feature, result in results.items():
+        if result.status == FeatureStatus.SUCCEEDED and feature in fingerprints:
+            record.fingerprints[feature] = fingerprints[feature]
+        else:
+            record.fingerprints.pop(feature, None)
+
+    record.applied_at = now
+    if full and all(result.status == FeatureStatus.SUCCEEDED for result in results.values()):
+        record.full_at = now
+
+    write_record(record, path)
@@ -0,0 +1,197 @@
+import json
+import logging
+import os
+import threading
+import time
+
+from pydantic import BaseModel, Field
+from typing import Dict, IO, List, Set, Union
+from models import Journal
+
+JOURNAL_VERSION = 1
+
+
+class ResumeState(BaseModel):
+    """
+    What the unfinished runs of a stack did since the last run that finished
+    """
+
+    # Keys of the planned operations and the fingerprint of the configuration they were planned for, by feature
+    planned: Dict[str, Set[str]] = Field(default={})
+    fingerprints: Dict[str, str] = Field(default={})
+    done: Set[str] = Field(default=set())
+    completed: Set[str] = Field(default=set())
+
+
+def get_journal_path(config: Journal, stack_name: str) -> str:
+    """
+    Get the path of the journal of a stack
+
+    :param config: The journal configuration
+    :param stack_name: The name of the stack
+
+    :return: The path of the journal file
+    """
+    return os.path.join(config.directory, f"{stack_name}.jsonl")
+
+
+def read_journal(path: str) -> ResumeState:
+    """
+    Read the entries of the unfinished runs of a journal
+    A partially written last line of a run that died is ignored
+
+    :param path: The path of the journal file
+
+    :return: The state to resume from
+    """
+    state = ResumeState()
+    try:
+        with open(path, "r") as file:
+            lines = file.readlines()
+    except FileNotFoundError:
+        return state
+
+    for line in lines:
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            continue
+
+        kind = entry.get("type")
+        if kind == "finished" or (kind == "run" and entry.get("version") != JOURNAL_VERSION):
+            state = ResumeState()
+        elif kind == "planned":
+            state.planned.setdefault(entry["feature"], set()).update(entry["operations"])
+            state.fingerprints[entry["feature"]] = entry.get("fingerprint", "")
+        elif kind == "done":
+            state.done.add(entry["operation"])
+        elif kind == "completed":
+            state.completed.add(entry["feature"])
+
+    return state
+
+
+class ApplyJournal:
+    """
+    Append-only journal of the planned and applied operations of one stack
+    Entries are flushed to disk in batches of sync_every entries or every sync_interval seconds,
+    and immediately when a feature or the run completed
+    """
+
+    def __init__(self, path: str, fingerprints: Dict[str, str], config: Journal, resume: bool = False):
+        self.path = path
+        self.fingerprints = fingerprints
+        self.config = config
+        self.previous = read_journal(path) if resume else ResumeState()
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._synced = time.monotonic()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+
+        # A resumed run appends, so the entries of all unfinished runs count
+        flags = os.O_WRONLY | os.O_CREAT | (os.O_APPEND if resume else os.O_TRUNC)
+        self._file: IO[str] = os.fdopen(os.open(path, flags, 0o600), "a")
+
+    def _append(self, entry: Dict, sync: bool = False) -> None:
+        with self._lock:
+            self._file.write(json.dumps(entry, separators=(",", ":")) + "\n")
+            self._pending += 1
+
+            now = time.monotonic()
+            if sync or self._pending >= self.config.sync_every or now - self._synced >= self.config.sync_interval:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self._pending = 0
+                self._synced = now
+
+    def _resumable(self, feature: str) -> bool:
+        # Work recorded for a different configuration of the feature is not resumed
+        return self.previous.fingerprints.get(feature) == self.fingerprints.get(feature)
+
+    def start(self) -> None:
+        self._append({"type": "run", "version": JOURNAL_VERSION, "started_at": time.time()}, sync=True)
+
+    def is_completed(self, feature: str) -> bool:
+        """
+        Whether all operations of the feature were applied by an unfinished run
+
+        :param feature: The name of the feature
+
+        :return: Whether the feature can be skipped
+        """
+        return feature in self.previous.completed and self._resumable(feature)
+
+    def applied(self, feature: str) -> Union[None, Set[str]]:
+        """
+        Get the keys of the operations of a feature that an unfinished run applied
+
+        :param feature: The name of the feature
+
+        :return: The keys of the applied operations, or None if no unfinished run started the feature
+        """
+        if feature not in self.previous.planned or not self._resumable(feature):
+            return None
+
+        prefix = f"{feature}:"
+        return {key for key in self.previous.done if key.startswith(prefix)}
+
+    def planned(self, feature: str, operations: List[str]) -> None:
+        self._append(
+            {
+                "type": "planned",
+                "feature": feature,
+                "fingerprint": self.fingerprints.get(feature, ""),
+                "operations": operations,
+            }
+        )
+
+    def done(self, operation: str) -> None:
+        self._append({"type": "done", "operation": operation})
+
+    def completed(self, feature: str) -> None:
+        self._append({"type": "completed", "feature": feature}, sync=True)
+
+    def finish(self) -> None:
+        """
+        Mark the run as finished, so the next run with --resume starts from scratch
+
+        :return: None
+        """
+        self._append({"type": "finished", "finished_at": time.time()}, sync=True)
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+
+
+def open_journal(config: Journal, stack_name: str, fingerprints: Dict[str, str], resume: bool) -> Union[None, ApplyJournal]:
+    """
+    Open the journal of a stack for a run that applies changes
+
+    :param config: The journal configuration
+    :param stack_name: The name of the stack
+    :param fingerprints: The fingerprint of the desired configuration of each feature
+    :param resume: Whether to resume the unfinished runs of the journal
+
+    :return: The journal or None if journaling is disabled
+    """
+    if not config.enabled:
+        if resume:
+            logging.warning("Can not resume %s as the journal is disabled", stack_name)
+        return None
+
+    journal = ApplyJournal(get_journal_path(config, stack_name), fingerprints, config, resume=resume)
+    if resume:
+        logging.info(
+            "Resuming %s: %d features and %d operations were already applied",
+            stack_name,
+            len(journal.previous.completed),
+            len(journal.previous.done),
+        )
+
+    return journal
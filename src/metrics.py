@@ -0,0 +1,282 @@
+import json
+import logging
+import math
+import os
+import re
+import threading
+import time
+
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+from pydantic import BaseModel
+from typing import Dict, Iterator, List, Tuple, Union
+from models import Metrics
+
+METRIC_PREFIX = "sc_bootstrap"
+QUANTILES = (0.5, 0.95)
+
+# Collections whose next path segment is the name of an object, replaced so requests of all objects share one endpoint
+OBJECT_COLLECTIONS = [
+    "indexes",
+    "inputs/http-event-collectors",
+    "apps/victoria",
+    "authorization/roles",
+    "admin/SAML-groups",
+    "authentication/providers/SAML",
+]
+
+
+class RequestRecord(BaseModel):
+    stack_name: str
+    client: str
+    method: str
+    endpoint: str
+    # 0 if no response was received
+    status: int
+    bytes: int
+    latency: float
+
+
+class PhaseRecord(BaseModel):
+    stack_name: str
+    feature: str
+    phase: str
+    duration: float
+
+
+def get_endpoint_template(url: str) -> str:
+    """
+    Get the endpoint of a request URL without the stack name, object names and query
+
+    :param url: The URL relative to the base URL of the client
+
+    :return: The endpoint, e.g. {stack}/adminconfig/v2/indexes/{name}
+    """
+    path = urlsplit(url).path.strip("/")
+    path = re.sub(r"^[^/]+/adminconfig/", "{stack}/adminconfig/", path)
+
+    for collection in OBJECT_COLLECTIONS:
+        path = re.sub(rf"(/{re.escape(collection)})/[^/]+", r"\1/{name}", path)
+
+    return "/" + path if url.startswith("/") else path
+
+
+def percentile(values: List[float], quantile: float) -> float:
+    """
+    Get the nearest-rank percentile of the values
+
+    :param values: The values, in any order
+    :param quantile: The quantile between 0 and 1
+
+    :return: The percentile, or 0 if there are no values
+    """
+    if not values:
+        return 0.0
+
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(quantile * len(ordered)) - 1)]
+
+
+class MetricsRecorder:
+    """
+    Collects the timing of every request and of every feature phase of the process
+    Requests are recorded on the event loop of the clients and phases on the feature threads
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.requests: List[RequestRecord] = []
+        self.phases: List[PhaseRecord] = []
+        self.lock = threading.Lock()
+
+    def record_request(
+        self, stack_name: str, client: str, method: str, url: str, status: int, size: int, latency: float
+    ) -> None:
+        record = RequestRecord(
+            stack_name=stack_name,
+            client=client,
+            method=method.upper(),
+            endpoint=get_endpoint_template(url),
+            status=status,
+            bytes=size,
+            latency=latency,
+        )
+        with self.lock:
+            self.requests.append(record)
+
+    def record_phase(self, stack_name: str, feature: str, phase: str, duration: float) -> None:
+        record = PhaseRecord(stack_name=stack_name, feature=feature, phase=phase, duration=duration)
+        with self.lock:
+            self.phases.append(record)
+
+    @contextmanager
+    def timed(self, stack_name: str, feature: str, phase: str) -> Iterator[None]:
+        """
+        Record the duration of a phase of a feature, also if it failed
+
+        :param stack_name: The name of the stack
+        :param feature: The name of the feature
+        :param phase: The phase, read, diff or write
+
+        :return: None
+        """
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record_phase(stack_name, feature, phase, time.monotonic() - started)
+
+    def snapshot(self) -> Tuple[List[RequestRecord], List[PhaseRecord]]:
+        with self.lock:
+            return list(self.requests), list(self.phases)
+
+    def report(self) -> Dict:
+        """
+        Build the run report with every record and the latency percentiles of each endpoint
+
+        :return: The report, serializable to JSON
+        """
+        requests, phases = self.snapshot()
+
+        endpoints: Dict[Tuple[str, str, str], List[RequestRecord]] = {}
+        for record in requests:
+            endpoints.setdefault((record.client, record.method, record.endpoint), []).append(record)
+
+        summary = []
+        for (client, method, endpoint), records in sorted(endpoints.items()):
+            latencies = [record.latency for record in records]
+            summary.append(
+                {
+                    "client": client,
+                    "method": method,
+                    "endpoint": endpoint,
+                    "count": len(records),
+                    "errors": len([record for record in records if record.status == 0 or record.status >= 400]),
+                    "bytes": sum(record.bytes for record in records),
+                    "p50": percentile(latencies, 0.5),
+                    "p95": percentile(latencies, 0.95),
+                    "max": max(latencies),
+                }
+            )
+
+        features: Dict[Tuple[str, str], Dict[str, float]] = {}
+        for record in phases:
+            durations = features.setdefault((record.stack_name, record.feature), {})
+            durations[record.phase] = durations.get(record.phase, 0.0) + record.duration
+
+        return {
+            "started_at": self.started,
+            "finished_at": time.time(),
+            "endpoints": summary,
+            "features": [
+                {"stack_name": stack_name, "feature": feature, **durations}
+                for (stack_name, feature), durations in sorted(features.items())
+            ],
+            "requests": [record.model_dump() for record in requests],
+        }
+
+    def prometheus(self) -> str:
+        """
+        Render the metrics of the run in the Prometheus text format
+
+        :return: The metrics
+        """
+        requests, phases = self.snapshot()
+        lines = []
+
+        def labels(**values: Union[str, int]) -> str:
+            escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"') for value in values.values())
+            return "{" + ",".join(f'{name}="{value}"' for name, value in zip(values, escaped)) + "}"
+
+        endpoints: Dict[Tuple[str, str, str], List[RequestRecord]] = {}
+        statuses: Dict[Tuple[str, str, str, int], int] = {}
+        for record in requests:
+            endpoints.setdefault((record.client, record.method, record.endpoint), []).append(record)
+            key = (record.client, record.method, record.endpoint, record.status)
+            statuses[key] = statuses.get(key, 0) + 1
+
+        name = f"{METRIC_PREFIX}_request_duration_seconds"
+        lines += [f"# HELP {name} Latency of the requests to ACS and the REST API", f"# TYPE {name} summary"]
+        for (client, method, endpoint), records in sorted(endpoints.items()):
+            latencies = [record.latency for record in records]
+            for quantile in QUANTILES:
+                value = percentile(latencies, quantile)
+                lines.append(f"{name}{labels(client=client, method=method, endpoint=endpoint, quantile=quantile)} {value:.6f}")
+            lines.append(f"{name}_sum{labels(client=client, method=method, endpoint=endpoint)} {sum(latencies):.6f}")
+            lines.append(f"{name}_count{labels(client=client, method=method, endpoint=endpoint)} {len(latencies)}")
+
+        name = f"{METRIC_PREFIX}_response_bytes"
+        lines += [f"# HELP {name} Size of the response bodies", f"# TYPE {name} counter"]
+        for (client, method, endpoint), records in sorted(endpoints.items()):
+            size = sum(record.bytes for record in records)
+            lines.append(f"{name}_total{labels(client=client, method=method, endpoint=endpoint)} {size}")
+
+        name = f"{METRIC_PREFIX}_requests"
+        lines += [f"# HELP {name} Requests by status, 0 if no response was received", f"# TYPE {name} counter"]
+        for (client, method, endpoint, status), count in sorted(statuses.items()):
+            lines.append(f"{name}_total{labels(client=client, method=method, endpoint=endpoint, status=status)} {count}")
+
+        durations: Dict[Tuple[str, str, str], float] = {}
+        for record in phases:
+            key = (record.stack_name, record.feature, record.phase)
+            durations[key] = durations.get(key, 0.0) + record.duration
+
+        name = f"{METRIC_PREFIX}_feature_phase_duration_seconds"
+        lines += [f"# HELP {name} Duration of the read, diff and write phase of each feature", f"# TYPE {name} gauge"]
+        for (stack_name, feature, phase), duration in sorted(durations.items()):
+            lines.append(f"{name}{labels(stack=stack_name, feature=feature, phase=phase)} {duration:.6f}")
+
+        name = f"{METRIC_PREFIX}_last_run_timestamp_seconds"
+        lines += [f"# HELP {name} Time the run finished", f"# TYPE {name} gauge", f"{name} {time.time():.3f}"]
+
+        return "\n".join(lines) + "\n"
+
+
+_RECORDER = MetricsRecorder()
+
+
+def get_recorder() -> MetricsRecorder:
+    """
+    Get the metrics recorder shared by all clients and features of the process
+
+    :return: The metrics recorder
+    """
+    return _RECORDER
+
+
+def _write_atomic(path: str, content: str) -> None:
+    # The Prometheus textfile collector may read at any time, so never expose a partial file
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with open(temporary_path, "w") as file:
+        file.write(content)
+    os.replace(temporary_path, path)
+
+
+def write_reports(config: Metrics, recorder: Union[None, MetricsRecorder] = None) -> None:
+    """
+    Write the JSON run report and the Prometheus textfile, if configured
+
+    :param config: The metrics configuration
+    :param recorder: The recorder to report, defaults to the shared recorder
+
+    :return: None
+    """
+    recorder = recorder or get_recorder()
+
+    if config.report_file:
+        try:
+            _write_atomic(config.report_file, json.dumps(recorder.report(), indent=2))
+            logging.info("Wrote run report to %s", config.report_file)
+        except OSError as error:
+            logging.warning("Could not write the run report to %s: %s", config.report_file, error)
+
+    if config.prometheus_file:
+        try:
+            _write_atomic(config.prometheus_file, recorder.prometheus())
+            logging.info("Wrote Prometheus metrics to %s", config.prometheus_file)
+        except OSError as error:
+            logging.warning("Could not write the Prometheus metrics to %s: %s", config.prometheus_file, error)
@@ -1,11 +1,14 @@
+import hashlib
+import json
 import os
+import string
 import uuid
 
-from pydantic import BaseModel, Field, model_validator
+from pydantic import BaseModel, Field, ValidationError, model_validator
 from pydantic.networks import IPvAnyNetwork
 
 from enum import Enum
-from typing import List, Union
+from typing import Any, Dict, Iterator, List, Set, Tuple, Union
 
 
 class CustomBaseModel(BaseModel):
@@ -14,6 +17,49 @@ class CustomBaseModel(BaseModel):
         allow_population_by_alias = True
         validate_assignment = True
 
+    def canonical(self) -> Dict[str, Any]:
+        """
+        The content that is compared between the desired and the current object
+        """
+        return self.model_dump(mode="json")
+
+    def fingerprint(self) -> str:
+        """
+        Hash of the canonical content, equal for objects that do not need an update
+        """
+        content = json.dumps(self.canonical(), sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def __eq__(self, other):
+        return isinstance(other, type(self)) and self.canonical() == other.canonical()
+
+    def to_update_delta(self, current: "CustomBaseModel") -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """
+        The fields of to_update_dict whose value differs from the current object, with their current values
+        Empty if only content outside of the update payload differs, e.g. a HEC token value,
+        as an update can not change it
+        """
+        desired = self.to_update_dict()
+        existing = current.to_update_dict()
+        changed = [key for key, value in desired.items() if _comparable(value) != _comparable(existing.get(key))]
+
+        return {key: desired[key] for key in changed}, {key: existing.get(key) for key in changed}
+
+
+def canonical_list(values: List[str]) -> List[str]:
+    """
+    Canonical form of a list whose order and duplicates are not significant
+    """
+    return sorted(set(values))
+
+
+def _comparable(value: Any) -> Any:
+    # Update payloads hold enums and unordered lists, compared like in the canonical content
+    if isinstance(value, list):
+        return canonical_list(value)
+
+    return getattr(value, "value", value)
+
 
 class AllowList(CustomBaseModel):
     search_ui: List[IPvAnyNetwork] = Field(alias="search-ui", default=[])
@@ -52,15 +98,13 @@ class Index(CustomBaseModel):
             "searchableDays": self.days_searchable,
         }
 
-    def __eq__(self, other):
-        return all(
-            [
-                self.name == other.name,
-                self.datatype == other.datatype,
-                self.maxmb == other.maxmb,
-                self.days_searchable == other.days_searchable,
-            ]
-        )
+    def canonical(self):
+        return {
+            "name": self.name,
+            "datatype": self.datatype.value,
+            "maxmb": self.maxmb,
+            "days_searchable": self.days_searchable,
+        }
 
 
 class HecToken(CustomBaseModel):
@@ -73,6 +117,9 @@ class HecToken(CustomBaseModel):
     allowed_indexes: List[str] = []
     use_ack: bool = False
 
+    def referenced_indexes(self) -> List[str]:
+        return canonical_list([self.default_index] + self.allowed_indexes)
+
     def to_create_dict(self):
         return {
             "allowedIndexes": self.allowed_indexes,
@@ -94,19 +141,17 @@ class HecToken(CustomBaseModel):
             "useAck": self.use_ack,
         }
 
-    def __eq__(self, other):
-        return all(
-            [
-                self.name == other.name,
-                self.token == other.token,
-                self.default_index == other.default_index,
-                self.default_source == other.default_source,
-                self.default_sourcetype == other.default_sourcetype,
-                self.disabled == other.disabled,
-                set(self.allowed_indexes) == set(other.allowed_indexes),
-                self.use_ack == other.use_ack,
-            ]
-        )
+    def canonical(self):
+        return {
+            "name": self.name,
+            "token": self.token,
+            "default_index": self.default_index,
+            "default_source": self.default_source,
+            "default_sourcetype": self.default_sourcetype,
+            "disabled": self.disabled,
+            "allowed_indexes": canonical_list(self.allowed_indexes),
+            "use_ack": self.use_ack,
+        }
 
 
 class SSOBinding(str, Enum):
@@ -196,9 +241,31 @@ class SAML(CustomBaseModel):
             "useAuthExtForTokenAuthOnly": self.use_auth_extentsion_token_only,
         }
 
-    def __eq__(self, _) -> bool:
-        # As we can not compare the script secure arguments we always return False
-        return False
+    def canonical(self):
+        # Only the settings that get_saml can read back, the others are compared by secret_content
+        # The name is left out as the remote reports its own identity for the provider
+        return {
+            "entity_id": self.entity_id,
+            "fqdn": self.fqdn,
+            "port": self.port,
+            "sso_url": self.sso_url,
+            "slo_url": self.slo_url,
+            "sso_binding": self.sso_binding.value,
+            "slo_binding": self.slo_binding.value,
+            "alias_realname": self.alias_realname,
+            "alias_email": self.alias_email,
+            "alias_roles": self.alias_roles,
+            "use_auth_extentsion_token_only": self.use_auth_extentsion_token_only,
+            "script_path": self.script_path,
+        }
+
+    def secret_content(self):
+        # The settings that can not be read back, with the resolved values of the script arguments
+        return {
+            "cert": self.cert,
+            "script_functions": self.script_functions,
+            "script_args": [arg.to_string() for arg in self.script_args],
+        }
 
 
 class Role(CustomBaseModel):
@@ -213,6 +280,9 @@ class Role(CustomBaseModel):
     search_job_quota: int = 100
     search_time_window: int = 0
 
+    def referenced_indexes(self) -> List[str]:
+        return canonical_list(self.search_indexes_allowed + self.search_indexes_default)
+
     def to_create_dict(self):
         return {
             "name": self.name,
@@ -240,21 +310,19 @@ class Role(CustomBaseModel):
             "srchTimeWin": self.search_time_window,
         }
 
-    def __eq__(self, other):
-        return all(
-            [
-                self.name == other.name,
-                set(self.capabilities) == set(other.capabilities),
-                self.default_app == other.default_app,
-                set(self.imported_roles) == set(other.imported_roles),
-                self.search_disk_quota == other.search_disk_quota,
-                self.search_filter == other.search_filter,
-                set(self.search_indexes_allowed) == set(other.search_indexes_allowed),
-                set(self.search_indexes_default) == set(other.search_indexes_default),
-                self.search_job_quota == other.search_job_quota,
-                self.search_time_window == other.search_time_window,
-            ]
-        )
+    def canonical(self):
+        return {
+            "name": self.name,
+            "capabilities": canonical_list(self.capabilities),
+            "default_app": self.default_app,
+            "imported_roles": canonical_list(self.imported_roles),
+            "search_disk_quota": self.search_disk_quota,
+            "search_filter": self.search_filter,
+            "search_indexes_allowed": canonical_list(self.search_indexes_allowed),
+            "search_indexes_default": canonical_list(self.search_indexes_default),
+            "search_job_quota": self.search_job_quota,
+            "search_time_window": self.search_time_window,
+        }
 
 
 class SAMLRoleMapping(CustomBaseModel):
@@ -272,13 +340,11 @@ class SAMLRoleMapping(CustomBaseModel):
             "roles": self.roles,
         }
 
-    def __eq__(self, other):
-        return all(
-            [
-                set(self.roles) == set(other.roles),
-                self.group == other.group,
-            ]
-        )
+    def canonical(self):
+        return {
+            "roles": canonical_list(self.roles),
+            "group": self.group,
+        }
 
 
 class SplunkbaseApp(CustomBaseModel):
@@ -298,13 +364,125 @@ class SplunkbaseApp(CustomBaseModel):
             "version": self.version,
         }
 
-    def __eq__(self, other):
-        return all(
-            [
-                self.splunkbase_id == other.splunkbase_id,
-                self.version == other.version,
-            ]
-        )
+    def canonical(self):
+        return {
+            "splunkbase_id": self.splunkbase_id,
+            "version": self.version,
+        }
+
+
+class SourceFormat(str, Enum):
+    CSV = "csv"
+    JSONL = "jsonl"
+
+
+class ObjectSource(CustomBaseModel):
+    # Relative to the environment file, compressed with gzip if the name ends with .gz
+    path: str
+    # Derived from the file extension if not set
+    format: Union[None, SourceFormat] = None
+    # Separator of the items of list fields in a CSV cell
+    list_separator: str = Field(default=";", min_length=1)
+
+    @model_validator(mode="before")
+    @classmethod
+    def from_path(cls, value):
+        # A plain string is the path of the file
+        return {"path": value} if isinstance(value, str) else value
+
+
+class ObjectSources(CustomBaseModel):
+    # CSV or JSON lines files with further objects of a section, read row by row when the feature is planned
+    hec: List[ObjectSource] = Field(default=[])
+    indexes: List[ObjectSource] = Field(default=[])
+    roles: List[ObjectSource] = Field(default=[])
+    saml_role_mappings: List[ObjectSource] = Field(default=[])
+
+
+def get_placeholders(value: Any) -> Set[str]:
+    """
+    Get the names of the ${name} placeholders in the strings of a template value
+    """
+    if isinstance(value, str):
+        matches = string.Template.pattern.finditer(value)
+        return {match["named"] or match["braced"] for match in matches if match["named"] or match["braced"]}
+
+    if isinstance(value, list):
+        return set().union(*[get_placeholders(item) for item in value])
+
+    if isinstance(value, dict):
+        return set().union(*[get_placeholders(item) for item in value.values()])
+
+    return set()
+
+
+def substitute(value: Any, values: Dict[str, str]) -> Any:
+    """
+    Replace the ${name} placeholders in the strings of a template value, $$ is a literal $
+    """
+    if isinstance(value, str):
+        return string.Template(value).substitute(values)
+
+    if isinstance(value, list):
+        return [substitute(item, values) for item in value]
+
+    if isinstance(value, dict):
+        return {key: substitute(item, values) for key, item in value.items()}
+
+    return value
+
+
+class ObjectTemplate(CustomBaseModel):
+    # Every template below is expanded once per entry, with ${name} replaced by the value of name in the entry
+    values: List[Dict[str, str]] = Field(min_length=1)
+    hec: List[Dict[str, Any]] = Field(default=[])
+    indexes: List[Dict[str, Any]] = Field(default=[])
+    roles: List[Dict[str, Any]] = Field(default=[])
+    saml_role_mappings: List[Dict[str, Any]] = Field(default=[])
+
+    @model_validator(mode="after")
+    def verify_templates(self):
+        # Every entry is expanded to validate the templates, the objects are built again when they are planned
+        for section, model in TEMPLATE_MODELS.items():
+            for template in getattr(self, section):
+                placeholders = get_placeholders(template)
+                for number, entry in enumerate(self.values, start=1):
+                    missing = placeholders - set(entry)
+                    if missing:
+                        names = ", ".join(sorted(missing))
+                        raise ValueError(f"Template of {section} uses {names}, missing in entry {number}")
+
+                    try:
+                        model.model_validate(substitute(template, entry))
+                    except ValidationError as e:
+                        raise ValueError(f"Template of {section} is invalid for entry {number}: {e}")
+
+        return self
+
+    def expand(self, section: str) -> Iterator[Dict[str, Any]]:
+        """
+        Expand the templates of a section one object at a time, validated by the caller
+        """
+        for entry in self.values:
+            for template in getattr(self, section):
+                yield substitute(template, entry)
+
+    def expand_field(self, section: str, field: str) -> Iterator[str]:
+        """
+        Expand only one field of the templates of a section, e.g. to check names without building the objects
+        """
+        for entry in self.values:
+            for template in getattr(self, section):
+                if field in template:
+                    yield substitute(template[field], entry)
+
+
+TEMPLATE_MODELS = {
+    "hec": HecToken,
+    "indexes": Index,
+    "roles": Role,
+    "saml_role_mappings": SAMLRoleMapping,
+}
 
 
 class StackConfiguration(CustomBaseModel):
@@ -319,11 +497,19 @@ class StackConfiguration(CustomBaseModel):
     saml: Union[None, SAML] = Field(default=None)
     saml_role_mappings: List[SAMLRoleMapping] = Field(default=[])
     splunkbase_apps: List[SplunkbaseApp] = Field(default=[])
+    sources: ObjectSources = Field(default=ObjectSources())
+    templates: List[ObjectTemplate] = Field(default=[])
+
+    def template_keys(self, section: str, field: str) -> List[str]:
+        """
+        The values of a field of all objects the templates expand to in a section
+        """
+        return [key for template in self.templates for key in template.expand_field(section, field)]
 
     @model_validator(mode="after")
     def verify_hec_tokens(self):
-        hec_names = [hec.name for hec in self.hec]
-        hec_tokens = [hec.token for hec in self.hec]
+        hec_names = [hec.name for hec in self.hec] + self.template_keys("hec", "name")
+        hec_tokens = [hec.token for hec in self.hec] + self.template_keys("hec", "token")
 
         if len(hec_names) != len(set(hec_names)):
             raise ValueError("Duplicate HEC names found")
@@ -341,7 +527,7 @@ class StackConfiguration(CustomBaseModel):
 
     @model_validator(mode="after")
     def verify_indexes(self):
-        index_names = [index.name for index in self.indexes]
+        index_names = [index.name for index in self.indexes] + self.template_keys("indexes", "name")
 
         if len(index_names) != len(set(index_names)):
             raise ValueError("Duplicate index names found")
@@ -350,7 +536,7 @@ class StackConfiguration(CustomBaseModel):
 
     @model_validator(mode="after")
     def verify_roles(self):
-        role_names = [role.name for role in self.roles]
+        role_names = [role.name for role in self.roles] + self.template_keys("roles", "name")
 
         if len(role_names) != len(set(role_names)):
             raise ValueError("Duplicate role names found")
@@ -359,7 +545,9 @@ class StackConfiguration(CustomBaseModel):
 
     @model_validator(mode="after")
     def verify_saml_role_mappings(self):
-        group_names = [mapping.group for mapping in self.saml_role_mappings]
+        group_names = [mapping.group for mapping in self.saml_role_mappings] + self.template_keys(
+            "saml_role_mappings", "group"
+        )
 
         if len(group_names) != len(set(group_names)):
             raise ValueError("Duplicate group names found")
@@ -383,5 +571,110 @@ class Proxy(CustomBaseModel):
     password: Union[None, str] = Field(default=None)
 
 
+class RateLimit(CustomBaseModel):
+    rate: float = Field(default=10.0, gt=0)
+    burst: int = Field(default=20, gt=0)
+    initial_concurrency: int = Field(default=8, gt=0)
+    min_concurrency: int = Field(default=1, gt=0)
+    max_concurrency: int = Field(default=32, gt=0)
+    max_retries: int = Field(default=5, ge=0)
+
+    @model_validator(mode="after")
+    def verify_concurrency(self):
+        if self.min_concurrency > self.max_concurrency:
+            raise ValueError("min_concurrency must not be greater than max_concurrency")
+
+        return self
+
+
+class Pagination(CustomBaseModel):
+    page_size: int = Field(default=100, gt=0)
+    concurrency: int = Field(default=4, gt=0)
+
+
+class Cache(CustomBaseModel):
+    directory: str = ".cache/snapshots"
+    # Seconds a snapshot of the remote state is reused, 0 disables the cache
+    ttl: float = Field(default=0, ge=0)
+
+
+class Incremental(CustomBaseModel):
+    enabled: bool = False
+    directory: str = ".state"
+    # Seconds after which all features are reconciled again, to correct changes made outside of this tool
+    full_interval: float = Field(default=86400, gt=0)
+
+
+class Splunkbase(CustomBaseModel):
+    login_url: str = "https://splunkbase.splunk.com/api/account:login"
+    session_file: str = ".cache/splunkbase-sessions.json"
+    # Seconds a Splunkbase login is reused by other stacks and runs, 0 logs in every time
+    session_ttl: float = Field(default=3600, ge=0)
+
+
+class SecretFingerprints(CustomBaseModel):
+    directory: str = ".state/fingerprints"
+    # Environment variable with the key of the fingerprints, a key is generated in the directory if it is not set
+    key_env_var: str = "FINGERPRINT_KEY"
+
+
+class Journal(CustomBaseModel):
+    enabled: bool = True
+    # One append-only journal per stack, an unfinished run is resumed from it with --resume
+    directory: str = ".state/journal"
+    # Entries are synced to disk after this many entries or seconds, whichever comes first
+    sync_every: int = Field(default=64, gt=0)
+    sync_interval: float = Field(default=1.0, ge=0)
+
+
+class Metrics(CustomBaseModel):
+    # JSON report with the timing of every request and feature phase, not written if empty
+    report_file: Union[None, str] = None
+    # Prometheus textfile with the latency percentiles of each endpoint, not written if empty
+    prometheus_file: Union[None, str] = None
+
+
+class CassetteMode(str, Enum):
+    OFF = "off"
+    RECORD = "record"
+    REPLAY = "replay"
+
+
+class Cassette(CustomBaseModel):
+    mode: CassetteMode = CassetteMode.OFF
+    # Compressed with gzip if the name ends with .gz
+    path: str = "cassettes/run.jsonl.gz"
+    # Fields of JSON and form bodies and keys of XML responses whose values are not written to the cassette
+    redact_fields: List[str] = Field(
+        default=["token", "password", "idpCertificatePayload", "scriptSecureArguments", "id"]
+    )
+
+
+class Tracking(CustomBaseModel):
+    enabled: bool = True
+    # Seconds before the first poll, doubled after every poll up to max_delay
+    initial_delay: float = Field(default=2.0, gt=0)
+    max_delay: float = Field(default=30.0, gt=0)
+    # Seconds after which objects that are still pending are reported as timed out
+    deadline: float = Field(default=900, gt=0)
+
+
 class Config(CustomBaseModel):
     proxy: Proxy = Field(default=Proxy())
+    # Base URL of ACS instead of the public endpoints, e.g. of a local mock server
+    acs_url: Union[None, str] = Field(default=None)
+    pagination: Pagination = Field(default=Pagination())
+    cache: Cache = Field(default=Cache())
+    incremental: Incremental = Field(default=Incremental())
+    splunkbase: Splunkbase = Field(default=Splunkbase())
+    secret_fingerprints: SecretFingerprints = Field(default=SecretFingerprints())
+    journal: Journal = Field(default=Journal())
+    metrics: Metrics = Field(default=Metrics())
+    cassette: Cassette = Field(default=Cassette())
+    app_tracking: Tracking = Field(default=Tracking())
+    allowlist_tracking: Tracking = Field(default=Tracking(initial_delay=5.0, max_delay=30.0, deadline=1800))
+    index_tracking: Tracking = Field(default=Tracking(initial_delay=1.0, max_delay=10.0, deadline=600))
+    acs_rate_limit: RateLimit = Field(default=RateLimit())
+    api_rate_limit: RateLimit = Field(default=RateLimit(rate=50.0, burst=50))
+    max_connections: int = Field(default=32, gt=0)
+    max_in_flight: int = Field(default=8, gt=0)
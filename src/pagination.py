@@ -0,0 +1,98 @@
+import logging
+
+from typing import Any, Callable, Dict, List, Union
+from client import AsyncClient, Client, gather_limited
+
+ResponseItems = Callable[[Any], List[Any]]
+ResponseTotal = Callable[[Any], Union[None, int]]
+
+
+async def _fetch_page(client: AsyncClient, url: str, params: Dict[str, Any], offset: int, count: int) -> Any:
+    _, response = await client.get(url, {}, {**params, "offset": offset, "count": count})
+    return response
+
+
+async def fetch_all_pages_async(
+    client: AsyncClient,
+    url: str,
+    items: ResponseItems,
+    page_size: int,
+    concurrency: int,
+    params: Union[None, Dict[str, Any]] = None,
+    total: Union[None, ResponseTotal] = None,
+) -> List[Any]:
+    """
+    Fetch all pages of a collection endpoint using offset and count parameters
+    If the endpoint reports the total, all remaining pages are requested at once
+    Otherwise pages are requested in windows of concurrency pages until a short page is returned
+
+    :param client: The client to use for the requests
+    :param url: The URL of the collection
+    :param items: Extracts the list of items from a response
+    :param page_size: The number of items per page
+    :param concurrency: The maximum number of pages requested at the same time
+    :param params: Additional query parameters
+    :param total: Extracts the total number of items from a response, if the endpoint reports it
+
+    :return: The items of all pages in order
+    """
+    params = params or {}
+
+    first = await _fetch_page(client, url, params, 0, page_size)
+    result = list(items(first))
+    if len(result) < page_size:
+        return result
+
+    expected = total(first) if total else None
+    if expected is not None:
+        offsets = list(range(page_size, expected, page_size))
+        pages = await gather_limited([_fetch_page(client, url, params, offset, page_size) for offset in offsets], concurrency)
+        for page in pages:
+            if isinstance(page, BaseException):
+                raise page
+            result.extend(items(page))
+
+        logging.debug("Fetched %d of %d items from %s in %d pages", len(result), expected, url, len(offsets) + 1)
+        return result
+
+    offset = page_size
+    while True:
+        offsets = [offset + index * page_size for index in range(concurrency)]
+        pages = await gather_limited([_fetch_page(client, url, params, offset, page_size) for offset in offsets], concurrency)
+
+        for page in pages:
+            if isinstance(page, BaseException):
+                raise page
+
+            page_items = items(page)
+            result.extend(page_items)
+            if len(page_items) < page_size:
+                logging.debug("Fetched %d items from %s", len(result), url)
+                return result
+
+        offset = offsets[-1] + page_size
+
+
+def fetch_all_pages(
+    client: Client,
+    url: str,
+    items: ResponseItems,
+    page_size: int,
+    concurrency: int,
+    params: Union[None, Dict[str, Any]] = None,
+    total: Union[None, ResponseTotal] = None,
+) -> List[Any]:
+    """
+    Synchronous version of fetch_all_pages_async
+    """
+    return client.run(
+        fetch_all_pages_async(
+            client=client.async_client,
+            url=url,
+            items=items,
+            page_size=page_size,
+            concurrency=concurrency,
+            params=params,
+            total=total,
+        )
+    )
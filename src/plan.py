@@ -0,0 +1,137 @@
+import logging
+import os
+
+from datetime import datetime, timezone
+from pydantic import BaseModel, Field
+from typing import Dict, List
+from executor import Action, Operation
+from models import StackConfiguration
+
+PLAN_VERSION = 1
+DEFAULT_MAX_PLAN_AGE = 3600
+PLAN_FILE_EXTENSIONS = (".json",)
+
+
+class FeaturePlan(BaseModel):
+    feature: str
+    operations: List[Operation] = Field(default=[])
+
+
+class StackPlan(BaseModel):
+    version: int = PLAN_VERSION
+    stack_name: str
+    api_url: str
+    is_stage: bool = False
+    created_at: datetime
+    features: List[FeaturePlan] = Field(default=[])
+    # Fingerprint of the desired configuration of each feature, recorded once the plan is applied
+    fingerprints: Dict[str, str] = Field(default={})
+    full: bool = True
+
+    @property
+    def age(self) -> float:
+        return (datetime.now(timezone.utc) - self.created_at).total_seconds()
+
+    def operations_for(self, feature: str) -> List[Operation]:
+        for feature_plan in self.features:
+            if feature_plan.feature == feature:
+                return feature_plan.operations
+
+        return []
+
+    def stack_config(self) -> StackConfiguration:
+        """
+        The part of the stack configuration needed to connect to the stack
+        """
+        return StackConfiguration(stack_name=self.stack_name, api_url=self.api_url, is_stage=self.is_stage)
+
+
+def get_plan_path(plan_dir: str, stack_name: str) -> str:
+    """
+    Get the path of the plan file for a given stack
+
+    :param plan_dir: The directory containing the plans
+    :param stack_name: The name of the stack
+
+    :return: The path of the plan file
+    """
+    return os.path.join(plan_dir, f"{stack_name}.json")
+
+
+def write_plan(plan: StackPlan, path: str) -> None:
+    """
+    Write the plan as compact JSON
+    Plans contain HEC tokens and SAML secrets, so the file is only readable by the owner
+
+    :param plan: The plan to write
+    :param path: The path of the plan file
+
+    :return: None
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as file:
+        file.write(plan.model_dump_json(exclude_defaults=True))
+
+
+def read_plan(path: str) -> StackPlan:
+    """
+    Read a plan written by write_plan
+
+    :param path: The path of the plan file
+
+    :return: The plan
+    """
+    with open(path, "r") as file:
+        plan = StackPlan.model_validate_json(file.read())
+
+    if plan.version != PLAN_VERSION:
+        raise ValueError(f"Unsupported plan version {plan.version}, expected {PLAN_VERSION}")
+
+    return plan
+
+
+def check_plan_fresh(plan: StackPlan, max_age: float = DEFAULT_MAX_PLAN_AGE) -> None:
+    """
+    Raise an error if the plan is older than max_age seconds, as the stack may have changed since
+
+    :param plan: The plan to check
+    :param max_age: The maximum age of the plan in seconds
+
+    :return: None
+    """
+    if plan.age > max_age:
+        raise ValueError(
+            f"Plan for {plan.stack_name} was created {plan.age:.0f}s ago, which is older than the allowed {max_age:.0f}s - create a new plan"
+        )
+
+
+def log_plan_summary(plan: StackPlan) -> None:
+    """
+    Log the number of planned operations per feature and action, and the fields each update changes
+
+    :param plan: The plan to summarize
+
+    :return: None
+    """
+    for feature_plan in plan.features:
+        counts = {action: 0 for action in Action}
+        for operation in feature_plan.operations:
+            counts[operation.action] += 1
+            if operation.previous:
+                changes = ", ".join(
+                    f"{key}: {operation.previous[key]!r} -> {operation.data.get(key)!r}" for key in operation.previous
+                )
+                logging.info("Plan for %s: update %s %s (%s)", plan.stack_name, operation.kind, operation.name, changes)
+
+        logging.info(
+            "Plan for %s %s: %d to add, %d to update, %d to delete",
+            plan.stack_name,
+            feature_plan.feature,
+            counts[Action.ADD],
+            counts[Action.UPDATE],
+            counts[Action.DELETE],
+        )
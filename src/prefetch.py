@@ -0,0 +1,83 @@
+import logging
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from pydantic import BaseModel, Field
+from typing import Any, Callable, Dict, List, Set, TypeVar, Union
+from models import SAML, AllowList, HecToken, Index, Role, SAMLRoleMapping, SplunkbaseApp
+
+T = TypeVar("T")
+
+
+class PrefetchError(Exception):
+    """
+    Raised when a feature is planned whose remote state could not be fetched
+    """
+
+
+class RemoteState(BaseModel):
+    """
+    The remote state of the features of a stack, fetched at once before the features are planned
+    Each field is named like the feature whose state it holds
+    """
+
+    allowlist: Union[None, AllowList] = None
+    indexes: Union[None, List[Index]] = None
+    hec: Union[None, List[HecToken]] = None
+    saml: Union[None, SAML] = None
+    splunkbase_apps: Union[None, List[SplunkbaseApp]] = None
+    roles: Union[None, List[Role]] = None
+    saml_mapping: Union[None, List[SAMLRoleMapping]] = None
+    # The features whose state was fetched, as the state of SAML is None if the stack has no SAML provider
+    fetched: Set[str] = Field(default=set())
+    errors: Dict[str, str] = Field(default={})
+
+
+def prefetch_state(readers: Dict[str, Callable[[], Any]], thread_prefix: str = "prefetch") -> RemoteState:
+    """
+    Fetch the state of all features at the same time
+    A failed read is recorded and raised when the feature is planned, so it does not affect the other features
+
+    :param readers: Fetches the state of each feature by name
+    :param thread_prefix: The prefix for the reader thread names
+
+    :return: The remote state
+    """
+    state = RemoteState()
+    if not readers:
+        return state
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=len(readers), thread_name_prefix=f"{thread_prefix}-read") as executor:
+        futures = {name: executor.submit(read) for name, read in readers.items()}
+
+        for name, future in futures.items():
+            try:
+                setattr(state, name, future.result())
+            except Exception as e:
+                logging.error("Failed to fetch the state of %s: %s", name, e)
+                state.errors[name] = str(e) or type(e).__name__
+            else:
+                state.fetched.add(name)
+
+    logging.info("Fetched the state of %d features in %.2fs", len(readers), time.monotonic() - started)
+    return state
+
+
+def get_current(state: Union[None, RemoteState], feature: str, read: Callable[[], T]) -> T:
+    """
+    Get the prefetched state of a feature, or fetch it if it was not prefetched
+
+    :param state: The prefetched remote state
+    :param feature: The name of the feature
+    :param read: Fetches the state of the feature
+
+    :return: The state of the feature
+    """
+    if state is not None and feature in state.errors:
+        raise PrefetchError(f"Failed to fetch the state of {feature}: {state.errors[feature]}")
+
+    if state is not None and feature in state.fetched:
+        return getattr(state, feature)
+
+    return read()
@@ -0,0 +1,187 @@
+import asyncio
+import email.utils
+import logging
+import random
+import time
+
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Union
+from models import RateLimit
+
+# 429 is rejected before it is processed, so it is safe to retry for every method
+RETRY_ALWAYS_STATUS_CODES = [429]
+RETRY_IDEMPOTENT_STATUS_CODES = [502, 503, 504]
+# PATCH is not idempotent in general, but all our PATCH bodies set absolute values
+IDEMPOTENT_METHODS = ["GET", "HEAD", "OPTIONS", "PUT", "DELETE", "PATCH"]
+
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 30.0
+THROTTLE_COOLDOWN = 1.0
+
+
+def parse_retry_after(value: Union[None, str]) -> Union[None, float]:
+    """
+    Parse the Retry-After header which is either a number of seconds or an HTTP date
+
+    :param value: The value of the header
+
+    :return: The number of seconds to wait or None if the header is missing or invalid
+    """
+    if not value:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+def backoff_delay(attempt: int, retry_after: Union[None, float] = None) -> float:
+    """
+    Get the delay before the next attempt using exponential backoff with full jitter
+    The Retry-After of the server is used as a lower bound
+
+    :param attempt: The number of the attempt that failed, starting at 0
+    :param retry_after: The delay requested by the server
+
+    :return: The delay in seconds
+    """
+    delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2**attempt))
+    if retry_after is not None:
+        return retry_after + delay / 4
+
+    return delay
+
+
+def should_retry(method: str, status_code: int) -> bool:
+    """
+    Check if a request with the given method and response status should be retried
+
+    :param method: The HTTP method of the request
+    :param status_code: The status code of the response
+
+    :return: True if the request should be retried
+    """
+    if status_code in RETRY_ALWAYS_STATUS_CODES:
+        return True
+
+    return status_code in RETRY_IDEMPOTENT_STATUS_CODES and method.upper() in IDEMPOTENT_METHODS
+
+
+class TokenBucket:
+    """
+    Token bucket allowing rate requests per second on average and bursts of up to burst requests
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = asyncio.Lock()
+
+    def block(self, seconds: float) -> None:
+        """
+        Do not hand out tokens for the given number of seconds, e.g. because of a Retry-After
+        """
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    async def acquire(self) -> None:
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class AIMDController:
+    """
+    Concurrency limit with additive increase on success and multiplicative decrease on throttling
+    """
+
+    def __init__(self, initial: int, minimum: int, maximum: int):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = float(min(max(initial, minimum), maximum))
+        self.in_flight = 0
+        self.decreased = 0.0
+        self.condition = asyncio.Condition()
+
+    async def acquire(self) -> None:
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release(self) -> None:
+        async with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    def on_success(self) -> None:
+        # Grows the limit by roughly one per round trip of a full window
+        self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+    def on_throttle(self) -> None:
+        # A burst of throttled responses belongs to the same congestion event, only back off once for it
+        now = time.monotonic()
+        if now - self.decreased < THROTTLE_COOLDOWN:
+            return
+
+        self.decreased = now
+        self.limit = max(self.minimum, self.limit / 2)
+        logging.debug("Throttled - reduced concurrency limit to %d", int(self.limit))
+
+
+class RateLimiter:
+    """
+    Rate limiter for one endpoint family, combining a token bucket and an AIMD concurrency controller
+    """
+
+    def __init__(self, name: str, config: RateLimit):
+        self.name = name
+        self.config = config
+        self.bucket = TokenBucket(rate=config.rate, burst=config.burst)
+        self.controller = AIMDController(
+            initial=config.initial_concurrency,
+            minimum=config.min_concurrency,
+            maximum=config.max_concurrency,
+        )
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """
+        Wait for a token and a free concurrency slot for one request
+        """
+        await self.controller.acquire()
+        try:
+            await self.bucket.acquire()
+            yield
+        finally:
+            await self.controller.release()
+
+    def on_success(self) -> None:
+        self.controller.on_success()
+
+    def on_throttle(self, retry_after: Union[None, float]) -> None:
+        self.controller.on_throttle()
+        if retry_after:
+            logging.info("Rate limited on %s - pausing requests for %.1fs", self.name, retry_after)
+            self.bucket.block(retry_after)
@@ -0,0 +1,144 @@
+import asyncio
+
+from enum import Enum
+from typing import Dict, Iterable, List
+from client import get_loop
+
+
+class ReadinessState(str, Enum):
+    PENDING = "pending"
+    READY = "ready"
+    FAILED = "failed"
+
+
+class ReadinessError(Exception):
+    """
+    Raised when an object did not become ready, or an operation depends on such an object
+    """
+
+
+def get_resource_key(feature: str, name: str) -> str:
+    """
+    Get the key of an object created by a feature, used in Operation.requires
+
+    :param feature: The name of the feature creating the object
+    :param name: The name of the object
+
+    :return: The key of the object
+    """
+    return f"{feature}/{name}"
+
+
+class _Resource:
+    def __init__(self):
+        self.state = ReadinessState.PENDING
+        self.detail = ""
+        self.event = asyncio.Event()
+
+
+class ReadinessBoard:
+    """
+    Tracks the objects that features create or update during a run of one stack,
+    so operations of other features can start as soon as the objects they reference are ready
+
+    The providers are the features whose objects can be waited for. An operation waiting for an object
+    first waits until its provider declared the objects it changes, then until that object is ready.
+    Objects that are not declared, e.g. because they already existed, are not waited for.
+
+    All state lives on the event loop of the clients, the public methods can be called from any thread.
+    """
+
+    def __init__(self, providers: Iterable[str]):
+        self._loop = get_loop()
+        self._declared: Dict[str, asyncio.Event] = {provider: asyncio.Event() for provider in providers}
+        self._resources: Dict[str, _Resource] = {}
+
+    def declare(self, provider: str, names: List[str]) -> None:
+        """
+        Declare the objects a provider is about to create or update, releasing the waiters of all other objects
+
+        :param provider: The name of the providing feature
+        :param names: The names of the objects
+
+        :return: None
+        """
+        self._loop.call_soon_threadsafe(self._declare, provider, names)
+
+    def mark_ready(self, provider: str, name: str) -> None:
+        """
+        Mark an object as ready, releasing the operations waiting for it
+
+        :param provider: The name of the providing feature
+        :param name: The name of the object
+
+        :return: None
+        """
+        self._loop.call_soon_threadsafe(self._resolve, get_resource_key(provider, name), ReadinessState.READY, "")
+
+    def mark_failed(self, provider: str, name: str, detail: str) -> None:
+        """
+        Mark an object as failed, failing the operations waiting for it
+
+        :param provider: The name of the providing feature
+        :param name: The name of the object
+        :param detail: Why the object is not ready
+
+        :return: None
+        """
+        self._loop.call_soon_threadsafe(self._resolve, get_resource_key(provider, name), ReadinessState.FAILED, detail)
+
+    def finish(self, provider: str) -> None:
+        """
+        Mark the provider as finished, failing all of its objects that are still pending
+        Must be called when the providing feature ends, also if it failed
+
+        :param provider: The name of the providing feature
+
+        :return: None
+        """
+        self._loop.call_soon_threadsafe(self._finish, provider)
+
+    async def wait(self, keys: Iterable[str]) -> None:
+        """
+        Wait until all given objects are ready
+        Must be awaited on the event loop of the clients
+
+        :param keys: The keys of the objects, see get_resource_key
+
+        :return: None
+        """
+        for key in keys:
+            provider = key.split("/", 1)[0]
+            if provider not in self._declared:
+                continue
+
+            await self._declared[provider].wait()
+            resource = self._resources.get(key)
+            if resource is None:
+                continue
+
+            await resource.event.wait()
+            if resource.state == ReadinessState.FAILED:
+                raise ReadinessError(f"{key} is not ready: {resource.detail}")
+
+    def _declare(self, provider: str, names: List[str]) -> None:
+        for name in names:
+            self._resources.setdefault(get_resource_key(provider, name), _Resource())
+
+        self._declared.setdefault(provider, asyncio.Event()).set()
+
+    def _resolve(self, key: str, state: ReadinessState, detail: str) -> None:
+        resource = self._resources.get(key)
+        if resource is None or resource.state != ReadinessState.PENDING:
+            return
+
+        resource.state = state
+        resource.detail = detail
+        resource.event.set()
+
+    def _finish(self, provider: str) -> None:
+        self._declared.setdefault(provider, asyncio.Event()).set()
+
+        for key in self._resources:
+            if key.startswith(f"{provider}/"):
+                self._resolve(key, ReadinessState.FAILED, f"{provider} finished before it was ready")
@@ -0,0 +1,560 @@
+import logging
+import threading
+
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pydantic import BaseModel, Field
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple, Union
+from cache import get_snapshot_cache
+from cassette import get_cassette
+from client import Client
+from executor import Operation, OperationResult, apply_operations, check_results
+from incremental import get_section_fingerprint
+from journal import ApplyJournal
+from metrics import get_recorder
+from models import CassetteMode, Config, StackConfiguration
+from plan import FeaturePlan, StackPlan
+from prefetch import RemoteState, prefetch_state
+from readiness import ReadinessBoard
+from scheduler import DEFAULT_WORKERS, FeatureResult, FeatureStatus, FeatureTask, run_features
+from sources import iter_objects
+
+from features.allowlist import apply_allowlist, plan_allowlist, read_allowlist
+from features.hec import plan_hec, read_hec
+from features.index import apply_indexes, plan_indexes, read_indexes
+from features.saml import apply_saml, plan_saml, read_saml
+from features.role import plan_roles, read_roles
+from features.samlrole import plan_saml_mapping, read_saml_mapping
+from features.splunkbase_apps import apply_splunkbase_apps, plan_splunkbase_apps, read_splunkbase_apps
+
+ACS_CLIENT = "acs"
+API_CLIENT = "api"
+
+
+def apply_feature(
+    client: Client,
+    operations: List[Operation],
+    stack_name: str,
+    config: Union[None, Config] = None,
+    board: Union[None, ReadinessBoard] = None,
+    journal: Union[None, ApplyJournal] = None,
+) -> List[OperationResult]:
+    """
+    Apply the planned operations of a feature that has no special ordering requirements
+
+    :param client: The client to use for the requests
+    :param operations: The planned operations
+    :param stack_name: The name of the stack as written in the stack configuration
+    :param config: The global configuration
+    :param board: The readiness board of the run
+    :param journal: The journal of the run
+
+    :return: The result of each applied operation
+    """
+    config = config or Config()
+    results = apply_operations(
+        client=client,
+        operations=operations,
+        max_in_flight=config.max_in_flight,
+        cache=get_snapshot_cache(config),
+        board=board,
+        journal=journal,
+    )
+    check_results(results)
+    return results
+
+
+class Feature(BaseModel):
+    name: str
+    # The section of the stack configuration the feature reconciles
+    section: str
+    client: str
+    # Fetches the remote state, named like the feature in RemoteState
+    read: Callable[..., Any]
+    plan: Callable[..., List[Operation]]
+    apply: Callable[..., List[OperationResult]] = apply_feature
+    depends_on: List[str] = Field(default=[])
+    # Features providing objects this feature waits for on the readiness board, they must be running before it starts
+    starts_after: List[str] = Field(default=[])
+    # Whether operations of other features can wait on the readiness board for the objects it creates
+    provides: bool = False
+
+
+FEATURES = [
+    Feature(
+        name="allowlist",
+        section="allowlist",
+        client=ACS_CLIENT,
+        read=read_allowlist,
+        plan=plan_allowlist,
+        apply=apply_allowlist,
+    ),
+    Feature(
+        name="indexes",
+        section="indexes",
+        client=ACS_CLIENT,
+        read=read_indexes,
+        plan=plan_indexes,
+        apply=apply_indexes,
+        provides=True,
+    ),
+    # HEC tokens reference indexes through allowed_indexes and default_index,
+    # each operation waits on the readiness board for the indexes it references
+    Feature(name="hec", section="hec", client=ACS_CLIENT, read=read_hec, plan=plan_hec, starts_after=["indexes"]),
+    Feature(name="saml", section="saml", client=API_CLIENT, read=read_saml, plan=plan_saml, apply=apply_saml),
+    Feature(
+        name="splunkbase_apps",
+        section="splunkbase_apps",
+        client=ACS_CLIENT,
+        read=read_splunkbase_apps,
+        plan=plan_splunkbase_apps,
+        apply=apply_splunkbase_apps,
+    ),
+    # Roles reference indexes through srchIndexesAllowed and srchIndexesDefault, waited for like for HEC tokens
+    Feature(
+        name="roles",
+        section="roles",
+        client=API_CLIENT,
+        read=read_roles,
+        plan=plan_roles,
+        starts_after=["indexes"],
+    ),
+    Feature(
+        name="saml_mapping",
+        section="saml_role_mappings",
+        client=API_CLIENT,
+        read=read_saml_mapping,
+        plan=plan_saml_mapping,
+        depends_on=["roles"],
+    ),
+]
+
+
+def get_fingerprints(stack_config: StackConfiguration, config: Config) -> Dict[str, str]:
+    """
+    Get the fingerprint of the desired configuration of each feature
+
+    :param stack_config: The stack configuration
+    :param config: The global configuration
+
+    :return: The fingerprint of each feature by name
+    """
+    return {feature.name: get_section_fingerprint(stack_config, feature.section, config) for feature in FEATURES}
+
+
+def create_board() -> ReadinessBoard:
+    """
+    Create the readiness board for one run of a stack, with every feature that provides objects to others
+
+    :return: The readiness board
+    """
+    return ReadinessBoard(providers=[feature.name for feature in FEATURES if feature.provides])
+
+
+@contextmanager
+def providing(board: ReadinessBoard, feature: Feature) -> Iterator[None]:
+    """
+    Finish the feature on the board when it ends, so operations waiting for its objects never hang
+
+    :param board: The readiness board of the run
+    :param feature: The running feature
+
+    :return: None
+    """
+    try:
+        yield
+    finally:
+        if feature.provides:
+            board.finish(feature.name)
+
+
+def plan_feature(
+    feature: Feature,
+    stack_config: StackConfiguration,
+    client: Client,
+    config: Config,
+    unchanged: Set[str],
+    state: Union[None, RemoteState] = None,
+) -> List[Operation]:
+    """
+    Compute the operations of a feature, without fetching its remote state if its configuration is unchanged
+
+    :param feature: The feature to plan
+    :param stack_config: The stack configuration to use
+    :param client: The client to use for the requests
+    :param config: The global configuration
+    :param unchanged: The features whose configuration did not change since their last successful apply
+    :param state: The prefetched remote state
+
+    :return: The operations to apply
+    """
+    if feature.name in unchanged:
+        logging.debug("Skipping feature %s as its configuration is unchanged since the last apply", feature.name)
+        return []
+
+    return feature.plan(stack_config=stack_config, client=client, config=config, state=state)
+
+
+def resume_operations(
+    feature: Feature, operations: List[Operation], journal: Union[None, ApplyJournal]
+) -> List[Operation]:
+    """
+    Record the operations of a feature in the journal before they are applied
+    If an unfinished run already started the feature, the operations it applied are left out
+    All other operations are kept, also those the unfinished run did not plan, e.g. as the remote state changed since
+
+    :param feature: The feature to apply
+    :param operations: The planned operations
+    :param journal: The journal of the run
+
+    :return: The operations to apply
+    """
+    if journal is None:
+        return operations
+
+    applied = journal.applied(feature.name)
+    if applied is not None:
+        resumed = [operation for operation in operations if operation.key() not in applied]
+        logging.info(
+            "Resuming feature %s: %d of %d operations are still to be applied",
+            feature.name,
+            len(resumed),
+            len(operations),
+        )
+        operations = resumed
+
+    journal.planned(feature.name, [operation.key() for operation in operations])
+    return operations
+
+
+def get_completed_features(journal: Union[None, ApplyJournal]) -> Set[str]:
+    """
+    Get the features an unfinished run completed for the current configuration
+
+    :param journal: The journal of the run
+
+    :return: The names of the features to skip
+    """
+    if journal is None:
+        return set()
+
+    completed = {feature.name for feature in FEATURES if journal.is_completed(feature.name)}
+    if completed:
+        logging.info("Skipping features %s as an unfinished run already applied them", ", ".join(sorted(completed)))
+
+    return completed
+
+
+def finish_journal(journal: Union[None, ApplyJournal], results: Dict[str, FeatureResult]) -> None:
+    """
+    Mark the run as finished in the journal if every feature succeeded, otherwise it can be resumed
+
+    :param journal: The journal of the run
+    :param results: The result of each feature by name
+
+    :return: None
+    """
+    if journal is not None and all(result.status == FeatureStatus.SUCCEEDED for result in results.values()):
+        journal.finish()
+
+
+def read_stack(
+    stack_config: StackConfiguration,
+    config: Config,
+    acs_client: Client,
+    api_client: Client,
+    unchanged: Set[str] = frozenset(),
+) -> RemoteState:
+    """
+    Fetch the remote state of all features of a stack at the same time, before any feature is planned
+
+    :param stack_config: The stack configuration to use
+    :param config: The global configuration
+    :param acs_client: The client to use for ACS requests
+    :param api_client: The client to use for REST API requests
+    :param unchanged: The features whose state is not needed as their configuration did not change
+
+    :return: The remote state
+    """
+    clients = {ACS_CLIENT: acs_client, API_CLIENT: api_client}
+    readers = {
+        feature.name: lambda feature=feature: feature.read(
+            stack_config=stack_config, client=clients[feature.client], config=config
+        )
+        for feature in FEATURES
+        if feature.name not in unchanged
+    }
+    return prefetch_state(readers, thread_prefix=stack_config.stack_name)
+
+
+def create_clients(stack_config: StackConfiguration, config: Config) -> Tuple[Client, Client]:
+    """
+    Create the ACS and the search head REST API client for a given stack
+
+    :param stack_config: The stack configuration to use
+    :param config: The global configuration
+
+    :return: The ACS client and the REST API client
+    """
+    cassette = get_cassette(config.cassette, config.secret_fingerprints)
+    if cassette is not None and config.cassette.mode == CassetteMode.REPLAY:
+        # Recorded HEC tokens are only restored where they equal the desired ones, the others stay placeholders
+        cassette.add_secrets(token.token for token in iter_objects(stack_config, "hec"))
+
+    acs_client = Client(
+        stack_name=stack_config.stack_name,
+        proxy=config.proxy,
+        is_stage=stack_config.is_stage,
+        acs_url=config.acs_url,
+        max_connections=config.max_connections,
+        rate_limit=config.acs_rate_limit,
+        splunkbase=config.splunkbase,
+        cassette=cassette,
+    )
+    api_client = Client(
+        stack_name=stack_config.stack_name,
+        proxy=config.proxy,
+        is_stage=stack_config.is_stage,
+        is_acs=False,
+        api_url=stack_config.api_url,
+        max_connections=config.max_connections,
+        rate_limit=config.api_rate_limit,
+        cassette=cassette,
+    )
+    return acs_client, api_client
+
+
+def build_tasks(
+    stack_config: StackConfiguration,
+    config: Config,
+    acs_client: Client,
+    api_client: Client,
+    unchanged: Set[str] = frozenset(),
+    state: Union[None, RemoteState] = None,
+    journal: Union[None, ApplyJournal] = None,
+) -> List[FeatureTask]:
+    """
+    Build the feature tasks that plan and directly apply each feature, with their dependencies
+
+    :param stack_config: The stack configuration to use
+    :param config: The global configuration
+    :param acs_client: The client to use for ACS requests
+    :param api_client: The client to use for REST API requests
+    :param unchanged: The features to skip as their configuration did not change
+    :param state: The prefetched remote state
+    :param journal: The journal of the run
+
+    :return: The feature tasks
+    """
+    clients = {ACS_CLIENT: acs_client, API_CLIENT: api_client}
+    board = create_board()
+
+    def run(feature: Feature) -> List[OperationResult]:
+        client = clients[feature.client]
+        with providing(board, feature):
+            operations = plan_feature(
+                feature, stack_config=stack_config, client=client, config=config, unchanged=unchanged, state=state
+            )
+            operations = resume_operations(feature, operations, journal)
+            with get_recorder().timed(stack_name=client.stack_name, feature=feature.name, phase="write"):
+                results = feature.apply(
+                    client=client,
+                    operations=operations,
+                    stack_name=stack_config.stack_name,
+                    config=config,
+                    board=board,
+                    journal=journal,
+                )
+
+        if journal is not None:
+            journal.completed(feature.name)
+        return results
+
+    return [
+        FeatureTask(
+            name=feature.name,
+            run=lambda feature=feature: run(feature),
+            depends_on=feature.depends_on,
+            starts_after=feature.starts_after,
+        )
+        for feature in FEATURES
+    ]
+
+
+def bootstrap_stack(
+    stack_config: StackConfiguration,
+    config: Config,
+    acs_client: Client,
+    api_client: Client,
+    max_workers: int = DEFAULT_WORKERS,
+    gate: Optional[threading.Semaphore] = None,
+    unchanged: Set[str] = frozenset(),
+    journal: Union[None, ApplyJournal] = None,
+) -> Dict[str, FeatureResult]:
+    """
+    Reconcile all features of a given stack
+    The remote state of all features is fetched at once before the first feature is planned
+    Features completed by an unfinished run in the journal are neither fetched nor applied again
+
+    :param stack_config: The stack configuration to use
+    :param config: The global configuration
+    :param acs_client: The client to use for ACS requests
+    :param api_client: The client to use for REST API requests
+    :param max_workers: The maximum number of features running at the same time for this stack
+    :param gate: Optional semaphore shared with other stacks to limit the total number of running features
+    :param unchanged: The features to skip as their configuration did not change
+    :param journal: The journal of the run
+
+    :return: The result of each feature by name
+    """
+    logging.info("Bootstrapping environment: %s", stack_config.stack_name)
+
+    unchanged = set(unchanged) | get_completed_features(journal)
+    if journal is not None:
+        journal.start()
+
+    state = read_stack(
+        stack_config=stack_config, config=config, acs_client=acs_client, api_client=api_client, unchanged=unchanged
+    )
+    tasks = build_tasks(
+        stack_config=stack_config,
+        config=config,
+        acs_client=acs_client,
+        api_client=api_client,
+        unchanged=unchanged,
+        state=state,
+        journal=journal,
+    )
+    results = run_features(tasks, max_workers=max_workers, gate=gate, thread_prefix=stack_config.stack_name)
+    finish_journal(journal, results)
+    return results
+
+
+def plan_stack(
+    stack_config: StackConfiguration,
+    config: Config,
+    acs_client: Client,
+    api_client: Client,
+    max_workers: int = DEFAULT_WORKERS,
+    gate: Optional[threading.Semaphore] = None,
+    unchanged: Set[str] = frozenset(),
+    full: bool = True,
+) -> Tuple[Union[None, StackPlan], Dict[str, FeatureResult]]:
+    """
+    Fetch the remote state of all features at once and compute the operations of each feature
+    Planning only reads, so the features do not wait for each other
+
+    :param stack_config: The stack configuration to use
+    :param config: The global configuration
+    :param acs_client: The client to use for ACS requests
+    :param api_client: The client to use for REST API requests
+    :param max_workers: The maximum number of features planned at the same time for this stack
+    :param gate: Optional semaphore shared with other stacks to limit the total number of running features
+    :param unchanged: The features to leave out of the plan as their configuration did not change
+    :param full: Whether the plan covers all features
+
+    :return: The plan, or None if any feature could not be planned, and the result of each feature by name
+    """
+    logging.info("Planning environment: %s", stack_config.stack_name)
+
+    clients = {ACS_CLIENT: acs_client, API_CLIENT: api_client}
+    created_at = datetime.now(timezone.utc)
+    state = read_stack(
+        stack_config=stack_config, config=config, acs_client=acs_client, api_client=api_client, unchanged=unchanged
+    )
+    tasks = [
+        FeatureTask(
+            name=feature.name,
+            run=lambda feature=feature: plan_feature(
+                feature,
+                stack_config=stack_config,
+                client=clients[feature.client],
+                config=config,
+                unchanged=unchanged,
+                state=state,
+            ),
+        )
+        for feature in FEATURES
+    ]
+
+    results = run_features(tasks, max_workers=max_workers, gate=gate, thread_prefix=stack_config.stack_name)
+    if any(result.status != FeatureStatus.SUCCEEDED for result in results.values()):
+        return None, results
+
+    plan = StackPlan(
+        stack_name=stack_config.stack_name,
+        api_url=stack_config.api_url,
+        is_stage=stack_config.is_stage,
+        created_at=created_at,
+        features=[FeaturePlan(feature=feature.name, operations=results[feature.name].result) for feature in FEATURES],
+        fingerprints=get_fingerprints(stack_config, config),
+        full=full,
+    )
+    return plan, results
+
+
+def apply_stack_plan(
+    plan: StackPlan,
+    config: Config,
+    acs_client: Client,
+    api_client: Client,
+    max_workers: int = DEFAULT_WORKERS,
+    gate: Optional[threading.Semaphore] = None,
+    journal: Union[None, ApplyJournal] = None,
+) -> Dict[str, FeatureResult]:
+    """
+    Apply a plan without fetching the remote state again, respecting the feature dependencies
+    Operations an unfinished run completed according to the journal are not applied again
+
+    :param plan: The plan to apply
+    :param config: The global configuration
+    :param acs_client: The client to use for ACS requests
+    :param api_client: The client to use for REST API requests
+    :param max_workers: The maximum number of features applied at the same time for this stack
+    :param gate: Optional semaphore shared with other stacks to limit the total number of running features
+    :param journal: The journal of the run
+
+    :return: The result of each feature by name
+    """
+    logging.info("Applying plan for environment: %s", plan.stack_name)
+
+    clients = {ACS_CLIENT: acs_client, API_CLIENT: api_client}
+    board = create_board()
+    completed = get_completed_features(journal)
+    if journal is not None:
+        journal.start()
+
+    def run(feature: Feature) -> List[OperationResult]:
+        client = clients[feature.client]
+        with providing(board, feature):
+            if feature.name in completed:
+                return []
+
+            operations = resume_operations(feature, plan.operations_for(feature.name), journal)
+            with get_recorder().timed(stack_name=client.stack_name, feature=feature.name, phase="write"):
+                results = feature.apply(
+                    client=client,
+                    operations=operations,
+                    stack_name=plan.stack_name,
+                    config=config,
+                    board=board,
+                    journal=journal,
+                )
+
+        if journal is not None:
+            journal.completed(feature.name)
+        return results
+
+    tasks = [
+        FeatureTask(
+            name=feature.name,
+            run=lambda feature=feature: run(feature),
+            depends_on=feature.depends_on,
+            starts_after=feature.starts_after,
+        )
+        for feature in FEATURES
+    ]
+
+    results = run_features(tasks, max_workers=max_workers, gate=gate, thread_prefix=plan.stack_name)
+    finish_journal(journal, results)
+    return results
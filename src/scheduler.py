@@ -0,0 +1,217 @@
+import logging
+import threading
+import time
+
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from enum import Enum
+from typing import Any, Callable, Dict, List, Optional
+
+from pydantic import BaseModel, Field
+
+DEFAULT_WORKERS = 4
+
+
+class FeatureStatus(str, Enum):
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    SKIPPED = "skipped"
+
+
+class FeatureTask(BaseModel):
+    name: str
+    run: Callable[[], Any]
+    depends_on: List[str] = Field(default=[])
+    # Features that must be running or finished before this one starts, without waiting for them to succeed
+    starts_after: List[str] = Field(default=[])
+
+
+class FeatureResult(BaseModel):
+    name: str
+    status: FeatureStatus
+    started: float = 0.0
+    finished: float = 0.0
+    error: str = ""
+    result: Any = None
+
+    @property
+    def duration(self) -> float:
+        return self.finished - self.started
+
+
+def topological_order(tasks: List[FeatureTask]) -> List[str]:
+    """
+    Order the tasks so that every task comes after its dependencies and the tasks it starts after
+
+    :param tasks: The tasks to order
+
+    :return: The task names in dependency order
+    """
+    names = {task.name for task in tasks}
+    if len(names) != len(tasks):
+        raise ValueError("Duplicate feature names found")
+
+    for task in tasks:
+        for dependency in task.depends_on + task.starts_after:
+            if dependency not in names:
+                raise ValueError(f"Feature {task.name} depends on unknown feature {dependency}")
+
+    remaining = {task.name: set(task.depends_on + task.starts_after) for task in tasks}
+    order = []
+    while remaining:
+        ready = sorted(name for name, deps in remaining.items() if not deps)
+        if not ready:
+            raise ValueError(f"Dependency cycle between features: {sorted(remaining)}")
+
+        for name in ready:
+            order.append(name)
+            del remaining[name]
+
+        for deps in remaining.values():
+            deps.difference_update(ready)
+
+    return order
+
+
+def critical_path(tasks: List[FeatureTask], results: Dict[str, FeatureResult]) -> List[FeatureResult]:
+    """
+    Get the chain of features that determined the total wall-clock time of the run
+    Starting with the feature that finished last, follow the dependency that released it,
+    including the features it started after as it waits on the readiness board for their objects
+
+    :param tasks: The tasks that were scheduled
+    :param results: The results of the run
+
+    :return: The features on the critical path, first to last
+    """
+    executed = {name: result for name, result in results.items() if result.status != FeatureStatus.SKIPPED}
+    if not executed:
+        return []
+
+    dependencies = {task.name: task.depends_on + task.starts_after for task in tasks}
+    current = max(executed.values(), key=lambda result: result.finished)
+    path = [current]
+
+    while True:
+        gating = [executed[dep] for dep in dependencies[current.name] if dep in executed]
+        if not gating:
+            break
+
+        current = max(gating, key=lambda result: result.finished)
+        path.append(current)
+
+    return list(reversed(path))
+
+
+def _run_task(task: FeatureTask, gate: Optional[threading.Semaphore], running: Future) -> FeatureResult:
+    if gate is not None:
+        gate.acquire()
+
+    # The task holds its worker and gate slot from here on, so tasks starting after it can not starve it
+    running.set_result(True)
+    started = time.monotonic()
+    logging.info("Starting feature %s", task.name)
+
+    try:
+        result = task.run()
+    except Exception as e:
+        logging.exception("Feature %s failed", task.name)
+        return FeatureResult(
+            name=task.name,
+            status=FeatureStatus.FAILED,
+            started=started,
+            finished=time.monotonic(),
+            error=str(e),
+        )
+    finally:
+        if gate is not None:
+            gate.release()
+
+    finished = time.monotonic()
+    logging.info("Finished feature %s in %.2fs", task.name, finished - started)
+    return FeatureResult(
+        name=task.name,
+        status=FeatureStatus.SUCCEEDED,
+        started=started,
+        finished=finished,
+        result=result,
+    )
+
+
+def run_features(
+    tasks: List[FeatureTask],
+    max_workers: int = DEFAULT_WORKERS,
+    gate: Optional[threading.Semaphore] = None,
+    thread_prefix: str = "feature",
+) -> Dict[str, FeatureResult]:
+    """
+    Run the features on a bounded worker pool, respecting their dependencies
+    A feature starts as soon as all of its dependencies succeeded
+    If a dependency failed or was skipped, the feature is skipped
+    A feature with starts_after is only submitted once those features hold a worker and gate slot or finished,
+    so it can wait for their objects without taking the slot they need
+
+    :param tasks: The tasks to run
+    :param max_workers: The maximum number of features running at the same time
+    :param gate: Optional semaphore shared with other runs to limit the total number of running features
+    :param thread_prefix: The prefix for the worker thread names
+
+    :return: The result of each feature by name
+    """
+    if max_workers < 1:
+        raise ValueError("The number of workers must be at least 1")
+
+    order = topological_order(tasks)
+    by_name = {task.name: task for task in tasks}
+    results: Dict[str, FeatureResult] = {}
+    running: Dict[Future, str] = {}
+    started: Dict[str, Future] = {}
+
+    run_started = time.monotonic()
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=thread_prefix) as executor:
+        while len(results) < len(tasks):
+            for name in order:
+                if name in results or name in running.values():
+                    continue
+
+                task = by_name[name]
+                if any(dep not in results for dep in task.depends_on):
+                    continue
+
+                if any(dep not in results and not (dep in started and started[dep].done()) for dep in task.starts_after):
+                    continue
+
+                failed = [dep for dep in task.depends_on if results[dep].status != FeatureStatus.SUCCEEDED]
+                if failed:
+                    logging.warning("Skipping feature %s as its dependencies did not succeed: %s", name, failed)
+                    results[name] = FeatureResult(
+                        name=name,
+                        status=FeatureStatus.SKIPPED,
+                        error=f"Dependencies did not succeed: {', '.join(failed)}",
+                    )
+                    continue
+
+                started[name] = Future()
+                running[executor.submit(_run_task, task, gate, started[name])] = name
+
+            if not running:
+                continue
+
+            # Also wake up when a submitted task starts, as the tasks starting after it can be submitted then
+            starting = [started[name] for name in running.values() if not started[name].done()]
+            done, _ = wait(list(running) + starting, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in running:
+                    name = running.pop(future)
+                    results[name] = future.result()
+
+    path = critical_path(tasks, results)
+    if path:
+        logging.info(
+            "Critical path: %s (%.2fs of %.2fs wall-clock)",
+            " -> ".join(f"{result.name} ({result.duration:.2f}s)" for result in path),
+            path[-1].finished - path[0].started,
+            time.monotonic() - run_started,
+        )
+
+    return results
@@ -0,0 +1,135 @@
+import hashlib
+import hmac
+import json
+import logging
+import os
+import threading
+
+from typing import Any, Dict, Union
+from models import SecretFingerprints
+
+KEY_FILE = "fingerprint.key"
+KEY_SIZE = 32
+
+_LOCK = threading.Lock()
+
+
+def _write_private(path: str, content: bytes, exclusive: bool = False) -> None:
+    """
+    Write a file that is only readable by the owner
+    An exclusive write fails with FileExistsError if the file already exists, otherwise the file is atomically replaced
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+
+    if exclusive:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "wb") as file:
+            file.write(content)
+        return
+
+    temporary_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    fd = os.open(temporary_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as file:
+        file.write(content)
+    os.replace(temporary_path, path)
+
+
+def get_fingerprint_key(config: SecretFingerprints) -> bytes:
+    """
+    Get the key of the secret fingerprints
+    The key is taken from the configured environment variable, so it can be shared between runners,
+    otherwise it is generated once and stored next to the fingerprints
+
+    :param config: The secret fingerprint configuration
+
+    :return: The key
+    """
+    if os.environ.get(config.key_env_var):
+        return os.environ[config.key_env_var].encode()
+
+    path = os.path.join(config.directory, KEY_FILE)
+    with _LOCK:
+        try:
+            _write_private(path, os.urandom(KEY_SIZE).hex().encode(), exclusive=True)
+            logging.info("Generated a new fingerprint key in %s", path)
+        except FileExistsError:
+            pass
+
+        with open(path, "rb") as file:
+            return file.read().strip()
+
+
+def get_secret_fingerprint(content: Dict[str, Any], key: bytes) -> str:
+    """
+    Keyed hash of content that can not be read back from the stack, e.g. because it contains secrets
+    Without the key the stored fingerprint does not allow to guess the secrets
+
+    :param content: The content to hash, must be serializable to JSON
+    :param key: The key of the secret fingerprints
+
+    :return: The fingerprint
+    """
+    encoded = json.dumps(content, sort_keys=True, separators=(",", ":"), default=str)
+    return hmac.new(key, encoded.encode(), hashlib.sha256).hexdigest()
+
+
+def get_fingerprint_path(config: SecretFingerprints, stack_name: str) -> str:
+    """
+    Get the path of the secret fingerprints of a stack
+
+    :param config: The secret fingerprint configuration
+    :param stack_name: The name of the stack
+
+    :return: The path of the fingerprint file
+    """
+    return os.path.join(config.directory, f"{stack_name}.json")
+
+
+def _read_fingerprints(path: str) -> Dict[str, str]:
+    try:
+        with open(path, "r") as file:
+            fingerprints = json.load(file)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as error:
+        logging.warning("Ignoring unreadable fingerprint file %s: %s", path, error)
+        return {}
+
+    return fingerprints if isinstance(fingerprints, dict) else {}
+
+
+def read_secret_fingerprint(config: SecretFingerprints, stack_name: str, feature: str) -> Union[None, str]:
+    """
+    Read the secret fingerprint of a feature recorded by its last successful apply
+
+    :param config: The secret fingerprint configuration
+    :param stack_name: The name of the stack
+    :param feature: The name of the feature
+
+    :return: The fingerprint or None if none was recorded
+    """
+    with _LOCK:
+        return _read_fingerprints(get_fingerprint_path(config, stack_name)).get(feature)
+
+
+def write_secret_fingerprint(config: SecretFingerprints, stack_name: str, feature: str, fingerprint: str) -> None:
+    """
+    Record the secret fingerprint of a feature after it was applied successfully
+
+    :param config: The secret fingerprint configuration
+    :param stack_name: The name of the stack
+    :param feature: The name of the feature
+    :param fingerprint: The fingerprint of the applied content
+
+    :return: None
+    """
+    path = get_fingerprint_path(config, stack_name)
+    with _LOCK:
+        fingerprints = _read_fingerprints(path)
+        fingerprints[feature] = fingerprint
+        try:
+            _write_private(path, json.dumps(fingerprints, indent=2).encode())
+        except OSError as error:
+            logging.warning("Could not record the %s fingerprint in %s: %s", feature, path, error)
@@ -0,0 +1,193 @@
+import csv
+import gzip
+import hashlib
+import json
+import os
+import typing
+import uuid
+
+from pydantic import BaseModel, ValidationError
+from typing import IO, Any, Callable, Dict, Iterator, List, Tuple, Type
+from models import HecToken, Index, ObjectSource, Role, SAMLRoleMapping, SourceFormat, StackConfiguration
+
+# The model of the objects of each section that can be read from files, with the key that must be unique
+SECTIONS: Dict[str, Tuple[Type[BaseModel], Callable[[Any], str]]] = {
+    "hec": (HecToken, lambda token: token.name),
+    "indexes": (Index, lambda index: index.name),
+    "roles": (Role, lambda role: role.name),
+    "saml_role_mappings": (SAMLRoleMapping, lambda mapping: mapping.group),
+}
+
+
+class SourceError(ValueError):
+    """
+    Raised for a file row that is not a valid object of its section
+    """
+
+
+def get_source_format(source: ObjectSource) -> SourceFormat:
+    """
+    Get the format of a source file, from its extension if it is not configured
+
+    :param source: The source
+
+    :return: The format of the file
+    """
+    if source.format is not None:
+        return source.format
+
+    name = source.path[:-3] if source.path.endswith(".gz") else source.path
+    extension = os.path.splitext(name)[1].lstrip(".").lower()
+    if extension in ("jsonl", "ndjson"):
+        return SourceFormat.JSONL
+    if extension == "csv":
+        return SourceFormat.CSV
+
+    raise SourceError(f"{source.path}: Unknown format, set the format of the source")
+
+
+def open_source(path: str) -> IO[str]:
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", newline="")
+
+    return open(path, "r", newline="")
+
+
+def _get_list_fields(model: Type[BaseModel]) -> Dict[str, str]:
+    # CSV columns of list fields by field name and alias
+    columns = {}
+    for name, field in model.model_fields.items():
+        if typing.get_origin(field.annotation) is list:
+            columns[name] = name
+            if field.alias:
+                columns[field.alias] = name
+
+    return columns
+
+
+def _read_rows(source: ObjectSource, file: IO[str], model: Type[BaseModel]) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    if get_source_format(source) == SourceFormat.JSONL:
+        for line_number, line in enumerate(file, start=1):
+            if line.strip():
+                try:
+                    yield line_number, json.loads(line)
+                except ValueError as e:
+                    raise SourceError(f"{source.path}:{line_number}: Invalid JSON: {e}")
+        return
+
+    list_fields = _get_list_fields(model)
+    reader = csv.DictReader(file)
+    for row in reader:
+        # Empty cells take the default of the field, list cells hold the items separated by list_separator
+        values = {}
+        for column, value in row.items():
+            if column is None or value is None or value == "":
+                continue
+            if column in list_fields:
+                values[column] = [item.strip() for item in value.split(source.list_separator) if item.strip()]
+            else:
+                values[column] = value
+
+        yield reader.line_num, values
+
+
+def read_source(source: ObjectSource, model: Type[BaseModel]) -> Iterator[BaseModel]:
+    """
+    Read the objects of a source file one row at a time, so files of any size are read with constant memory
+
+    :param source: The source
+    :param model: The model of the objects
+
+    :return: The validated objects in file order
+    """
+    with open_source(source.path) as file:
+        for line_number, values in _read_rows(source, file, model):
+            try:
+                yield model.model_validate(values)
+            except ValidationError as e:
+                details = "; ".join(
+                    f"{'.'.join(str(part) for part in error['loc']) or 'row'}: {error['msg']}" for error in e.errors()
+                )
+                raise SourceError(f"{source.path}:{line_number}: {details}")
+
+
+def iter_objects(stack_config: StackConfiguration, section: str) -> Iterator[BaseModel]:
+    """
+    Iterate over the objects of a section: those in the environment file, those the templates expand to
+    and those of each source file
+    The keys must be unique across all of them, HEC tokens are verified like in the environment file
+
+    :param stack_config: The stack configuration
+    :param section: The name of the section
+
+    :return: The desired objects of the section
+    """
+    model, key = SECTIONS[section]
+    seen = set()
+    tokens = set()
+
+    def objects() -> Iterator[BaseModel]:
+        yield from getattr(stack_config, section)
+        for template in stack_config.templates:
+            for values in template.expand(section):
+                yield model.model_validate(values)
+        for source in getattr(stack_config.sources, section):
+            yield from read_source(source, model)
+
+    for obj in objects():
+        obj_key = key(obj)
+        if obj_key in seen:
+            raise SourceError(f"Duplicate {section} entry {obj_key} found")
+        seen.add(obj_key)
+
+        if isinstance(obj, HecToken):
+            if obj.token in tokens:
+                raise SourceError(f"Duplicate HEC token found for {obj.name}")
+            try:
+                uuid.UUID(obj.token)
+            except ValueError:
+                raise SourceError(f"Invalid token {obj.token}")
+            tokens.add(obj.token)
+
+        yield obj
+
+
+def resolve_sources(stack_config: StackConfiguration, directory: str) -> None:
+    """
+    Resolve the paths of the source files relative to the directory of the environment file
+    Only the files are checked to exist, their rows are validated when the feature is planned
+
+    :param stack_config: The stack configuration
+    :param directory: The directory of the environment file
+
+    :return: None
+    """
+    for section in SECTIONS:
+        for source in getattr(stack_config.sources, section):
+            source.path = os.path.join(directory, source.path)
+            if not os.path.isfile(source.path):
+                raise ValueError(f"Source file of {section} not found: {source.path}")
+            get_source_format(source)
+
+
+def get_source_digests(stack_config: StackConfiguration, section: str) -> List[str]:
+    """
+    Hash the content of the source files of a section, so a changed file counts as a changed section
+
+    :param stack_config: The stack configuration
+    :param section: The name of the section
+
+    :return: The SHA-256 digest of each source file
+    """
+    if section not in SECTIONS:
+        return []
+
+    digests = []
+    for source in getattr(stack_config.sources, section):
+        digest = hashlib.sha256()
+        with open(source.path, "rb") as file:
+            for chunk in iter(lambda: file.read(1024 * 1024), b""):
+                digest.update(chunk)
+        digests.append(digest.hexdigest())
+
+    return digests
@@ -0,0 +1,185 @@
+import asyncio
+import httpx
+import json
+import logging
+import os
+import threading
+import time
+
+import xml.etree.ElementTree as ET
+from pydantic import BaseModel, ValidationError
+from typing import Dict, Union
+from models import Splunkbase
+
+SESSION_FILE_VERSION = 1
+
+_CACHES: Dict[str, "SessionCache"] = {}
+_CACHES_LOCK = threading.Lock()
+
+
+class SplunkbaseSession(BaseModel):
+    token: str
+    expires_at: float
+
+
+class SessionCache:
+    """
+    Splunkbase sessions by account, shared by all clients of the process and stored on disk between runs
+    """
+
+    def __init__(self, path: str, ttl: float):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._logins: Dict[str, asyncio.Lock] = {}
+        self._sessions = self._read() if ttl > 0 else {}
+
+    def _read(self) -> Dict[str, SplunkbaseSession]:
+        try:
+            with open(self.path, "r") as file:
+                content = json.load(file)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as error:
+            logging.warning("Ignoring unreadable Splunkbase session file %s: %s", self.path, error)
+            return {}
+
+        if content.get("version") != SESSION_FILE_VERSION:
+            return {}
+
+        sessions = {}
+        for account, session in content.get("sessions", {}).items():
+            try:
+                sessions[account] = SplunkbaseSession.model_validate(session)
+            except ValidationError:
+                continue
+
+        return sessions
+
+    def _write(self) -> None:
+        """
+        Replace the session file, which is only readable by the owner as it contains the session tokens
+        Must be called with the lock held
+        """
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+
+        now = time.time()
+        content = {
+            "version": SESSION_FILE_VERSION,
+            "sessions": {
+                account: session.model_dump() for account, session in self._sessions.items() if session.expires_at > now
+            },
+        }
+
+        temporary_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            fd = os.open(temporary_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w") as file:
+                json.dump(content, file)
+            os.replace(temporary_path, self.path)
+        except OSError as error:
+            logging.warning("Could not store Splunkbase sessions in %s: %s", self.path, error)
+
+    def get(self, account: str) -> Union[None, str]:
+        """
+        Get the session token of an account if it has not expired
+
+        :param account: The Splunkbase username
+
+        :return: The session token or None
+        """
+        with self._lock:
+            session = self._sessions.get(account)
+
+        if session is None or session.expires_at <= time.time():
+            return None
+
+        return session.token
+
+    def store(self, account: str, token: str) -> None:
+        """
+        Store the session token of an account until the TTL expires
+
+        :param account: The Splunkbase username
+        :param token: The session token
+
+        :return: None
+        """
+        if self.ttl <= 0:
+            return
+
+        with self._lock:
+            self._sessions[account] = SplunkbaseSession(token=token, expires_at=time.time() + self.ttl)
+            self._write()
+
+    def invalidate(self, account: str, token: str) -> None:
+        """
+        Forget the session token of an account, unless another client already replaced it
+
+        :param account: The Splunkbase username
+        :param token: The session token that was rejected
+
+        :return: None
+        """
+        with self._lock:
+            session = self._sessions.get(account)
+            if session is not None and session.token == token:
+                del self._sessions[account]
+                self._write()
+
+    def login_lock(self, account: str) -> asyncio.Lock:
+        """
+        Get the lock that makes concurrent clients of the same account wait for a single login
+        Must be called on the event loop of the clients
+
+        :param account: The Splunkbase username
+
+        :return: The lock of the account
+        """
+        with self._lock:
+            if account not in self._logins:
+                self._logins[account] = asyncio.Lock()
+
+            return self._logins[account]
+
+
+def get_session_cache(config: Splunkbase) -> SessionCache:
+    """
+    Get the session cache of the process for a given session file
+
+    :param config: The Splunkbase configuration
+
+    :return: The session cache
+    """
+    with _CACHES_LOCK:
+        if config.session_file not in _CACHES:
+            _CACHES[config.session_file] = SessionCache(path=config.session_file, ttl=config.session_ttl)
+
+        return _CACHES[config.session_file]
+
+
+async def login(pool: httpx.AsyncClient, url: str, username: str, password: str) -> str:
+    """
+    Log in to Splunkbase
+
+    :param pool: The connection pool to use for the request
+    :param url: The login URL of Splunkbase
+    :param username: The Splunkbase username
+    :param password: The Splunkbase password
+
+    :return: The session token
+    """
+    response = await pool.post(url, data={"username": username, "password": password})
+    response.raise_for_status()
+
+    namespace = {'atom': 'http://www.w3.org/2005/Atom'}
+    root = ET.fromstring(response.text)
+    id_element = root.find('atom:id', namespace)
+
+    if id_element is None or not id_element.text:
+        raise ValueError("Invalid response from Splunkbase")
+
+    logging.info("Logged in to Splunkbase as %s", username)
+    return id_element.text
@@ -0,0 +1,93 @@
+import asyncio
+import logging
+import random
+import time
+
+from enum import Enum
+from pydantic import BaseModel
+from typing import Awaitable, Callable, Tuple
+from models import Tracking
+
+
+class PollState(str, Enum):
+    PENDING = "pending"
+    READY = "ready"
+    FAILED = "failed"
+
+
+class TrackStatus(str, Enum):
+    READY = "ready"
+    FAILED = "failed"
+    TIMED_OUT = "timed_out"
+
+
+class TrackedOutcome(BaseModel):
+    name: str
+    status: TrackStatus
+    # Seconds from the start of tracking until the final state was observed
+    elapsed: float
+    detail: str = ""
+
+
+# Polls the remote state of one object once and returns its state with a human readable detail
+Check = Callable[[], Awaitable[Tuple[PollState, str]]]
+
+
+def poll_delay(attempt: int, tracking: Tracking) -> float:
+    """
+    Get the delay before the next poll using exponential backoff with a little jitter,
+    so objects that were requested at the same time are not polled in lockstep
+
+    :param attempt: The number of polls so far
+    :param tracking: The tracking configuration
+
+    :return: The delay in seconds
+    """
+    delay = min(tracking.max_delay, tracking.initial_delay * 2**attempt)
+    return delay * random.uniform(0.8, 1.0)
+
+
+async def wait_until_ready(name: str, check: Check, tracking: Tracking) -> TrackedOutcome:
+    """
+    Poll a single object until it is ready or failed, or the deadline passed
+    Used to track each object right after it was requested instead of waiting for a whole batch
+
+    :param name: The name of the object
+    :param check: The status check of the object
+    :param tracking: The tracking configuration
+
+    :return: The outcome of the object
+    """
+    return await _poll(name, check, time.monotonic(), tracking)
+
+
+async def _poll(name: str, check: Check, started: float, tracking: Tracking) -> TrackedOutcome:
+    deadline = started + tracking.deadline
+    detail = ""
+    attempt = 0
+
+    # A freshly requested object is rarely ready at once
+    await asyncio.sleep(tracking.initial_delay)
+    while True:
+        try:
+            state, detail = await check()
+        except Exception as e:
+            # The client already retried transient errors, keep polling until the deadline
+            logging.warning("Failed to poll the status of %s: %s", name, e)
+            state, detail = PollState.PENDING, str(e)
+        attempt += 1
+
+        elapsed = time.monotonic() - started
+        if state == PollState.READY:
+            return TrackedOutcome(name=name, status=TrackStatus.READY, elapsed=elapsed, detail=detail)
+
+        if state == PollState.FAILED:
+            return TrackedOutcome(name=name, status=TrackStatus.FAILED, elapsed=elapsed, detail=detail)
+
+        delay = poll_delay(attempt, tracking)
+        if time.monotonic() + delay > deadline:
+            return TrackedOutcome(name=name, status=TrackStatus.TIMED_OUT, elapsed=elapsed, detail=detail)
+
+        logging.debug("%s is %s, polling again in %.1fs", name, detail or state.value, delay)
+        await asyncio.sleep(delay)
+
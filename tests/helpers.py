@@ -0,0 +1,41 @@
+import os
+import subprocess
+import sys
+import yaml
+
+from typing import Any, List
+from mock_server import MockServer
+from run import ROOT, build_config, build_stack
+
+
+def write_stack(directory: str, name: str, api_url: str, size: int = 5, **changes: Any) -> str:
+    """
+    Write the environment file of a benchmark stack on the mock with a given name
+    """
+    stack = build_stack(size, api_url=f"{api_url}/{name}")
+    stack["stack_name"] = name
+    stack.update(changes)
+    path = os.path.join(directory, f"{name}.yaml")
+    with open(path, "w") as file:
+        yaml.safe_dump(stack, file)
+
+    return path
+
+
+def run_bootstrap(
+    directory: str, server: MockServer, arguments: List[str], stack_names: List[str]
+) -> subprocess.CompletedProcess:
+    """
+    Run bootstrap.py in a child process against the mock
+    """
+    config_file = os.path.join(directory, "config.yaml")
+    with open(config_file, "w") as file:
+        yaml.safe_dump(build_config(server, directory), file)
+
+    env = {**os.environ, "FINGERPRINT_KEY": "test"}
+    for name in stack_names:
+        prefix = name.upper()
+        env.update({f"{prefix}_TOKEN": "token", f"{prefix}_USERNAME": "user", f"{prefix}_PASSWORD": "password"})
+
+    command = [sys.executable, os.path.join(ROOT, "bootstrap.py"), "--config-file", config_file, "--full", *arguments]
+    return subprocess.run(command, env=env, cwd=ROOT, capture_output=True, timeout=120)
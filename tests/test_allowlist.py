@@ -0,0 +1,98 @@
+import asyncio
+import ipaddress
+import pytest
+
+from features.allowlist import collapse_subnets, diff_subnets, get_deployment_check
+from tracker import PollState
+
+
+def networks(*subnets):
+    return [ipaddress.ip_network(subnet) for subnet in subnets]
+
+
+def test_collapse_merges_adjacent_and_drops_duplicate_and_covered_subnets():
+    collapsed = collapse_subnets(networks("10.0.0.128/25", "10.0.0.0/25", "10.0.0.0/25", "10.0.0.7/32", "10.0.1.0/24"))
+
+    assert collapsed == networks("10.0.0.0/23")
+
+
+def test_collapse_keeps_overlapping_versions_apart_and_sorted():
+    collapsed = collapse_subnets(networks("2001:db8::/33", "192.168.0.0/24", "2001:db8:8000::/33", "10.0.0.0/8"))
+
+    assert collapsed == networks("10.0.0.0/8", "192.168.0.0/24", "2001:db8::/32")
+
+
+def test_collapse_of_everything_is_the_default_route():
+    assert collapse_subnets(networks("0.0.0.0/1", "128.0.0.0/1", "10.0.0.0/8")) == networks("0.0.0.0/0")
+    assert collapse_subnets([]) == []
+
+
+def test_diff_keeps_current_subnets_covering_the_desired_addresses():
+    plan = diff_subnets(collapse_subnets(networks("10.0.0.0/24")), networks("10.0.0.0/25", "10.0.0.128/25"))
+
+    assert not plan.has_changes
+    assert plan.unchanged == 2
+
+
+def test_diff_adds_a_desired_subnet_only_partly_covered():
+    plan = diff_subnets(networks("10.0.0.0/24"), networks("10.0.0.0/25", "172.16.0.0/12"))
+
+    assert plan.to_add == networks("10.0.0.0/24")
+    assert plan.to_delete == networks("172.16.0.0/12")
+    assert plan.unchanged == 1
+
+
+def test_diff_with_default_route():
+    everything = networks("0.0.0.0/0")
+
+    plan = diff_subnets(everything, networks("10.0.0.0/8", "192.168.1.1/32"))
+    assert plan.to_add == everything
+    assert plan.to_delete == []
+
+    plan = diff_subnets(networks("10.0.0.0/8"), everything)
+    assert plan.to_add == networks("10.0.0.0/8")
+    assert plan.to_delete == everything
+
+    assert not diff_subnets(everything, everything).has_changes
+
+
+def test_diff_does_not_match_subnets_across_versions():
+    plan = diff_subnets(networks("::/0"), networks("0.0.0.0/0", "2001:db8::/32"))
+
+    assert plan.to_add == networks("::/0")
+    assert plan.to_delete == networks("0.0.0.0/0")
+
+
+def test_diff_of_empty_lists():
+    assert not diff_subnets([], []).has_changes
+    assert diff_subnets([], networks("10.0.0.0/8")).to_delete == networks("10.0.0.0/8")
+
+
+class FakeAsyncClient:
+    def __init__(self, response):
+        self.response = response
+
+    async def get(self, url, headers, params):
+        return 200, self.response
+
+
+class FakeClient:
+    def __init__(self, response):
+        self.async_client = FakeAsyncClient(response)
+
+
+@pytest.mark.parametrize(
+    "response, state",
+    [
+        ({"infrastructure": {"status": "Ready"}}, PollState.READY),
+        ({"infrastructure": {"stackStatus": "Updating"}}, PollState.PENDING),
+        ({"infrastructure": {"status": "Failed"}}, PollState.FAILED),
+        ({"infrastructure": {"status": "Hibernating"}}, PollState.FAILED),
+        ({"infrastructure": {}}, PollState.FAILED),
+        ({"messages": {}}, PollState.FAILED),
+    ],
+)
+def test_deployment_check_fails_on_missing_or_unrecognised_status(response, state):
+    check = get_deployment_check(FakeClient(response), stack_name="stack")
+
+    assert asyncio.run(check())[0] == state
@@ -0,0 +1,38 @@
+import json
+
+from cassette import PLACEHOLDER_PATTERN, get_placeholder, redact_body, restore_body
+
+KEY = b"test"
+TOKEN = "6b1e5b2a-0f5c-4a52-9d1a-3c7f3f1a2b10"
+
+
+def test_redacted_values_get_stable_keyed_placeholders():
+    body = json.dumps({"http-event-collector": [{"token": TOKEN, "spec": {"name": "hec"}}]}).encode()
+    redacted = redact_body(body, "application/json", ["token"], KEY)
+
+    assert TOKEN not in redacted
+    assert redacted == redact_body(body, "application/json", ["token"], KEY)
+    assert get_placeholder(TOKEN, KEY) in redacted
+    assert get_placeholder(TOKEN, b"other") not in redacted
+
+
+def test_restore_replaces_only_known_placeholders():
+    other = get_placeholder("unknown", KEY)
+    recorded = json.dumps({"tokens": [get_placeholder(TOKEN, KEY), other]})
+    restored = json.loads(restore_body(recorded, "application/json", {get_placeholder(TOKEN, KEY): TOKEN}))
+
+    assert restored == {"tokens": [TOKEN, other]}
+
+
+def test_form_and_xml_bodies_are_redacted_and_restored():
+    form = redact_body(b"name=hec&password=secret", "application/x-www-form-urlencoded", ["password"], KEY)
+    assert "secret" not in form
+    assert "name=hec" in form
+
+    xml = b'<feed><s:key name="password">a&lt;b</s:key><id>session</id></feed>'
+    redacted = redact_body(xml, "text/xml", ["password", "id"], KEY)
+    assert "session" not in redacted
+    assert len(PLACEHOLDER_PATTERN.findall(redacted)) == 2
+
+    secrets = {get_placeholder("session", KEY): "session"}
+    assert "<id>session</id>" in restore_body(redacted, "text/xml", secrets)
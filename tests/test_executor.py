@@ -0,0 +1,98 @@
+import asyncio
+import pytest
+
+from executor import Action, Operation, apply_operations
+
+
+class FakeAsyncClient:
+    """
+    Answers every request after a short delay and records the order and the concurrency of the requests
+    """
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.sent = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def request(self, method, url, headers, data=None, as_json=True):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.01)
+            self.sent.append(url)
+            if url in self.failing:
+                raise RuntimeError(f"{url} failed")
+            return 200, {}
+        finally:
+            self.in_flight -= 1
+
+
+class FakeClient:
+    stack_name = "stack"
+
+    def __init__(self, failing=()):
+        self.async_client = FakeAsyncClient(failing)
+
+    def run(self, call):
+        return asyncio.run(call)
+
+
+class FakeJournal:
+    def __init__(self):
+        self.keys = []
+
+    def done(self, key):
+        self.keys.append(key)
+
+
+def operation(action: Action, name: str) -> Operation:
+    return Operation(feature="indexes", kind="index", action=action, name=name, method="POST", url=name)
+
+
+def test_deletes_go_before_adds_and_adds_before_updates():
+    client = FakeClient()
+    operations = [operation(Action.UPDATE, "u1"), operation(Action.ADD, "a1"), operation(Action.DELETE, "d1")]
+    results = apply_operations(client, operations, max_in_flight=4)
+
+    assert client.async_client.sent == ["d1", "a1", "u1"]
+    assert [result.operation.name for result in results] == ["d1", "a1", "u1"]
+
+
+@pytest.mark.parametrize("max_in_flight", [1, 3])
+def test_requests_in_flight_are_bounded(max_in_flight):
+    client = FakeClient()
+    results = apply_operations(client, [operation(Action.ADD, f"a{number}") for number in range(10)], max_in_flight)
+
+    assert all(result.succeeded for result in results)
+    assert client.async_client.max_in_flight == max_in_flight
+
+
+def test_failed_operation_does_not_stop_the_others_and_is_not_journaled():
+    client = FakeClient(failing=["a1"])
+    journal = FakeJournal()
+    operations = [operation(Action.ADD, "a0"), operation(Action.ADD, "a1"), operation(Action.UPDATE, "u0")]
+    results = apply_operations(client, operations, max_in_flight=2, journal=journal)
+
+    assert [result.succeeded for result in results] == [True, False, True]
+    assert "a1 failed" in results[1].error
+    assert journal.keys == ["indexes:add:index:a0", "indexes:update:index:u0"]
+
+
+def test_operation_is_journaled_only_after_its_follow_up_succeeded():
+    journal = FakeJournal()
+
+    async def follow_up(applied, response):
+        if applied.name == "a1":
+            raise RuntimeError("not ready")
+
+    operations = [operation(Action.ADD, "a0"), operation(Action.ADD, "a1")]
+    results = apply_operations(FakeClient(), operations, max_in_flight=2, journal=journal, follow_up=follow_up)
+
+    assert [result.succeeded for result in results] == [True, False]
+    assert journal.keys == ["indexes:add:index:a0"]
+
+
+def test_invalid_limit_is_rejected():
+    with pytest.raises(ValueError):
+        apply_operations(FakeClient(), [], max_in_flight=0)
@@ -0,0 +1,46 @@
+from incremental import get_unchanged_features, record_results
+from models import Config, StackConfiguration
+from runner import get_fingerprints
+from scheduler import FeatureResult, FeatureStatus
+
+SAML = {
+    "name": "idp",
+    "entity_id": "https://stack.example.com",
+    "fqdn": "https://stack.example.com",
+    "cert": "certificate",
+    "sso_url": "https://idp.example.com/sso",
+    "slo_url": "https://idp.example.com/slo",
+    "script_args": [{"name": "client_secret", "env_var": "TEST_SAML_SECRET"}],
+}
+
+
+def config(tmp_path) -> Config:
+    return Config.model_validate(
+        {
+            "incremental": {"enabled": True, "directory": str(tmp_path / "records")},
+            "secret_fingerprints": {"directory": str(tmp_path / "fingerprints"), "key_env_var": "TEST_FINGERPRINT_KEY"},
+        }
+    )
+
+
+def apply_all(stack_config: StackConfiguration, config: Config) -> None:
+    fingerprints = get_fingerprints(stack_config, config)
+    results = {name: FeatureResult(name=name, status=FeatureStatus.SUCCEEDED) for name in fingerprints}
+    record_results(stack_config.stack_name, fingerprints, results, config, full=True)
+
+
+def test_rotated_secret_script_argument_changes_the_saml_section(tmp_path, monkeypatch):
+    monkeypatch.setenv("TEST_FINGERPRINT_KEY", "key")
+    monkeypatch.setenv("TEST_SAML_SECRET", "first")
+    stack_config = StackConfiguration(stack_name="stack", api_url="https://stack", saml=SAML)
+    global_config = config(tmp_path)
+    apply_all(stack_config, global_config)
+
+    unchanged, full = get_unchanged_features("stack", get_fingerprints(stack_config, global_config), global_config)
+    assert not full
+    assert "saml" in unchanged
+
+    monkeypatch.setenv("TEST_SAML_SECRET", "rotated")
+    unchanged, _ = get_unchanged_features("stack", get_fingerprints(stack_config, global_config), global_config)
+    assert "saml" not in unchanged
+    assert {"indexes", "hec", "roles"} <= unchanged
@@ -0,0 +1,105 @@
+from executor import Action, Operation
+from journal import ApplyJournal, read_journal
+from models import Journal
+from runner import FEATURES, resume_operations
+
+INDEXES = next(feature for feature in FEATURES if feature.name == "indexes")
+FINGERPRINTS = {"indexes": "a"}
+
+
+def operation(name: str) -> Operation:
+    return Operation(
+        feature="indexes", kind="index", action=Action.ADD, name=name, method="POST", url="stack/adminconfig/v2/indexes"
+    )
+
+
+def open_journal(path, resume: bool, fingerprints=FINGERPRINTS) -> ApplyJournal:
+    journal = ApplyJournal(str(path), fingerprints, Journal(directory=str(path.parent)), resume=resume)
+    journal.start()
+    return journal
+
+
+def interrupted_run(path, planned, done):
+    journal = open_journal(path, resume=False)
+    resume_operations(INDEXES, [operation(name) for name in planned], journal)
+    for name in done:
+        journal.done(operation(name).key())
+    journal.close()
+
+
+def names(operations):
+    return [operation.name for operation in operations]
+
+
+def test_feature_not_started_is_applied_in_full(tmp_path):
+    path = tmp_path / "stack.jsonl"
+    open_journal(path, resume=False).close()
+
+    journal = open_journal(path, resume=True)
+    assert journal.applied("indexes") is None
+    assert names(resume_operations(INDEXES, [operation("a")], journal)) == ["a"]
+
+
+def test_all_operations_done_without_completion_are_not_applied_again(tmp_path):
+    path = tmp_path / "stack.jsonl"
+    interrupted_run(path, planned=["a", "b"], done=["a", "b"])
+
+    journal = open_journal(path, resume=True)
+    assert not journal.is_completed("indexes")
+    assert resume_operations(INDEXES, [operation("a"), operation("b")], journal) == []
+
+
+def test_operations_planned_since_the_interruption_are_kept(tmp_path):
+    path = tmp_path / "stack.jsonl"
+    interrupted_run(path, planned=["a", "b"], done=["a"])
+
+    journal = open_journal(path, resume=True)
+    assert names(resume_operations(INDEXES, [operation("a"), operation("b"), operation("c")], journal)) == ["b", "c"]
+
+
+def test_resumed_runs_accumulate_until_a_run_finishes(tmp_path):
+    path = tmp_path / "stack.jsonl"
+    interrupted_run(path, planned=["a", "b", "c"], done=["a"])
+
+    journal = open_journal(path, resume=True)
+    operations = resume_operations(INDEXES, [operation("b"), operation("c")], journal)
+    journal.done(operations[0].key())
+    journal.close()
+
+    journal = open_journal(path, resume=True)
+    assert journal.applied("indexes") == {operation("a").key(), operation("b").key()}
+    journal.completed("indexes")
+    journal.finish()
+    journal.close()
+
+    journal = open_journal(path, resume=True)
+    assert journal.applied("indexes") is None
+    assert not journal.is_completed("indexes")
+
+
+def test_work_for_a_different_configuration_is_not_resumed(tmp_path):
+    path = tmp_path / "stack.jsonl"
+    interrupted_run(path, planned=["a"], done=["a"])
+
+    journal = open_journal(path, resume=True, fingerprints={"indexes": "b"})
+    assert journal.applied("indexes") is None
+    assert names(resume_operations(INDEXES, [operation("a")], journal)) == ["a"]
+
+
+def test_partially_written_entries_are_ignored(tmp_path):
+    path = tmp_path / "stack.jsonl"
+    interrupted_run(path, planned=["a", "b"], done=["a"])
+    with open(path, "a") as file:
+        file.write('{"type":"done","operation":"indexes:add:index:b"')
+
+    state = read_journal(str(path))
+    assert state.done == {operation("a").key()}
+    assert state.planned["indexes"] == {operation("a").key(), operation("b").key()}
+
+
+def test_journal_without_resume_starts_from_scratch(tmp_path):
+    path = tmp_path / "stack.jsonl"
+    interrupted_run(path, planned=["a"], done=["a"])
+
+    open_journal(path, resume=False).close()
+    assert read_journal(str(path)).planned == {}
@@ -0,0 +1,65 @@
+import asyncio
+import pytest
+
+from pagination import fetch_all_pages_async
+
+
+class FakeCollection:
+    """
+    Collection endpoint returning count items from offset, optionally with the total
+    """
+
+    def __init__(self, size: int, with_total: bool, failing_offset: int = -1):
+        self.size = size
+        self.with_total = with_total
+        self.failing_offset = failing_offset
+        self.offsets = []
+
+    async def get(self, url, headers, params):
+        offset, count = params["offset"], params["count"]
+        self.offsets.append(offset)
+        if offset == self.failing_offset:
+            raise RuntimeError(f"page at {offset} failed")
+
+        response = {"items": list(range(offset, min(offset + count, self.size)))}
+        if self.with_total:
+            response["total"] = self.size
+        return 200, response
+
+
+def fetch(collection: FakeCollection, page_size: int = 10, concurrency: int = 3):
+    return asyncio.run(
+        fetch_all_pages_async(
+            client=collection,
+            url="collection",
+            items=lambda response: response["items"],
+            page_size=page_size,
+            concurrency=concurrency,
+            total=(lambda response: response.get("total")) if collection.with_total else None,
+        )
+    )
+
+
+@pytest.mark.parametrize("with_total", [True, False])
+@pytest.mark.parametrize("size", [0, 5, 10, 25, 30, 95])
+def test_all_items_are_fetched_in_order(size, with_total):
+    assert fetch(FakeCollection(size, with_total)) == list(range(size))
+
+
+def test_known_total_requests_each_page_once():
+    collection = FakeCollection(95, with_total=True)
+    fetch(collection)
+
+    assert sorted(collection.offsets) == list(range(0, 100, 10))
+
+
+def test_unknown_total_stops_at_the_window_with_a_short_page():
+    collection = FakeCollection(25, with_total=False)
+    fetch(collection, concurrency=3)
+
+    assert sorted(collection.offsets) == [0, 10, 20, 30]
+
+
+def test_failed_page_fails_the_fetch():
+    with pytest.raises(RuntimeError, match="page at 20 failed"):
+        fetch(FakeCollection(95, with_total=True, failing_offset=20))
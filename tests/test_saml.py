@@ -0,0 +1,16 @@
+from helpers import run_bootstrap, write_stack
+from mock_server import MockServer, MockSettings
+
+
+def test_unchanged_saml_plans_no_operations(tmp_path):
+    directory = str(tmp_path)
+    with MockServer(MockSettings()) as server:
+        env_file = write_stack(directory, "bench", server.url, size=2)
+        assert run_bootstrap(directory, server, ["--env-file", env_file], ["bench"]).returncode == 0
+        # The remote reports its own identity for the provider instead of the configured name
+        server.mock.stack("bench").saml["name"] = "saml"
+
+        plan_dir = str(tmp_path / "plans")
+        process = run_bootstrap(directory, server, ["plan", "--env-file", env_file, "--plan-dir", plan_dir], ["bench"])
+        assert process.returncode == 0, process.stderr.decode()[-2000:]
+        assert "Plan for bench saml: 0 to add, 0 to update" in process.stderr.decode()
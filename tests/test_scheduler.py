@@ -0,0 +1,134 @@
+import threading
+import time
+import pytest
+
+from helpers import run_bootstrap, write_stack
+from mock_server import MockServer, MockSettings
+from run import STACK_NAME
+from scheduler import FeatureResult, FeatureStatus, FeatureTask, critical_path, run_features, topological_order
+
+TIMEOUT = 10
+
+
+def provider_and_consumers(log):
+    # Mirrors indexes, hec and roles: the consumers block until the provider released its objects
+    released = threading.Event()
+
+    def provide():
+        log.append("indexes")
+        time.sleep(0.05)
+        released.set()
+
+    def consume(name):
+        if not released.wait(TIMEOUT):
+            raise TimeoutError(f"{name} waited for indexes")
+        log.append(name)
+
+    return [
+        FeatureTask(name="allowlist", run=lambda: log.append("allowlist")),
+        FeatureTask(name="hec", run=lambda: consume("hec"), starts_after=["indexes"]),
+        FeatureTask(name="indexes", run=provide),
+        FeatureTask(name="roles", run=lambda: consume("roles"), starts_after=["indexes"]),
+        FeatureTask(name="saml_mapping", run=lambda: log.append("saml_mapping"), depends_on=["roles"]),
+    ]
+
+
+def test_critical_path_follows_the_features_a_task_started_after():
+    tasks = provider_and_consumers([])
+    timings = {"allowlist": (0, 1), "indexes": (0, 3), "hec": (0.1, 4), "roles": (0.1, 3.5), "saml_mapping": (3.5, 5)}
+    results = {
+        name: FeatureResult(name=name, status=FeatureStatus.SUCCEEDED, started=started, finished=finished)
+        for name, (started, finished) in timings.items()
+    }
+
+    assert [result.name for result in critical_path(tasks, results)] == ["indexes", "roles", "saml_mapping"]
+
+
+def test_topological_order_puts_providers_first():
+    order = topological_order(provider_and_consumers([]))
+
+    assert order.index("indexes") < order.index("hec")
+    assert order.index("indexes") < order.index("roles")
+    assert order.index("roles") < order.index("saml_mapping")
+
+
+def test_topological_order_rejects_unknown_and_cyclic_features():
+    with pytest.raises(ValueError, match="unknown feature"):
+        topological_order([FeatureTask(name="hec", run=lambda: None, starts_after=["indexes"])])
+
+    with pytest.raises(ValueError, match="cycle"):
+        topological_order(
+            [
+                FeatureTask(name="a", run=lambda: None, depends_on=["b"]),
+                FeatureTask(name="b", run=lambda: None, starts_after=["a"]),
+            ]
+        )
+
+
+def test_single_worker_runs_providers_before_their_consumers():
+    log = []
+    results = run_features(provider_and_consumers(log), max_workers=1)
+
+    assert all(result.status == FeatureStatus.SUCCEEDED for result in results.values())
+    assert log.index("indexes") < log.index("hec")
+    assert log.index("indexes") < log.index("roles")
+
+
+def test_shared_gate_is_not_held_by_waiting_consumers():
+    gate = threading.BoundedSemaphore(1)
+    logs = [[], [], []]
+    results = []
+
+    def run_stack(log):
+        results.append(run_features(provider_and_consumers(log), max_workers=4, gate=gate))
+
+    threads = [threading.Thread(target=run_stack, args=(log,)) for log in logs]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(TIMEOUT * 2)
+
+    assert len(results) == 3
+    for stack_results in results:
+        assert all(result.status == FeatureStatus.SUCCEEDED for result in stack_results.values())
+
+
+def test_failed_provider_still_releases_its_consumers():
+    def fail():
+        raise RuntimeError("indexes failed")
+
+    tasks = [
+        FeatureTask(name="indexes", run=fail),
+        FeatureTask(name="hec", run=lambda: None, starts_after=["indexes"]),
+    ]
+    results = run_features(tasks, max_workers=1)
+
+    assert results["indexes"].status == FeatureStatus.FAILED
+    assert results["hec"].status == FeatureStatus.SUCCEEDED
+
+
+def test_bootstrap_with_one_worker_creates_indexes_before_tokens_and_roles(tmp_path):
+    with MockServer(MockSettings(index_ready_delay=0.2)) as server:
+        env_file = write_stack(str(tmp_path), STACK_NAME, server.url)
+        process = run_bootstrap(str(tmp_path), server, ["--env-file", env_file, "--workers", "1"], [STACK_NAME])
+
+        assert process.returncode == 0, process.stderr.decode()[-2000:]
+        stack = server.mock.stack(STACK_NAME)
+        assert {"bench-00000", "bench-00004"} <= set(stack.indexes)
+        assert len(stack.hec) == 5
+
+
+def test_fleet_with_one_feature_slot_does_not_deadlock(tmp_path):
+    with MockServer(MockSettings(index_ready_delay=0.2)) as server:
+        fleet = tmp_path / "fleet"
+        fleet.mkdir()
+        names = ["bench", "other"]
+        for name in names:
+            write_stack(str(fleet), name, server.url)
+
+        arguments = ["--fleet", str(fleet), "--workers", "4", "--max-features", "1"]
+        process = run_bootstrap(str(tmp_path), server, arguments, names)
+
+        assert process.returncode == 0, process.stderr.decode()[-2000:]
+        for name in names:
+            assert len(server.mock.stack(name).hec) == 5
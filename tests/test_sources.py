@@ -0,0 +1,90 @@
+import gzip
+import pytest
+
+from models import StackConfiguration
+from sources import SourceError, get_source_digests, iter_objects, resolve_sources
+
+TOKEN = "6b1e5b2a-0f5c-4a52-9d1a-3c7f3f1a2b10"
+
+
+def stack(tmp_path, sources, **sections):
+    stack_config = StackConfiguration(stack_name="stack", api_url="https://stack", sources=sources, **sections)
+    resolve_sources(stack_config, str(tmp_path))
+    return stack_config
+
+
+def test_csv_rows_with_lists_and_defaults(tmp_path):
+    (tmp_path / "roles.csv").write_text(
+        "name,capabilities,search_indexes_allowed,search_job_quota\n"
+        "reader,search; list_inputs,,5\n"
+        "writer,,main|summary,\n"
+    )
+    stack_config = stack(tmp_path, {"roles": ["roles.csv"]})
+
+    roles = list(iter_objects(stack_config, "roles"))
+    assert [role.name for role in roles] == ["reader", "writer"]
+    assert roles[0].capabilities == ["search", "list_inputs"]
+    assert roles[0].search_indexes_allowed == []
+    assert roles[0].search_job_quota == 5
+    assert roles[1].search_indexes_allowed == ["main|summary"]
+    assert roles[1].search_job_quota == 100
+
+
+def test_csv_list_separator(tmp_path):
+    (tmp_path / "roles.txt").write_text("name,search_indexes_allowed\nwriter,main|summary\n")
+    stack_config = stack(tmp_path, {"roles": [{"path": "roles.txt", "format": "csv", "list_separator": "|"}]})
+
+    assert [role.search_indexes_allowed for role in iter_objects(stack_config, "roles")] == [["main", "summary"]]
+
+
+def test_invalid_csv_row_reports_its_line(tmp_path):
+    (tmp_path / "indexes.csv").write_text("name,days_searchable\nfirst,30\nsecond,never\n")
+    stack_config = stack(tmp_path, {"indexes": ["indexes.csv"]})
+
+    with pytest.raises(SourceError, match=r"indexes\.csv:3: days_searchable: "):
+        list(iter_objects(stack_config, "indexes"))
+
+
+def test_jsonl_reports_invalid_json_and_invalid_objects_with_their_line(tmp_path):
+    (tmp_path / "broken.jsonl").write_text('{"name": "first"}\n\n{"name": \n')
+    (tmp_path / "invalid.jsonl").write_text('{"name": "first"}\n\n{"name": "second", "unknown": 1}\n')
+
+    with pytest.raises(SourceError, match=r"broken\.jsonl:3: Invalid JSON"):
+        list(iter_objects(stack(tmp_path, {"indexes": ["broken.jsonl"]}), "indexes"))
+
+    with pytest.raises(SourceError, match=r"invalid\.jsonl:3: unknown: Extra inputs"):
+        list(iter_objects(stack(tmp_path, {"indexes": ["invalid.jsonl"]}), "indexes"))
+
+
+def test_compressed_jsonl_follows_the_inline_objects(tmp_path):
+    with gzip.open(tmp_path / "hec.jsonl.gz", "wt") as file:
+        file.write(f'{{"name": "from-file", "token": "{TOKEN}"}}\n')
+    inline = {"name": "inline", "token": "0d8a7f5e-52c4-4f0e-b1a3-9e2c6d4b7a21"}
+    stack_config = stack(tmp_path, {"hec": ["hec.jsonl.gz"]}, hec=[inline])
+
+    assert [token.name for token in iter_objects(stack_config, "hec")] == ["inline", "from-file"]
+    assert len(get_source_digests(stack_config, "hec")) == 1
+
+
+def test_duplicates_and_invalid_tokens_across_sources(tmp_path):
+    (tmp_path / "indexes.jsonl").write_text('{"name": "main2"}\n')
+    (tmp_path / "hec.jsonl").write_text(f'{{"name": "a", "token": "{TOKEN}"}}\n{{"name": "b", "token": "{TOKEN}"}}\n')
+    (tmp_path / "bad.jsonl").write_text('{"name": "a", "token": "not-a-uuid"}\n')
+
+    with pytest.raises(SourceError, match="Duplicate indexes entry main2"):
+        list(iter_objects(stack(tmp_path, {"indexes": ["indexes.jsonl"]}, indexes=[{"name": "main2"}]), "indexes"))
+
+    with pytest.raises(SourceError, match="Duplicate HEC token found for b"):
+        list(iter_objects(stack(tmp_path, {"hec": ["hec.jsonl"]}), "hec"))
+
+    with pytest.raises(SourceError, match="Invalid token not-a-uuid"):
+        list(iter_objects(stack(tmp_path, {"hec": ["bad.jsonl"]}), "hec"))
+
+
+def test_missing_file_and_unknown_format_fail_when_loaded(tmp_path):
+    with pytest.raises(ValueError, match="not found"):
+        stack(tmp_path, {"indexes": ["missing.csv"]})
+
+    (tmp_path / "indexes.xlsx").write_text("")
+    with pytest.raises(SourceError, match="Unknown format"):
+        stack(tmp_path, {"indexes": ["indexes.xlsx"]})
@@ -0,0 +1,42 @@
+import json
+import os
+import stat
+import time
+
+from splunkbase import SessionCache
+
+
+def test_sessions_are_shared_between_runs_through_a_private_file(tmp_path):
+    path = str(tmp_path / "sessions.json")
+    SessionCache(path, ttl=60).store("user", "token")
+
+    assert SessionCache(path, ttl=60).get("user") == "token"
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+
+
+def test_expired_sessions_are_not_used(tmp_path):
+    path = tmp_path / "sessions.json"
+    path.write_text(json.dumps({"version": 1, "sessions": {"user": {"token": "old", "expires_at": time.time() - 1}}}))
+
+    assert SessionCache(str(path), ttl=60).get("user") is None
+
+
+def test_invalidate_keeps_a_session_another_client_already_replaced(tmp_path):
+    cache = SessionCache(str(tmp_path / "sessions.json"), ttl=60)
+    cache.store("user", "new")
+
+    cache.invalidate("user", "old")
+    assert cache.get("user") == "new"
+
+    cache.invalidate("user", "new")
+    assert cache.get("user") is None
+    assert SessionCache(cache.path, ttl=60).get("user") is None
+
+
+def test_disabled_cache_and_unreadable_files(tmp_path):
+    path = tmp_path / "sessions.json"
+    SessionCache(str(path), ttl=0).store("user", "token")
+    assert not path.exists()
+
+    path.write_text("not json")
+    assert SessionCache(str(path), ttl=60).get("user") is None
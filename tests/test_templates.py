@@ -0,0 +1,98 @@
+import pytest
+
+from pydantic import ValidationError
+from incremental import get_section_fingerprint
+from models import Config, StackConfiguration, get_placeholders, substitute
+from sources import iter_objects
+
+CONFIG = Config()
+TOKENS = ["6b1e5b2a-0f5c-4a52-9d1a-3c7f3f1a2b10", "0d8a7f5e-52c4-4f0e-b1a3-9e2c6d4b7a21"]
+
+
+def stack(**sections) -> StackConfiguration:
+    return StackConfiguration(stack_name="stack", api_url="https://stack", **sections)
+
+
+def template(**sections):
+    values = [{"unit": "finance", "token": TOKENS[0]}, {"unit": "sales", "token": TOKENS[1]}]
+    return {"values": values, **sections}
+
+
+def test_substitute_braced_and_plain_placeholders_and_escaped_dollars():
+    values = {"unit": "finance"}
+
+    assert substitute("${unit}-events", values) == "finance-events"
+    assert substitute("$unit", values) == "finance"
+    assert substitute("price=$$5 {literal}", values) == "price=$5 {literal}"
+    assert substitute({"list": ["${unit}", 5], "flag": True}, values) == {"list": ["finance", 5], "flag": True}
+    assert get_placeholders({"a": ["${unit}", "$other", "$$escaped"]}) == {"unit", "other"}
+
+
+def test_templates_expand_per_entry_between_inline_objects_and_sources():
+    stack_config = stack(
+        indexes=[{"name": "shared"}],
+        templates=[template(indexes=[{"name": "${unit}-events", "days_searchable": "90"}, {"name": "${unit}-metrics"}])],
+    )
+
+    indexes = list(iter_objects(stack_config, "indexes"))
+    assert [index.name for index in indexes] == [
+        "shared",
+        "finance-events",
+        "finance-metrics",
+        "sales-events",
+        "sales-metrics",
+    ]
+    assert indexes[1].days_searchable == 90
+
+
+def test_hec_tokens_and_roles_from_templates():
+    hec = {"name": "${unit}-hec", "token": "${token}", "default_index": "${unit}-events"}
+    role = {"name": "${unit}-user", "search_indexes_allowed": ["${unit}-events"], "search_filter": "source=$$x"}
+    stack_config = stack(templates=[template(hec=[hec], roles=[role])])
+
+    assert [token.token for token in iter_objects(stack_config, "hec")] == TOKENS
+    roles = list(iter_objects(stack_config, "roles"))
+    assert roles[1].search_indexes_allowed == ["sales-events"]
+    assert roles[1].search_filter == "source=$x"
+
+
+def test_missing_and_invalid_placeholders_fail_when_loaded():
+    with pytest.raises(ValidationError, match="uses region, missing in entry 1"):
+        stack(templates=[template(indexes=[{"name": "${unit}-${region}"}])])
+
+    with pytest.raises(ValidationError, match="Invalid placeholder"):
+        stack(templates=[template(indexes=[{"name": "${unit}-$"}])])
+
+    with pytest.raises(ValidationError, match="days_searchable"):
+        stack(templates=[template(indexes=[{"name": "${unit}", "days_searchable": "never"}])])
+
+    later = {"values": [{"unit": "finance", "days": "90"}, {"unit": "sales", "days": "never"}]}
+    with pytest.raises(ValidationError, match="invalid for entry 2"):
+        stack(templates=[{**later, "indexes": [{"name": "${unit}", "days_searchable": "${days}"}]}])
+
+
+def test_duplicate_checks_cover_expanded_names_and_tokens():
+    with pytest.raises(ValidationError, match="Duplicate index names found"):
+        stack(indexes=[{"name": "sales-events"}], templates=[template(indexes=[{"name": "${unit}-events"}])])
+
+    with pytest.raises(ValidationError, match="Duplicate index names found"):
+        stack(templates=[template(indexes=[{"name": "fixed"}])])
+
+    with pytest.raises(ValidationError, match="Duplicate HEC tokens found"):
+        stack(templates=[template(hec=[{"name": "${unit}-hec", "token": TOKENS[0]}])])
+
+    with pytest.raises(ValidationError, match="Invalid token"):
+        stack(templates=[template(hec=[{"name": "${unit}-hec", "token": "${unit}"}])])
+
+    with pytest.raises(ValidationError, match="Duplicate group names found"):
+        stack(templates=[template(saml_role_mappings=[{"group": "admins", "roles": ["${unit}-user"]}])])
+
+
+def test_template_changes_change_only_the_fingerprints_of_their_sections():
+    before = stack(templates=[template(indexes=[{"name": "${unit}-events"}])])
+    changed = template(indexes=[{"name": "${unit}-events"}])
+    changed["values"][1]["unit"] = "marketing"
+    after = stack(templates=[changed])
+
+    assert get_section_fingerprint(before, "indexes", CONFIG) != get_section_fingerprint(after, "indexes", CONFIG)
+    assert get_section_fingerprint(before, "roles", CONFIG) == get_section_fingerprint(after, "roles", CONFIG)
@@ -0,0 +1,68 @@
+from client import convert_to_form_data
+from features.hec import plan_hec
+from features.role import plan_roles
+from helpers import run_bootstrap, write_stack
+from mock_server import MockServer, MockSettings
+from models import HecToken, Role, StackConfiguration
+from prefetch import RemoteState
+
+TOKEN = "6b1e5b2a-0f5c-4a52-9d1a-3c7f3f1a2b10"
+
+
+class FakeClient:
+    stack_name = "stack"
+
+
+def test_delta_holds_only_the_changed_fields():
+    current = Role(name="reader", capabilities=["search"], search_filter="index=a", search_job_quota=3)
+    desired = Role(name="reader", capabilities=["search"], search_filter="index=b", search_job_quota=3)
+
+    assert desired.to_update_delta(current) == ({"srchFilter": "index=b"}, {"srchFilter": "index=a"})
+
+
+def test_delta_ignores_list_order():
+    current = HecToken(name="hec", token=TOKEN, allowed_indexes=["a", "b"])
+    desired = HecToken(name="hec", token=TOKEN, allowed_indexes=["b", "a"])
+
+    assert desired.to_update_delta(current) == ({}, {})
+
+
+def test_change_outside_the_payload_plans_no_update():
+    current = HecToken(name="hec", token=TOKEN)
+    desired = HecToken(name="hec", token="0f3c9a52-8e1d-4b7a-a6c2-5d9e8f7a6b10")
+    state = RemoteState(hec=[current], fetched={"hec"})
+    stack_config = StackConfiguration(stack_name="stack", api_url="https://stack", hec=[desired])
+
+    assert desired.to_update_delta(current) == ({}, {})
+    assert plan_hec(stack_config, FakeClient(), state=state) == []
+
+
+def test_cleared_list_field_is_sent_as_empty_form_value():
+    current = Role(name="reader", search_indexes_allowed=["a", "b"], search_indexes_default=["a"])
+    desired = Role(name="reader", search_indexes_default=["a"])
+    state = RemoteState(roles=[current], fetched={"roles"})
+    stack_config = StackConfiguration(stack_name="stack", api_url="https://stack", roles=[desired])
+
+    assert desired.to_update_delta(current) == ({"srchIndexesAllowed": []}, {"srchIndexesAllowed": ["a", "b"]})
+    [operation] = plan_roles(stack_config, FakeClient(), state=state)
+    assert operation.data == {"srchIndexesAllowed": [""]}
+    assert convert_to_form_data(operation.data) == [("srchIndexesAllowed", "")]
+    assert convert_to_form_data({"capabilities": []}) == []
+
+
+def test_cleared_role_list_converges_on_the_mock(tmp_path):
+    directory = str(tmp_path)
+    with MockServer(MockSettings()) as server:
+        env_file = write_stack(directory, "bench", server.url, size=2)
+        assert run_bootstrap(directory, server, ["--env-file", env_file], ["bench"]).returncode == 0
+
+        roles = [{"name": "role-00000", "search_indexes_allowed": [], "search_indexes_default": ["bench-00000"]}]
+        env_file = write_stack(directory, "bench", server.url, size=2, roles=roles, saml_role_mappings=[])
+        process = run_bootstrap(directory, server, ["--env-file", env_file], ["bench"])
+        assert process.returncode == 0, process.stderr.decode()[-2000:]
+        assert server.mock.stack("bench").roles["role-00000"]["srchIndexesAllowed"] == []
+
+        plan_dir = str(tmp_path / "plans")
+        process = run_bootstrap(directory, server, ["plan", "--env-file", env_file, "--plan-dir", plan_dir], ["bench"])
+        assert process.returncode == 0, process.stderr.decode()[-2000:]
+        assert "Plan for bench roles: 0 to add, 0 to update" in process.stderr.decode()